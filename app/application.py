@@ -1,71 +1,98 @@
-import nest_asyncio
-nest_asyncio.apply()
-
-from flask import Flask, render_template, request, session, redirect, url_for, flash
-from app.components.retriver import create_qa_chain
-from app.components.data_loader import process_and_store_pdfs
+from flask import Flask, render_template, request, session, redirect, url_for, flash, jsonify, Response, stream_with_context, g
+from flask.sessions import SessionInterface
+from app.components.chain_registry import get_qa_chain
+from app.components.answer_cache import get_answer_cache
+from app.components.coalescer import answer_once
+from app.components.answer_stream import chain_parts, stream_answer
+from app.components.batch_qa import iter_answers, answer_questions, parse_questions
+from app.components.ingestion_jobs import get_ingestion_queue
+from app.components.warmup import warm_up
+from app.components.session_store import get_session_store
+from app.components.collections import get_collection, list_collections
 from dotenv import load_dotenv
 from werkzeug.utils import secure_filename
 import os
 from app.common.logger import get_logger
-from app.components.mongodata import insert_document
+from app.common import metrics
+from app.common.metrics import span
+from app.components.mongodata import log_retrieval_source
+from app.web_common import (ALLOWED_EXTENSIONS, ServerSessionMixin, add_chat_messages,
+                            allowed_file, chat_history, clear_chat_history, format_source_info,
+                            list_uploaded_files, nl2br, searched_collections, secret_key, session_collection,
+                            sse, target_collection)
 from app.config.config import *
 import json
+import time
+from uuid import uuid4
 
 logger = get_logger(__name__)
 
 load_dotenv()
 HF_TOKEN = os.environ.get("HF_TOKEN")
 
+class ServerSessionInterface(ServerSessionMixin, SessionInterface):
+    """Sessions and chat history in the session store, with only the session ID in the cookie."""
+
+    def open_session(self, app, request):
+        return self._open(app, request)
+
+    def save_session(self, app, session, response):
+        self._save(app, session, response)
+
+
 app = Flask(__name__)
-app.secret_key = os.urandom(24)
+app.secret_key = secret_key()
 
 UPLOAD_FOLDER = 'data2'
 if not os.path.exists(UPLOAD_FOLDER):
     os.makedirs(UPLOAD_FOLDER)
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
-app.config['ALLOWED_EXTENSIONS'] = {'pdf'}
+app.config['ALLOWED_EXTENSIONS'] = ALLOWED_EXTENSIONS
 app.config['MAX_CONTENT_LENGTH'] = 10 * 1024 * 1024  # 10MB max file size
 
-def allowed_file(filename):
-    """Checks if a file has a PDF extension."""
-    return '.' in filename and \
-           filename.rsplit('.', 1)[1].lower() in app.config['ALLOWED_EXTENSIONS']
+def get_uploaded_files():
+    """Get list of uploaded files of the session's collection with their info"""
+    return list_uploaded_files(get_collection(session_collection(session)).data_path)
 
 
-def get_uploaded_files():
-    """Get list of uploaded files with their info"""
-    files = []
-    if os.path.exists(app.config['UPLOAD_FOLDER']):
-        for filename in os.listdir(app.config['UPLOAD_FOLDER']):
-            if allowed_file(filename):
-                filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-                file_size = os.path.getsize(filepath)
-                # Convert bytes to human readable format
-                if file_size < 1024:
-                    size_str = f"{file_size} B"
-                elif file_size < 1024*1024:
-                    size_str = f"{file_size/1024:.1f} KB"
-                else:
-                    size_str = f"{file_size/(1024*1024):.1f} MB"
-                
-                files.append({
-                    'filename': filename,
-                    'size': size_str
-                })
-    return files
-
-from markupsafe import Markup
-def nl2br(value):
-    return Markup(value.replace('\n', '\n'))
+def page_context():
+    """What index.html shows besides the chat: the session's collection and its documents."""
+    return {"uploaded_files": get_uploaded_files(), "collection": session_collection(session),
+            "collections": list_collections()}
 
 app.jinja_env.filters['nl2br'] = nl2br
+app.session_interface = ServerSessionInterface(get_session_store())
+
+
+if METRICS_ENABLED:
+    @app.before_request
+    def _begin_request_timing():
+        g.timing = metrics.begin_timing()
+
+    @app.after_request
+    def _note_response_status(response):
+        g.timing_status = str(response.status_code)
+        return response
+
+    @app.teardown_request
+    def _end_request_timing(error):
+        # Runs after the session is saved, so its serialization is part of the request's time
+        timing = g.pop("timing", None)
+        if timing is not None:
+            status = "error" if error is not None else g.pop("timing_status", "unknown")
+            metrics.end_timing(timing, request.endpoint or "unknown", status)
+
+
+@app.route("/metrics")
+def prometheus_metrics():
+    """Stage timings and counters in the Prometheus text format."""
+    if not METRICS_ENABLED:
+        return "Metrics are disabled\n", 404, {"Content-Type": "text/plain"}
+    return Response(metrics.render(), content_type=metrics.CONTENT_TYPE)
 
 @app.route("/", methods=["GET", "POST"])
 def index():
-    
-    if "messages" not in session:
-        session["messages"] = []
+    store = app.session_interface.store
 
     if request.method == "POST":
         # Check if this is a chat message (not file upload)
@@ -73,22 +100,35 @@ def index():
             user_input = request.form.get("prompt")
 
             if user_input:
-                messages = session["messages"]
-                messages.append({"role": "user", "content": user_input})
-                session["messages"] = messages
+                add_chat_messages(store, session, [{"role": "user", "content": user_input}])
 
                 try:
-                    qa_chain = create_qa_chain()
-                    if qa_chain is None:
-                        raise Exception("QA chain could not be created (LLM or VectorStore issue)")
-                    response = qa_chain.invoke({"query": user_input})
-                    logger.info(f"Response from QA chain: {response}")
+                    collections = searched_collections(session, request.form)
+                    answer_cache = get_answer_cache(collections) if ANSWER_CACHE_ENABLED else None
+                    with span("answer_cache_lookup"):
+                        response, query_vector = answer_cache.lookup(user_input) if answer_cache else (None, None)
+                    
+                    if response is None:
+                        with span("chain_build"):
+                            qa_chain = get_qa_chain(collections)
+                        if qa_chain is None:
+                            raise Exception("QA chain could not be created (LLM or VectorStore issue)")
+                        started = time.perf_counter()
+                        with span("qa_chain"):
+                            # An identical question already being answered shares its answer
+                            response, answered = answer_once(collections, user_input,
+                                                             lambda: qa_chain.invoke({"query": user_input}))
+                        logger.info(f"Response from QA chain: {response}")
+                        if answer_cache and answered:
+                            answer_cache.store(user_input, response, time.perf_counter() - started, query_vector)
+                    else:
+                        logger.info(f"Answer served from cache: {answer_cache.stats()}")
                     result = response.get("result", "No response")
                     source_docs = response.get("source_documents", [])
                     metadata = source_docs[0].metadata if source_docs and hasattr(source_docs[0], 'metadata') else {}
                     
                     # 1. Add the main assistant response to the chat
-                    messages.append({"role": "assistant", "content": result})
+                    messages = [{"role": "assistant", "content": result}]
 
                     # 2. Process metadata for DB and UI
                     if metadata:
@@ -96,30 +136,148 @@ def index():
                         # We remove any existing '_id' to let MongoDB generate a new, proper ObjectId.
                         db_metadata = metadata.copy()
                         db_metadata.pop('_id', None) # Safely remove _id if it exists
-                        insert_document(db_metadata)
+                        with span("mongo_enqueue"):
+                            log_retrieval_source(db_metadata)
 
                         # Format metadata into a user-friendly, JSON-serializable string for the session.
-                        source = metadata.get('source', 'N/A')
-                        page = metadata.get('page', 'N/A')
-                        source_filename = os.path.basename(source) # Gets just the filename
-                        
-                        source_info_string = f"Source: {source_filename}, Page: {page}"
-                        messages.append({"role": "metadata", "content": source_info_string})
+                        messages.append({"role": "metadata", "content": format_source_info(metadata)})
                     
-                    session["messages"] = messages
+                    add_chat_messages(store, session, messages)
                     
                 except Exception as e:
                     error_msg = f"Error: {str(e)}"
                     return render_template("index.html", 
-                                         messages=session["messages"], 
+                                         messages=chat_history(store, session), 
                                          error=error_msg,
-                                         uploaded_files=get_uploaded_files())
+                                         **page_context())
             
             return redirect(url_for("index"))
     
     return render_template("index.html", 
-                         messages=session.get("messages", []),
-                         uploaded_files=get_uploaded_files())
+                         messages=chat_history(store, session),
+                         ingestion_job=session.get("ingestion_job"),
+                         **page_context())
+
+@app.route("/chat_stream", methods=["POST"])
+def chat_stream():
+    """
+    Server-sent events: "sources" with the retrieved documents' metadata, then one "token"
+    event per LLM token, then "done", by which time the turn is in the session's chat history.
+    Searches the session's collection unless "collection" or "collections" says otherwise.
+    """
+    user_input = request.form.get("prompt") or (request.get_json(silent=True) or {}).get("prompt")
+    if not user_input:
+        return jsonify({"error": "Empty prompt"}), 400
+    try:
+        collections = searched_collections(session, request.form, request.get_json(silent=True), request.args)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    stream_id = uuid4().hex
+    # The turn is saved after the headers went out, so a new session's cookie goes with them
+    session.modified = True
+    chat_session = session._get_current_object()
+
+    def generate():
+        # The route's own timing ends when the response starts, the answer is timed here
+        timing, status = metrics.begin_timing(), "ok"
+        try:
+            answer_cache = get_answer_cache(collections) if ANSWER_CACHE_ENABLED else None
+            with span("answer_cache_lookup"):
+                cached, query_vector = answer_cache.lookup(user_input) if answer_cache else (None, None)
+
+            if cached is not None:
+                source_docs = cached.get("source_documents", [])
+                events = [("sources", source_docs), ("token", cached.get("result", "No response")),
+                          ("done", {"result": cached.get("result", "No response"), "source_documents": source_docs,
+                                    "ttft": 0.0, "total": 0.0})]
+            else:
+                with span("chain_build"):
+                    qa_chain = get_qa_chain(collections)
+                if qa_chain is None:
+                    raise Exception("QA chain could not be created (LLM or VectorStore issue)")
+                retriever, llm = chain_parts(qa_chain)
+                events = stream_answer(user_input, retriever, llm)
+
+            for event, payload in events:
+                if event == "sources":
+                    yield sse("sources", [doc.metadata for doc in payload])
+                elif event == "token":
+                    yield sse("token", payload)
+                else:
+                    source_docs = payload["source_documents"]
+                    if cached is None and answer_cache:
+                        answer_cache.store(user_input, {"result": payload["result"], "source_documents": source_docs},
+                                           payload["total"], query_vector)
+
+                    messages = [{"role": "user", "content": user_input},
+                                {"role": "assistant", "content": payload["result"]}]
+                    metadata = source_docs[0].metadata if source_docs else {}
+                    if metadata:
+                        db_metadata = metadata.copy()
+                        db_metadata.pop('_id', None)
+                        try:
+                            with span("mongo_enqueue"):
+                                log_retrieval_source(db_metadata)
+                        except Exception as e:
+                            logger.error(f"Failed to log retrieval source: {e}")
+                        messages.append({"role": "metadata", "content": format_source_info(metadata)})
+
+                    add_chat_messages(app.session_interface.store, chat_session, messages)
+
+                    yield sse("done", {"stream_id": stream_id, "ttft": payload["ttft"], "total": payload["total"],
+                                        "source_info": messages[-1]["content"] if metadata else None})
+        except Exception as e:
+            status = "error"
+            logger.error(f"Streaming chat failed: {e}")
+            yield sse("error", {"error": str(e)})
+        finally:
+            metrics.end_timing(timing, "chat_stream_answer", status)
+
+    return Response(stream_with_context(generate()), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@app.route("/chat_stream/<stream_id>/commit", methods=["POST"])
+def commit_chat_stream(stream_id):
+    """No-op for clients from before streamed turns were saved at the "done" event."""
+    return "", 204
+
+@app.route("/api/ask", methods=["POST"])
+def api_ask():
+    """
+    JSON question answering. One question returns {"answer", "sources", ...}; a batch returns
+    {"answers": [...]} in input order, or with "stream": true (or a JSONL body) one JSON line
+    per answer as each completes, with "index" giving its position in the batch.
+    "collection" or "collections" (in the JSON object or the query string) pick what is searched.
+    """
+    try:
+        questions, single, stream = parse_questions(request.mimetype, request.get_data(as_text=True))
+        collections = searched_collections(session, request.get_json(silent=True), request.args)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    if get_qa_chain(collections) is None:
+        return jsonify({"error": "QA chain could not be created (LLM or VectorStore issue)"}), 503
+
+    if stream:
+        def generate():
+            try:
+                for result in iter_answers(questions, collections=collections):
+                    yield json.dumps(result) + "\n"
+            except Exception as e:
+                logger.error(f"Streaming batch answers failed: {e}")
+                yield json.dumps({"error": str(e)}) + "\n"
+
+        return Response(stream_with_context(generate()), mimetype="application/x-ndjson",
+                        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+    try:
+        results = answer_questions(questions, collections=collections)
+    except Exception as e:
+        logger.error(f"Batch answers failed: {e}")
+        return jsonify({"error": str(e)}), 500
+    if single:
+        return jsonify(results[0]), 500 if "error" in results[0] else 200
+    return jsonify({"answers": results})
 
 @app.route("/upload_document", methods=["POST"])
 def upload_document():
@@ -133,24 +291,27 @@ def upload_document():
                 flash("You can only upload a maximum of 20 PDF files.", 'error')
                 return redirect(url_for('index'))
 
+            try:
+                collection = target_collection(session, request.form)
+            except ValueError as e:
+                flash(str(e), 'error')
+                return redirect(url_for('index'))
+            os.makedirs(collection.data_path, exist_ok=True)
+
             for file in files:
                 if file and file.filename != '' and allowed_file(file.filename):
                     filename = secure_filename(file.filename)
-                    filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
+                    filepath = os.path.join(collection.data_path, filename)
                     file.save(filepath)
                     pdf_paths.append(filepath)
                 elif file.filename != '':
                     flash(f"Invalid file type for: {file.filename}. Only PDF files are allowed.", 'error')
             
-            # Process the uploaded files
+            # Ingestion runs in the background; the page polls /ingestion_status for progress
             if pdf_paths:
-                try:
-                    flash("PDFs uploaded. Processing all files in the data folder...", 'success')
-                    # Process all PDFs in the upload folder
-                    process_and_store_pdfs()
-                    flash("All PDFs in the data folder have been processed and are ready for chat!", 'success')
-                except Exception as e:
-                    flash(f"Error processing PDFs: {str(e)}", 'error')
+                job = get_ingestion_queue().submit([os.path.basename(path) for path in pdf_paths], collection.name)
+                session["ingestion_job"] = job.id
+                flash("PDFs uploaded. Only new or changed files will be processed, progress is shown below.", 'success')
             else:
                 flash("No valid PDF files were uploaded.", 'error')
             
@@ -161,19 +322,17 @@ def upload_document():
 @app.route("/remove_document", methods=["POST"])
 def remove_document():
     if request.method == 'POST':
-        filename = request.form.get('filename')
+        filename = secure_filename(request.form.get('filename', ''))
         if filename:
-            filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
             try:
+                collection = target_collection(session, request.form)
+                filepath = os.path.join(collection.data_path, filename)
                 if os.path.exists(filepath):
                     os.remove(filepath)
                     flash(f"File '{filename}' has been removed successfully.", 'success')
-                    # Reprocess remaining files after removal
-                    try:
-                        process_and_store_pdfs(app.config['UPLOAD_FOLDER'])
-                        flash("Remaining files have been reprocessed.", 'success')
-                    except Exception as e:
-                        flash(f"Error reprocessing files: {str(e)}", 'error')
+                    # The ingestion run deletes exactly this file's vectors by ID, other files and collections are untouched
+                    job = get_ingestion_queue().submit(collection=collection.name)
+                    session["ingestion_job"] = job.id
                 else:
                     flash(f"File '{filename}' not found.", 'error')
             except Exception as e:
@@ -181,10 +340,37 @@ def remove_document():
     
     return redirect(url_for('index'))
 
+@app.route("/collection", methods=["POST"])
+def select_collection():
+    """Switches the session to a collection; a new name creates it."""
+    try:
+        collection = get_collection(request.form.get('collection', '').strip())
+    except ValueError as e:
+        flash(str(e), 'error')
+        return redirect(url_for('index'))
+    os.makedirs(collection.data_path, exist_ok=True)
+    session["collection"] = collection.name
+    return redirect(url_for('index'))
+
+@app.route("/collections")
+def collection_list():
+    return jsonify({"collections": list_collections(), "current": session_collection(session)})
+
+@app.route("/ingestion_status")
+@app.route("/ingestion_status/<job_id>")
+def ingestion_status(job_id=None):
+    queue = get_ingestion_queue()
+    job = queue.get(job_id) if job_id else queue.latest()
+    if job is None:
+        return jsonify({"error": "Unknown ingestion job"}), 404
+    return jsonify(job.to_dict())
+
 @app.route("/clear")
 def clear():
-    session.pop("messages", None)
+    clear_chat_history(app.session_interface.store, session)
     return redirect(url_for("index"))
 
 if __name__ == "__main__":
+    if WARMUP_ON_START:
+        warm_up()
     app.run(host="0.0.0.0", port=5000, debug=False, use_reloader=False)
\ No newline at end of file
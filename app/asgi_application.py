@@ -0,0 +1,417 @@
+"""
+Async serving mode: the same routes and templates as application.py on Quart, an ASGI
+framework with Flask's API. Chat requests await the chain's async APIs (ainvoke/astream,
+async embeddings and Groq's async client), so one worker holds many concurrent chats while
+they wait on I/O instead of one thread per chat. Pinecone queries are the exception: they
+run the sync client on PINECONE_QUERY_THREADS threads, which bounds concurrent searches.
+
+    hypercorn app.asgi_application:app --bind 0.0.0.0:5000 --workers 2
+"""
+import asyncio
+import json
+import os
+import time
+from uuid import uuid4
+
+from dotenv import load_dotenv
+from quart import Quart, render_template, request, session, redirect, url_for, flash, jsonify, Response, g
+from quart.sessions import SessionInterface
+from werkzeug.utils import secure_filename
+
+from app.components.chain_registry import aget_qa_chain
+from app.components.answer_cache import get_answer_cache
+from app.components.coalescer import aanswer_once
+from app.components.answer_stream import chain_parts, astream_answer
+from app.components.batch_qa import aiter_answers, parse_questions
+from app.components.ingestion_jobs import get_ingestion_queue
+from app.components.mongodata import log_retrieval_source
+from app.components.warmup import warm_up
+from app.components.session_store import MemorySessionStore, get_session_store
+from app.components.collections import get_collection, list_collections
+from app.web_common import (ALLOWED_EXTENSIONS, ServerSessionMixin, add_chat_messages,
+                            allowed_file, chat_history, clear_chat_history, format_source_info,
+                            list_uploaded_files, nl2br, searched_collections, secret_key, session_collection,
+                            sse, target_collection)
+from app.common.logger import get_logger
+from app.common import metrics
+from app.common.metrics import span
+from app.config.config import *
+
+logger = get_logger(__name__)
+
+load_dotenv()
+
+
+class ServerSessionInterface(ServerSessionMixin, SessionInterface):
+    """
+    Sessions and chat history in the session store, with only the session ID in the cookie.
+    Disk and Mongo stores are called from a worker thread, the in-memory one directly.
+    """
+
+    async def open_session(self, app, request):
+        return await _store_call(self._open, app, request)
+
+    async def save_session(self, app, session, response):
+        await _store_call(self._save, app, session, response)
+
+
+async def _store_call(fn, *args):
+    if isinstance(session_store, MemorySessionStore):
+        return fn(*args)
+    return await asyncio.to_thread(fn, *args)
+
+
+app = Quart(__name__)
+app.secret_key = secret_key()
+
+UPLOAD_FOLDER = 'data2'
+if not os.path.exists(UPLOAD_FOLDER):
+    os.makedirs(UPLOAD_FOLDER)
+app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
+app.config['ALLOWED_EXTENSIONS'] = ALLOWED_EXTENSIONS
+app.config['MAX_CONTENT_LENGTH'] = 10 * 1024 * 1024  # 10MB max file size
+# Streamed answers and batches can run for minutes
+app.config['RESPONSE_TIMEOUT'] = None
+
+app.jinja_env.filters['nl2br'] = nl2br
+session_store = get_session_store()
+app.session_interface = ServerSessionInterface(session_store)
+
+
+
+def get_uploaded_files():
+    """Get list of uploaded files of the session's collection with their info"""
+    return list_uploaded_files(get_collection(session_collection(session)).data_path)
+
+
+def page_context():
+    """What index.html shows besides the chat: the session's collection and its documents."""
+    return {"uploaded_files": get_uploaded_files(), "collection": session_collection(session),
+            "collections": list_collections()}
+
+
+async def _log_source(metadata):
+    db_metadata = metadata.copy()
+    db_metadata.pop('_id', None)
+    try:
+        with span("mongo_enqueue"):
+            # Only enqueues; the background writer thread does the insert. The "block"
+            # drop policy can wait for room in the queue, so that one runs off the loop.
+            if MONGO_WRITER_DROP_POLICY == "block":
+                await asyncio.get_running_loop().run_in_executor(None, log_retrieval_source, db_metadata)
+            else:
+                log_retrieval_source(db_metadata)
+    except Exception as e:
+        logger.error(f"Failed to log retrieval source: {e}")
+
+
+@app.before_serving
+async def _warm_up():
+    if WARMUP_ON_START:
+        await asyncio.to_thread(warm_up)
+
+
+if METRICS_ENABLED:
+    @app.before_request
+    async def _begin_request_timing():
+        g.timing = metrics.begin_timing()
+
+    @app.after_request
+    async def _note_response_status(response):
+        g.timing_status = str(response.status_code)
+        return response
+
+    @app.teardown_request
+    async def _end_request_timing(error):
+        timing = g.pop("timing", None)
+        if timing is not None:
+            status = "error" if error is not None else g.pop("timing_status", "unknown")
+            metrics.end_timing(timing, request.endpoint or "unknown", status)
+
+
+@app.route("/metrics")
+async def prometheus_metrics():
+    """Stage timings and counters in the Prometheus text format."""
+    if not METRICS_ENABLED:
+        return "Metrics are disabled\n", 404, {"Content-Type": "text/plain"}
+    return Response(metrics.render(), content_type=metrics.CONTENT_TYPE)
+
+
+@app.route("/", methods=["GET", "POST"])
+async def index():
+    if request.method == "POST":
+        form = await request.form
+        if 'prompt' in form:
+            user_input = form.get("prompt")
+
+            if user_input:
+                await _store_call(add_chat_messages, session_store, session, [{"role": "user", "content": user_input}])
+
+                try:
+                    collections = searched_collections(session, form)
+                    answer_cache = get_answer_cache(collections) if ANSWER_CACHE_ENABLED else None
+                    with span("answer_cache_lookup"):
+                        response, query_vector = await answer_cache.alookup(user_input) if answer_cache else (None, None)
+
+                    if response is None:
+                        with span("chain_build"):
+                            qa_chain = await aget_qa_chain(collections)
+                        if qa_chain is None:
+                            raise Exception("QA chain could not be created (LLM or VectorStore issue)")
+                        started = time.perf_counter()
+                        with span("qa_chain"):
+                            # An identical question already being answered shares its answer
+                            response, answered = await aanswer_once(collections, user_input,
+                                                                    lambda: qa_chain.ainvoke({"query": user_input}))
+                        logger.info(f"Response from QA chain: {response}")
+                        if answer_cache and answered:
+                            answer_cache.store(user_input, response, time.perf_counter() - started, query_vector)
+                    else:
+                        logger.info(f"Answer served from cache: {answer_cache.stats()}")
+                    result = response.get("result", "No response")
+                    source_docs = response.get("source_documents", [])
+                    metadata = source_docs[0].metadata if source_docs and hasattr(source_docs[0], 'metadata') else {}
+
+                    messages = [{"role": "assistant", "content": result}]
+                    if metadata:
+                        await _log_source(metadata)
+                        messages.append({"role": "metadata", "content": format_source_info(metadata)})
+
+                    await _store_call(add_chat_messages, session_store, session, messages)
+
+                except Exception as e:
+                    error_msg = f"Error: {str(e)}"
+                    return await render_template("index.html",
+                                                 messages=await _store_call(chat_history, session_store, session),
+                                                 error=error_msg,
+                                                 **page_context())
+
+            return redirect(url_for("index"))
+
+    return await render_template("index.html",
+                                 messages=await _store_call(chat_history, session_store, session),
+                                 ingestion_job=session.get("ingestion_job"),
+                                 **page_context())
+
+
+@app.route("/chat_stream", methods=["POST"])
+async def chat_stream():
+    """
+    Server-sent events: "sources" with the retrieved documents' metadata, then one "token"
+    event per LLM token, then "done", by which time the turn is in the session's chat history.
+    Searches the session's collection unless "collection" or "collections" says otherwise.
+    """
+    form = await request.form
+    payload = await request.get_json(silent=True)
+    user_input = form.get("prompt") or (payload or {}).get("prompt")
+    if not user_input:
+        return jsonify({"error": "Empty prompt"}), 400
+    try:
+        collections = searched_collections(session, form, payload, request.args)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    stream_id = uuid4().hex
+    # The turn is saved after the headers went out, so a new session's cookie goes with them
+    session.modified = True
+    chat_session = session._get_current_object()
+
+    async def generate():
+        # The route's own timing ends when the response starts, the answer is timed here
+        timing, status = metrics.begin_timing(), "ok"
+        try:
+            answer_cache = get_answer_cache(collections) if ANSWER_CACHE_ENABLED else None
+            with span("answer_cache_lookup"):
+                cached, query_vector = await answer_cache.alookup(user_input) if answer_cache else (None, None)
+
+            if cached is not None:
+                source_docs = cached.get("source_documents", [])
+                replayed = [("sources", source_docs), ("token", cached.get("result", "No response")),
+                            ("done", {"result": cached.get("result", "No response"), "source_documents": source_docs,
+                                      "ttft": 0.0, "total": 0.0})]
+
+                async def replay():
+                    for event in replayed:
+                        yield event
+                events = replay()
+            else:
+                with span("chain_build"):
+                    qa_chain = await aget_qa_chain(collections)
+                if qa_chain is None:
+                    raise Exception("QA chain could not be created (LLM or VectorStore issue)")
+                retriever, llm = chain_parts(qa_chain)
+                events = astream_answer(user_input, retriever, llm)
+
+            async for event, payload in events:
+                if event == "sources":
+                    yield sse("sources", [doc.metadata for doc in payload])
+                elif event == "token":
+                    yield sse("token", payload)
+                else:
+                    source_docs = payload["source_documents"]
+                    if cached is None and answer_cache:
+                        answer_cache.store(user_input, {"result": payload["result"], "source_documents": source_docs},
+                                           payload["total"], query_vector)
+
+                    messages = [{"role": "user", "content": user_input},
+                                {"role": "assistant", "content": payload["result"]}]
+                    metadata = source_docs[0].metadata if source_docs else {}
+                    if metadata:
+                        await _log_source(metadata)
+                        messages.append({"role": "metadata", "content": format_source_info(metadata)})
+
+                    await _store_call(add_chat_messages, session_store, chat_session, messages)
+
+                    yield sse("done", {"stream_id": stream_id, "ttft": payload["ttft"], "total": payload["total"],
+                                       "source_info": messages[-1]["content"] if metadata else None})
+        except Exception as e:
+            status = "error"
+            logger.error(f"Streaming chat failed: {e}")
+            yield sse("error", {"error": str(e)})
+        finally:
+            metrics.end_timing(timing, "chat_stream_answer", status)
+
+    return Response(generate(), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+@app.route("/chat_stream/<stream_id>/commit", methods=["POST"])
+async def commit_chat_stream(stream_id):
+    """No-op for clients from before streamed turns were saved at the "done" event."""
+    return "", 204
+
+
+@app.route("/api/ask", methods=["POST"])
+async def api_ask():
+    """
+    JSON question answering. One question returns {"answer", "sources", ...}; a batch returns
+    {"answers": [...]} in input order, or with "stream": true (or a JSONL body) one JSON line
+    per answer as each completes, with "index" giving its position in the batch.
+    "collection" or "collections" (in the JSON object or the query string) pick what is searched.
+    """
+    try:
+        questions, single, stream = parse_questions(request.mimetype, await request.get_data(as_text=True))
+        collections = searched_collections(session, await request.get_json(silent=True), request.args)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    if await aget_qa_chain(collections) is None:
+        return jsonify({"error": "QA chain could not be created (LLM or VectorStore issue)"}), 503
+
+    if stream:
+        async def generate():
+            try:
+                async for result in aiter_answers(questions, collections=collections):
+                    yield json.dumps(result) + "\n"
+            except Exception as e:
+                logger.error(f"Streaming batch answers failed: {e}")
+                yield json.dumps({"error": str(e)}) + "\n"
+
+        return Response(generate(), mimetype="application/x-ndjson",
+                        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+    try:
+        results = [None] * len(questions)
+        async for result in aiter_answers(questions, collections=collections):
+            results[result["index"]] = result
+    except Exception as e:
+        logger.error(f"Batch answers failed: {e}")
+        return jsonify({"error": str(e)}), 500
+    if single:
+        return jsonify(results[0]), 500 if "error" in results[0] else 200
+    return jsonify({"answers": results})
+
+
+@app.route("/upload_document", methods=["POST"])
+async def upload_document():
+    files = (await request.files).getlist('document')
+    pdf_paths = []
+
+    if len(files) > 20:
+        await flash("You can only upload a maximum of 20 PDF files.", 'error')
+        return redirect(url_for('index'))
+
+    try:
+        collection = target_collection(session, await request.form)
+    except ValueError as e:
+        await flash(str(e), 'error')
+        return redirect(url_for('index'))
+    os.makedirs(collection.data_path, exist_ok=True)
+
+    for file in files:
+        if file and file.filename != '' and allowed_file(file.filename):
+            filename = secure_filename(file.filename)
+            filepath = os.path.join(collection.data_path, filename)
+            await file.save(filepath)
+            pdf_paths.append(filepath)
+        elif file.filename != '':
+            await flash(f"Invalid file type for: {file.filename}. Only PDF files are allowed.", 'error')
+
+    # Ingestion runs in the background; the page polls /ingestion_status for progress
+    if pdf_paths:
+        job = get_ingestion_queue().submit([os.path.basename(path) for path in pdf_paths], collection.name)
+        session["ingestion_job"] = job.id
+        await flash("PDFs uploaded. Only new or changed files will be processed, progress is shown below.", 'success')
+    elif files:
+        await flash("No valid PDF files were uploaded.", 'error')
+
+    return redirect(url_for('index'))
+
+
+@app.route("/remove_document", methods=["POST"])
+async def remove_document():
+    form = await request.form
+    filename = secure_filename(form.get('filename', ''))
+    if filename:
+        try:
+            collection = target_collection(session, form)
+            filepath = os.path.join(collection.data_path, filename)
+            if os.path.exists(filepath):
+                os.remove(filepath)
+                await flash(f"File '{filename}' has been removed successfully.", 'success')
+                # The ingestion run deletes exactly this file's vectors by ID, other files and collections are untouched
+                job = get_ingestion_queue().submit(collection=collection.name)
+                session["ingestion_job"] = job.id
+            else:
+                await flash(f"File '{filename}' not found.", 'error')
+        except Exception as e:
+            await flash(f"Error removing file: {str(e)}", 'error')
+
+    return redirect(url_for('index'))
+
+
+@app.route("/collection", methods=["POST"])
+async def select_collection():
+    """Switches the session to a collection; a new name creates it."""
+    try:
+        collection = get_collection((await request.form).get('collection', '').strip())
+    except ValueError as e:
+        await flash(str(e), 'error')
+        return redirect(url_for('index'))
+    os.makedirs(collection.data_path, exist_ok=True)
+    session["collection"] = collection.name
+    return redirect(url_for('index'))
+
+
+@app.route("/collections")
+async def collection_list():
+    return jsonify({"collections": list_collections(), "current": session_collection(session)})
+
+
+@app.route("/ingestion_status")
+@app.route("/ingestion_status/<job_id>")
+async def ingestion_status(job_id=None):
+    queue = get_ingestion_queue()
+    job = queue.get(job_id) if job_id else queue.latest()
+    if job is None:
+        return jsonify({"error": "Unknown ingestion job"}), 404
+    return jsonify(job.to_dict())
+
+
+@app.route("/clear")
+async def clear():
+    await _store_call(clear_chat_history, session_store, session)
+    return redirect(url_for("index"))
+
+
+if __name__ == "__main__":
+    app.run(host="0.0.0.0", port=5000, debug=False, use_reloader=False)
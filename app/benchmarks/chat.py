@@ -0,0 +1,117 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from app.benchmarks.fakes import CallCounter, DelayedIndex, FakeChatModel, FakeEmbeddings, FakeMongoCollection
+from app.benchmarks.measure import summarize_latencies
+
+from app.common.logger import get_logger
+
+logger = get_logger(__name__)
+
+
+def sample_questions(texts, count, words=6, seed=0):
+    """Deterministic questions made of word spans from the indexed chunks."""
+    rng = np.random.default_rng(seed)
+    questions = []
+    for _ in range(count):
+        tokens = texts[int(rng.integers(len(texts)))].split()
+        start = int(rng.integers(max(len(tokens) - words, 1)))
+        questions.append("What is " + " ".join(tokens[start:start + words]) + "?")
+    return questions
+
+
+class ChatBench:
+    """
+    Drives the chat routes through the Flask test client, with the QA chain built from the
+    real retriever code over the local index but with fake embeddings, LLM and Mongo.
+    """
+
+    def __init__(self, index, embed_latency, index_latency, llm_latency, token_latency, mongo_latency, dimension):
+        from app.components import answer_cache, mongo_writer, retriver, vector_store
+
+        self.embeddings = FakeEmbeddings(dimension, embed_latency)
+        self.llm = FakeChatModel(latency=llm_latency, token_latency=token_latency, counter=CallCounter())
+        self.collection = FakeMongoCollection(mongo_latency)
+        self.index = DelayedIndex(index, index_latency)
+
+        vector_store.get_embeddings_model = lambda: self.embeddings
+        vector_store.get_local_index = lambda path=None: self.index
+        answer_cache.get_embeddings_model = lambda: self.embeddings
+        retriver.load_llm = lambda: self.llm
+        mongo_writer._default_collection = lambda: self.collection
+
+        from app.application import app
+        app.testing = True
+        self.app = app
+
+    def _ask(self, path, question):
+        client = self.app.test_client()
+        began = time.perf_counter()
+        if path == "/chat_stream":
+            response = client.post(path, data={"prompt": question}, buffered=False)
+            ttft = None
+            for chunk in response.response:
+                if ttft is None and b"event: token" in chunk:
+                    ttft = time.perf_counter() - began
+            ok = response.status_code == 200
+            response.close()
+        else:
+            response = client.post(path, data={"prompt": question})
+            ttft = None
+            # A successful chat turn redirects back to the page; errors re-render it with 200
+            ok = response.status_code == 302
+        return time.perf_counter() - began, ttft, ok
+
+    def run_level(self, path, questions, concurrency, requests):
+        latencies, ttfts, errors = [], [], 0
+        lock = threading.Lock()
+
+        def task(i):
+            nonlocal errors
+            seconds, ttft, ok = self._ask(path, questions[i % len(questions)])
+            with lock:
+                if ok:
+                    latencies.append(seconds)
+                    if ttft is not None:
+                        ttfts.append(ttft)
+                else:
+                    errors += 1
+
+        began = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            list(executor.map(task, range(requests)))
+        summary = summarize_latencies(latencies, time.perf_counter() - began, errors)
+        if ttfts:
+            summary["ttft_p50"], summary["ttft_p95"] = (float(v) for v in np.percentile(ttfts, [50, 95]))
+        return summary
+
+
+def run_chat(index, questions_from, concurrency_levels=(1, 4, 16), requests=200, question_count=50,
+             paths=("/", "/chat_stream"), embed_latency=0.0, index_latency=0.0, llm_latency=0.0,
+             token_latency=0.0, mongo_latency=0.0, dimension=768):
+    """
+    index is a filled local vector index and questions_from the chunk texts in it,
+    e.g. from IngestionBench.process(); questions are sampled from those texts.
+    """
+    bench = ChatBench(index, embed_latency, index_latency, llm_latency, token_latency, mongo_latency, dimension)
+    questions = sample_questions(questions_from, question_count)
+
+    from app.components.chain_registry import warm_up_qa_chain
+    warm_up_qa_chain()
+
+    results = {}
+    for path in paths:
+        for concurrency in concurrency_levels:
+            logger.info(f"Benchmarking {path} at concurrency {concurrency}")
+            results[f"chat{path.rstrip('/')}/concurrency={concurrency}"] = bench.run_level(
+                path, questions, concurrency, requests)
+    results["calls"] = {
+        "llm": bench.llm.counter.calls,
+        "embedding": bench.embeddings.counter.calls,
+        "index_query": bench.index.counter.calls,
+        "mongo": bench.collection.counter.calls,
+    }
+    return results
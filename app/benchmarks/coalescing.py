@@ -0,0 +1,75 @@
+import random
+import time
+
+from app.benchmarks.fakes import CallCounter, FakeEmbeddings
+from app.benchmarks.measure import drive_threads
+
+from app.common.logger import get_logger
+
+logger = get_logger(__name__)
+
+
+def _draws(requests, questions, seed=0):
+    """Which of the questions each request asks, the same for every mode compared."""
+    rng = random.Random(seed)
+    return [f"question {rng.randrange(questions)}" for _ in range(requests)]
+
+
+def _embedding(requests, concurrency, questions, embed_latency, dimension, window, max_batch_size):
+    """Concurrent embed_query() calls straight to the model, and through the micro-batcher."""
+    from app.components.coalescer import MicroBatchingEmbeddings
+
+    asked, results = _draws(requests, questions), {}
+    for mode in ("direct", "batched"):
+        model = FakeEmbeddings(dimension, embed_latency)
+        embeddings = model if mode == "direct" else MicroBatchingEmbeddings(model, window, max_batch_size)
+        results[mode] = drive_threads(lambda i: embeddings.embed_query(asked[i]), requests, concurrency)
+        stats = model.counter.stats()
+        results[mode].update({
+            "upstream_calls": stats["calls"],
+            "upstream_texts": stats["items"],
+            "mean_batch_size": stats["items"] / stats["calls"] if stats["calls"] else 0.0,
+        })
+    return results
+
+
+def _answers(requests, concurrency, questions, llm_latency):
+    """Concurrent answers to repeated questions, each its own completion and with single-flight."""
+    from app.components.coalescer import SingleFlight
+
+    asked, results = _draws(requests, questions), {}
+    for mode in ("off", "on"):
+        counter = CallCounter()
+        flight = SingleFlight(f"bench-{mode}")
+
+        def complete():
+            counter.add()
+            time.sleep(llm_latency)
+            return "answer"
+
+        def ask(i):
+            return complete() if mode == "off" else flight.do(asked[i], complete)
+
+        results[mode] = drive_threads(ask, requests, concurrency)
+        results[mode]["upstream_calls"] = counter.stats()["calls"]
+    return results
+
+
+def run_coalescing(levels, requests, questions, embed_latency, llm_latency, dimension=768,
+                   window=None, max_batch_size=None):
+    """
+    Upstream calls and latency with and without request coalescing, at each concurrency level:
+    query embeddings against the fake embedding model, and answers to questions drawn from a
+    pool of questions against a completion that takes llm_latency.
+    """
+    from app.config.config import QUERY_BATCH_MAX_SIZE, QUERY_BATCH_WINDOW
+
+    window = QUERY_BATCH_WINDOW if window is None else window
+    max_batch_size = QUERY_BATCH_MAX_SIZE if max_batch_size is None else max_batch_size
+    results = {}
+    for concurrency in levels:
+        logger.info(f"Benchmarking request coalescing at concurrency {concurrency}")
+        results[f"embed_query/concurrency={concurrency}"] = _embedding(
+            requests, concurrency, questions, embed_latency, dimension, window, max_batch_size)
+        results[f"answers/concurrency={concurrency}"] = _answers(requests, concurrency, questions, llm_latency)
+    return results
@@ -0,0 +1,128 @@
+import asyncio
+import threading
+import time
+from urllib.parse import urlencode
+
+import numpy as np
+
+from app.benchmarks.chat import ChatBench, sample_questions
+from app.benchmarks.measure import summarize_latencies
+
+from app.common.logger import get_logger
+
+logger = get_logger(__name__)
+
+
+class ThreadSampler:
+    """Polls the live thread count in the background and keeps the peak."""
+
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.peak = threading.active_count()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="thread-sampler", daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.peak = max(self.peak, threading.active_count())
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self._stop.set()
+        self._thread.join()
+        return False
+
+
+class AsyncChatBench(ChatBench):
+    """
+    ChatBench against the ASGI app: every request at a concurrency level shares one event
+    loop, the way one Hypercorn worker would serve them, where the Flask app needs a thread
+    per in-flight request.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        from app.asgi_application import app
+        app.testing = True
+        self.asgi_app = app
+
+    async def _aask(self, client, path, question):
+        began = time.perf_counter()
+        ttft = None
+        if path == "/chat_stream":
+            async with client.request(path, method="POST",
+                                      headers={"Content-Type": "application/x-www-form-urlencoded"}) as connection:
+                await connection.send(urlencode({"prompt": question}).encode("utf-8"))
+                await connection.send_complete()
+                # The test connection doesn't signal the end of the body, the last event does
+                while True:
+                    chunk = await connection.receive()
+                    if ttft is None and b"event: token" in chunk:
+                        ttft = time.perf_counter() - began
+                    if b"event: done" in chunk or b"event: error" in chunk:
+                        break
+            ok = connection.status_code == 200
+        else:
+            response = await client.post(path, form={"prompt": question})
+            ok = response.status_code == 302
+        return time.perf_counter() - began, ttft, ok
+
+    async def _arun_level(self, path, questions, concurrency, requests):
+        slots = asyncio.Semaphore(concurrency)
+
+        async def task(i):
+            async with slots:
+                return await self._aask(self.asgi_app.test_client(), path, questions[i % len(questions)])
+
+        return await asyncio.gather(*(task(i) for i in range(requests)))
+
+    def run_async_level(self, path, questions, concurrency, requests):
+        began = time.perf_counter()
+        with ThreadSampler() as sampler:
+            outcomes = asyncio.run(self._arun_level(path, questions, concurrency, requests))
+        return _summarize(outcomes, time.perf_counter() - began, sampler.peak)
+
+    def run_thread_level(self, path, questions, concurrency, requests):
+        with ThreadSampler() as sampler:
+            summary = self.run_level(path, questions, concurrency, requests)
+        summary["peak_threads"] = sampler.peak
+        return summary
+
+
+def _summarize(outcomes, wall_seconds, peak_threads):
+    latencies = [seconds for seconds, _, ok in outcomes if ok]
+    ttfts = [ttft for _, ttft, ok in outcomes if ok and ttft is not None]
+    summary = summarize_latencies(latencies, wall_seconds, sum(1 for _, _, ok in outcomes if not ok))
+    if ttfts:
+        summary["ttft_p50"], summary["ttft_p95"] = (float(v) for v in np.percentile(ttfts, [50, 95]))
+    summary["peak_threads"] = peak_threads
+    return summary
+
+
+def run_concurrency(index, questions_from, concurrency_levels=(1, 16, 64), requests=200, question_count=50,
+                    paths=("/", "/chat_stream"), embed_latency=0.0, index_latency=0.0, llm_latency=0.0,
+                    token_latency=0.0, mongo_latency=0.0, dimension=768):
+    """
+    Load test of one worker: the Flask app with a thread per concurrent request against the
+    ASGI app with all of them on one event loop, at each concurrency level. Reports latency,
+    throughput and the peak number of live threads for both.
+    """
+    bench = AsyncChatBench(index, embed_latency, index_latency, llm_latency, token_latency, mongo_latency, dimension)
+    questions = sample_questions(questions_from, question_count)
+
+    from app.components.chain_registry import warm_up_qa_chain
+    warm_up_qa_chain()
+
+    results = {}
+    for path in paths:
+        for concurrency in concurrency_levels:
+            logger.info(f"Load testing {path} at concurrency {concurrency} (threads, then asyncio)")
+            name = path.rstrip('/')
+            results[f"wsgi{name}/concurrency={concurrency}"] = bench.run_thread_level(
+                path, questions, concurrency, requests)
+            results[f"asgi{name}/concurrency={concurrency}"] = bench.run_async_level(
+                path, questions, concurrency, requests)
+    return results
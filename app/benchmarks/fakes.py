@@ -0,0 +1,280 @@
+import asyncio
+import hashlib
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, AsyncIterator, Iterator, List, Optional
+
+import numpy as np
+from langchain_core.callbacks import AsyncCallbackManagerForLLMRun, CallbackManagerForLLMRun
+from langchain_core.embeddings import Embeddings
+from langchain_core.language_models.chat_models import SimpleChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+
+# Deterministic local stand-ins for Google embeddings, Groq, Pinecone and Mongo, and a stub
+# HTTP embedding service for exercising real connections.
+# Every call sleeps for a configurable latency, so a benchmark can model a remote
+# service without depending on one. The async methods wait with asyncio.sleep, like a
+# native async client would, instead of holding a thread.
+
+
+class CallCounter:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.items = 0
+
+    def add(self, items=1):
+        with self._lock:
+            self.calls += 1
+            self.items += items
+
+    def stats(self):
+        with self._lock:
+            return {"calls": self.calls, "items": self.items}
+
+
+class FakeEmbeddings(Embeddings):
+    """
+    Hash-seeded unit vectors: the same text always gets the same vector.
+    latency is paid once per call, per_item_latency once per text in the call.
+    """
+
+    def __init__(self, dimension=768, latency=0.0, per_item_latency=0.0):
+        self.dimension = dimension
+        self.latency = latency
+        self.per_item_latency = per_item_latency
+        self.counter = CallCounter()
+
+    def _vector(self, text):
+        seed = int.from_bytes(hashlib.blake2b(text.encode("utf-8"), digest_size=8).digest(), "little")
+        vector = np.random.default_rng(seed).standard_normal(self.dimension).astype(np.float32)
+        return (vector / np.linalg.norm(vector)).tolist()
+
+    def embed_documents(self, texts):
+        self.counter.add(len(texts))
+        time.sleep(self.latency + self.per_item_latency * len(texts))
+        return [self._vector(text) for text in texts]
+
+    def embed_query(self, text):
+        return self.embed_documents([text])[0]
+
+    async def aembed_documents(self, texts):
+        self.counter.add(len(texts))
+        await asyncio.sleep(self.latency + self.per_item_latency * len(texts))
+        return [self._vector(text) for text in texts]
+
+    async def aembed_query(self, text):
+        return (await self.aembed_documents([text]))[0]
+
+
+class FakeChatModel(SimpleChatModel):
+    """
+    Answers with the first answer_words words of the prompt's context, after latency
+    seconds (time to first token) plus token_latency per streamed word.
+    """
+
+    latency: float = 0.0
+    token_latency: float = 0.0
+    answer_words: int = 40
+    counter: Any = None
+
+    @property
+    def _llm_type(self) -> str:
+        return "benchmark-fake-chat"
+
+    def _answer(self, messages):
+        prompt = messages[-1].content if messages else ""
+        context = prompt.split("Context:", 1)[-1].split("Question:", 1)[0]
+        return " ".join(context.split()[:self.answer_words]) or "No context."
+
+    def _call(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+              run_manager: Optional[CallbackManagerForLLMRun] = None, **kwargs: Any) -> str:
+        if self.counter:
+            self.counter.add()
+        answer = self._answer(messages)
+        time.sleep(self.latency + self.token_latency * len(answer.split()))
+        return answer
+
+    def _stream(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                run_manager: Optional[CallbackManagerForLLMRun] = None, **kwargs: Any) -> Iterator[ChatGenerationChunk]:
+        if self.counter:
+            self.counter.add()
+        time.sleep(self.latency)
+        for i, word in enumerate(self._answer(messages).split()):
+            time.sleep(self.token_latency)
+            yield ChatGenerationChunk(message=AIMessageChunk(content=word if i == 0 else " " + word))
+
+    async def _agenerate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                         run_manager: Optional[AsyncCallbackManagerForLLMRun] = None, **kwargs: Any) -> ChatResult:
+        if self.counter:
+            self.counter.add()
+        answer = self._answer(messages)
+        await asyncio.sleep(self.latency + self.token_latency * len(answer.split()))
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=answer))])
+
+    async def _astream(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                       run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+                       **kwargs: Any) -> AsyncIterator[ChatGenerationChunk]:
+        if self.counter:
+            self.counter.add()
+        await asyncio.sleep(self.latency)
+        for i, word in enumerate(self._answer(messages).split()):
+            await asyncio.sleep(self.token_latency)
+            yield ChatGenerationChunk(message=AIMessageChunk(content=word if i == 0 else " " + word))
+
+
+class DelayedIndex:
+    """
+    Wraps a vector index (the local one, or anything with the Pinecone upsert/query/delete
+    calls) and adds latency to its network-facing methods, like a remote Pinecone would.
+    """
+
+    _DELAYED = ("upsert", "delete", "update", "query")
+
+    def __init__(self, index, latency=0.0):
+        self._index = index
+        self.latency = latency
+        self.counter = CallCounter()
+
+    def __len__(self):
+        return len(self._index)
+
+    def __getattr__(self, name):
+        attr = getattr(self._index, name)
+        if name not in self._DELAYED or not callable(attr):
+            return attr
+
+        def delayed(*args, **kwargs):
+            self.counter.add(len(kwargs.get("vectors") or kwargs.get("ids") or ()) or 1)
+            time.sleep(self.latency)
+            return attr(*args, **kwargs)
+        return delayed
+
+
+class FakeMongoCollection:
+    """In-memory collection with insert_one/insert_many and a per-call latency."""
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.documents = []
+        self.counter = CallCounter()
+        self._lock = threading.Lock()
+
+    def insert_one(self, document):
+        self.counter.add()
+        time.sleep(self.latency)
+        with self._lock:
+            self.documents.append(dict(document))
+
+    def insert_many(self, documents, ordered=True):
+        self.counter.add(len(documents))
+        time.sleep(self.latency)
+        with self._lock:
+            self.documents.extend(dict(document) for document in documents)
+
+
+class StubEmbeddingServer:
+    """
+    A local HTTP embedding service: POST /embed {"texts": [...]} answers {"vectors": [...]}
+    after latency seconds, or slow_latency for a slow_rate share of requests. With
+    status set (e.g. 503) every request fails with it instead; with hang set, requests
+    wait that long before answering.
+    """
+
+    def __init__(self, dimension=64, latency=0.0, slow_latency=0.0, slow_rate=0.0, seed=0):
+        self.embeddings = FakeEmbeddings(dimension)
+        self.latency = latency
+        self.slow_latency = slow_latency
+        self.slow_rate = slow_rate
+        self.status = None
+        self.hang = 0.0
+        self.counter = CallCounter()
+        self.connections = CallCounter()
+        self._random = random.Random(seed)
+        self._random_lock = threading.Lock()
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), self._handler())
+        self._server.daemon_threads = True
+        # Clients that gave up at their deadline reset the connection; that's expected here
+        self._server.handle_error = lambda request, client_address: None
+        self._thread = threading.Thread(target=self._server.serve_forever, name="stub-embedding-server", daemon=True)
+
+    @property
+    def url(self):
+        host, port = self._server.server_address
+        return f"http://{host}:{port}/embed"
+
+    def _delay(self):
+        with self._random_lock:
+            slow = self._random.random() < self.slow_rate
+        return self.hang or (self.slow_latency if slow else self.latency)
+
+    def _handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            # Keep-alive, so a pooled client reuses its connections
+            protocol_version = "HTTP/1.1"
+
+            def setup(self):
+                super().setup()
+                stub.connections.add()
+
+            def log_message(self, format, *args):
+                pass
+
+            def do_POST(self):
+                texts = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))["texts"]
+                stub.counter.add(len(texts))
+                time.sleep(stub._delay())
+                if stub.status:
+                    status, body = stub.status, b'{"error": "unavailable"}'
+                else:
+                    status, body = 200, json.dumps({"vectors": stub.embeddings.embed_documents(texts)}).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        return Handler
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self._server.shutdown()
+        self._server.server_close()
+        return False
+
+
+class HttpEmbeddings(Embeddings):
+    """
+    Embeddings from a StubEmbeddingServer over httpx. With a client, every call reuses its
+    pooled connections; without one, each call opens (and closes) a connection of its own.
+    """
+
+    def __init__(self, url, client=None, timeout=10.0):
+        self.url = url
+        self.client = client
+        self.timeout = timeout
+
+    def _post(self, client, texts):
+        response = client.post(self.url, json={"texts": texts}, timeout=self.timeout)
+        response.raise_for_status()
+        return response.json()["vectors"]
+
+    def embed_documents(self, texts):
+        if self.client is not None:
+            return self._post(self.client, texts)
+        import httpx
+
+        with httpx.Client() as client:
+            return self._post(client, texts)
+
+    def embed_query(self, text):
+        return self.embed_documents([text])[0]
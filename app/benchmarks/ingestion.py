@@ -0,0 +1,210 @@
+import os
+import shutil
+
+import numpy as np
+from langchain_core.documents import Document
+
+from app.benchmarks.fakes import DelayedIndex, FakeEmbeddings
+from app.benchmarks.measure import max_rss_mb, timed
+
+from app.common.logger import get_logger
+
+logger = get_logger(__name__)
+
+
+def synthetic_documents(pages, words_per_page=400, vocabulary=20000, seed=0):
+    """Deterministic pages of Zipf-distributed words, standing in for a large PDF corpus."""
+    rng = np.random.default_rng(seed)
+    words = np.array([f"w{i}" for i in range(vocabulary)])
+    documents = []
+    for page in range(pages):
+        ids = np.minimum(rng.zipf(1.2, words_per_page), vocabulary) - 1
+        documents.append(Document(
+            page_content=" ".join(words[ids]),
+            metadata={"source": f"synthetic-{page // 100}.pdf", "page": page % 100, "total_pages": 100},
+        ))
+    return documents
+
+
+def replicate_corpus(pdf_paths, copies, target_dir):
+    """Links copies of the bundled PDFs under new names, for a corpus copies times larger."""
+    os.makedirs(target_dir, exist_ok=True)
+    paths = []
+    for copy in range(copies):
+        for path in pdf_paths:
+            stem, ext = os.path.splitext(os.path.basename(path))
+            target = os.path.join(target_dir, f"{stem}-{copy}{ext}")
+            if not os.path.exists(target):
+                os.symlink(os.path.abspath(path), target)
+            paths.append(target)
+    return paths
+
+
+class IngestionBench:
+    """
+    Runs load_pdf_files, create_text_chunks, save_vector_store and the full
+    process_and_store_pdfs against fake embeddings and a delayed local vector index.
+    """
+
+    def __init__(self, workdir, embed_latency, embed_item_latency, index_latency, dimension):
+        self.workdir = workdir
+        self.embed_latency = embed_latency
+        self.embed_item_latency = embed_item_latency
+        self.index_latency = index_latency
+        self.dimension = dimension
+        self._runs = 0
+        # The local index of the latest run, left in place for the chat benchmark
+        self.index = None
+
+    def _fresh_backend(self):
+        """New fake embedding model and empty delayed local index, patched into the vector store module."""
+        from app.components import vector_store, ingestion_pipeline
+        from app.components.local_vector_index import LocalVectorIndex
+
+        self._runs += 1
+        embeddings = FakeEmbeddings(self.dimension, self.embed_latency, self.embed_item_latency)
+        index = DelayedIndex(LocalVectorIndex(os.path.join(self.workdir, f"index-{self._runs}")), self.index_latency)
+        vector_store.get_embeddings_model = lambda: embeddings
+        vector_store.get_local_index = lambda path=None: index
+        ingestion_pipeline.get_embeddings_model = lambda: embeddings
+        self.index = index._index
+        return embeddings, index
+
+    def load(self, paths, workers):
+        from app.components.pdf_loader import load_pdf_files
+
+        documents, seconds = timed(load_pdf_files, paths, workers=workers)
+        documents = documents or []
+        return documents, {
+            "seconds": seconds,
+            "files": len(paths),
+            "pages": len(documents),
+            "pages_per_sec": len(documents) / seconds if seconds > 0 else 0.0,
+            "max_rss_mb": max_rss_mb(),
+        }
+
+    def chunk(self, documents):
+        from app.components.pdf_loader import create_text_chunks
+
+        chunks, seconds = timed(create_text_chunks, documents)
+        chunks = chunks or []
+        return chunks, {
+            "seconds": seconds,
+            "pages": len(documents),
+            "chunks": len(chunks),
+            "chunks_per_sec": len(chunks) / seconds if seconds > 0 else 0.0,
+            "max_rss_mb": max_rss_mb(),
+        }
+
+    def compare_splitters(self, documents):
+        """
+        The old RecursiveCharacterTextSplitter against PageChunker on the same pages, with the
+        configured CHUNK_SIZE/CHUNK_OVERLAP: per-page chunking in characters and in tokens, and
+        chunks spanning pages.
+        """
+        from langchain.text_splitter import RecursiveCharacterTextSplitter
+        from app.components.chunker import PageChunker, count_tokens
+        from app.config.config import CHUNK_SIZE, CHUNK_OVERLAP
+
+        splitters = {
+            "recursive_character": RecursiveCharacterTextSplitter(chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP),
+            "page_chunker": PageChunker(CHUNK_SIZE, CHUNK_OVERLAP, unit="chars", across_pages=False),
+            "page_chunker_across_pages": PageChunker(CHUNK_SIZE, CHUNK_OVERLAP, unit="chars", across_pages=True),
+            # The same budget counted in tokens, at the estimated four characters a token
+            "page_chunker_tokens": PageChunker(CHUNK_SIZE // 4, CHUNK_OVERLAP // 4, unit="tokens", across_pages=False),
+        }
+        results = {}
+        for name, splitter in splitters.items():
+            chunks, seconds = timed(splitter.split_documents, documents)
+            results[name] = {
+                "seconds": seconds,
+                "pages": len(documents),
+                "chunks": len(chunks),
+                "pages_per_sec": len(documents) / seconds if seconds > 0 else 0.0,
+                "chunks_per_sec": len(chunks) / seconds if seconds > 0 else 0.0,
+                "mean_chunk_chars": sum(len(chunk.page_content) for chunk in chunks) / len(chunks) if chunks else 0.0,
+                "mean_chunk_tokens": sum(count_tokens(chunk.page_content) for chunk in chunks) / len(chunks) if chunks else 0.0,
+            }
+        return results
+
+    def save(self, chunks):
+        from app.components.vector_store import save_vector_store
+
+        embeddings, index = self._fresh_backend()
+        report, seconds = timed(save_vector_store, chunks)
+        report = report or {}
+        return {
+            "seconds": seconds,
+            "chunks": len(chunks),
+            "upserted": report.get("upserted", 0),
+            "chunks_per_sec": report.get("upserted", 0) / seconds if seconds > 0 else 0.0,
+            "embedding_calls": embeddings.counter.calls,
+            "index_calls": index.counter.calls,
+            "max_rss_mb": max_rss_mb(),
+        }
+
+    def process(self, paths):
+        """process_and_store_pdfs() from scratch over paths, linked into DATA_PATH."""
+        from app.components.data_loader import process_and_store_pdfs
+        from app.components.dedup_index import get_dedup_index
+        from app.components.lexical_index import get_lexical_index
+        from app.config.config import DATA_PATH
+
+        for path in (DATA_PATH, "vectorestore"):
+            shutil.rmtree(path, ignore_errors=True)
+        # The process-wide indexes would still hold the previous run's chunks
+        get_lexical_index().load(force=True)
+        get_dedup_index().load(force=True)
+        os.makedirs(DATA_PATH)
+        for path in paths:
+            os.symlink(os.path.abspath(path), os.path.join(DATA_PATH, os.path.basename(path)))
+
+        embeddings, index = self._fresh_backend()
+        summary, seconds = timed(process_and_store_pdfs)
+        summary = summary or {}
+        return {
+            "seconds": seconds,
+            "files": len(paths),
+            "chunks": summary.get("chunks", 0),
+            "chunks_deduplicated": summary.get("chunks_deduplicated", 0),
+            "failed_files": len(summary.get("failed_files", [])),
+            "chunks_per_sec": summary.get("chunks", 0) / seconds if seconds > 0 else 0.0,
+            "embedding_calls": embeddings.counter.calls,
+            "max_rss_mb": max_rss_mb(),
+        }
+
+
+def run_ingestion(workdir, pdf_paths, corpus_copies=1, synthetic_pages=0, parse_workers=1,
+                  embed_latency=0.0, embed_item_latency=0.0, index_latency=0.0, dimension=768):
+    from app.config.config import DATA_PATH
+
+    # load_pdf_files() refuses to run without DATA_PATH, even when given explicit paths
+    os.makedirs(DATA_PATH, exist_ok=True)
+    bench = IngestionBench(workdir, embed_latency, embed_item_latency, index_latency, dimension)
+    results = {}
+
+    corpora = {"bundled": pdf_paths}
+    if corpus_copies > 1:
+        corpora[f"bundled_x{corpus_copies}"] = replicate_corpus(pdf_paths, corpus_copies, os.path.join(workdir, "corpus"))
+
+    for name, paths in corpora.items():
+        logger.info(f"Benchmarking ingestion of corpus {name} ({len(paths)} files)")
+        documents = []
+        for workers in sorted({1, parse_workers}):
+            documents, results[f"load_pdf_files/{name}/workers={workers}"] = bench.load(paths, workers)
+        for splitter, result in bench.compare_splitters(documents).items():
+            results[f"chunking/{name}/{splitter}"] = result
+        chunks, results[f"create_text_chunks/{name}"] = bench.chunk(documents)
+        results[f"save_vector_store/{name}"] = bench.save(chunks)
+        del documents, chunks
+        results[f"process_and_store_pdfs/{name}"] = bench.process(paths)
+
+    if synthetic_pages:
+        name = f"synthetic_{synthetic_pages}_pages"
+        documents = synthetic_documents(synthetic_pages)
+        for splitter, result in bench.compare_splitters(documents).items():
+            results[f"chunking/{name}/{splitter}"] = result
+        chunks, results[f"create_text_chunks/{name}"] = bench.chunk(documents)
+        results[f"save_vector_store/{name}"] = bench.save(chunks)
+
+    return results
@@ -0,0 +1,54 @@
+import resource
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+
+def timed(fn, *args, **kwargs):
+    """Returns (result, seconds)."""
+    began = time.perf_counter()
+    result = fn(*args, **kwargs)
+    return result, time.perf_counter() - began
+
+
+def max_rss_mb():
+    """Peak resident set size of this process so far, in MB."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def summarize_latencies(latencies, wall_seconds, errors=0):
+    latencies = np.asarray(latencies, dtype=np.float64)
+    if not len(latencies):
+        return {"requests": 0, "errors": errors}
+    p50, p95, p99 = np.percentile(latencies, [50, 95, 99])
+    return {
+        "requests": int(len(latencies)),
+        "errors": errors,
+        "mean": float(latencies.mean()),
+        "p50": float(p50),
+        "p95": float(p95),
+        "p99": float(p99),
+        "max": float(latencies.max()),
+        "throughput_rps": float(len(latencies) / wall_seconds) if wall_seconds > 0 else 0.0,
+    }
+
+
+def drive_threads(fn, requests, concurrency):
+    """Calls fn(i) for i in range(requests) from concurrency threads; latency summary of the calls."""
+    def one(i):
+        began = time.perf_counter()
+        try:
+            fn(i)
+            return time.perf_counter() - began, False
+        except Exception:
+            return time.perf_counter() - began, True
+
+    began = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        outcomes = list(pool.map(one, range(requests)))
+    wall = time.perf_counter() - began
+    return summarize_latencies([seconds for seconds, _ in outcomes], wall, sum(failed for _, failed in outcomes))
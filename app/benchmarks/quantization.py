@@ -0,0 +1,72 @@
+import os
+import time
+
+import numpy as np
+
+from app.benchmarks.measure import summarize_latencies, timed
+
+from app.common.logger import get_logger
+
+logger = get_logger(__name__)
+
+
+def clustered_vectors(rows, dimension, clusters=200, spread=0.6, seed=0):
+    """Unit vectors scattered around random topic directions, roughly how text embeddings cluster."""
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((clusters, dimension)).astype(np.float32)
+    vectors = centers[rng.integers(0, clusters, rows)] + spread * rng.standard_normal((rows, dimension)).astype(np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def recall_at_k(found, exact):
+    """Share of the exact top-k rows that a search found, averaged over queries."""
+    return float(np.mean([len(set(f) & set(e)) / len(e) for f, e in zip(found, exact)]))
+
+
+def _build(workdir, vectors, quantization, rerank_factor):
+    from app.components.local_vector_index import LocalVectorIndex
+
+    # No IVF, so recall measures the quantization alone
+    index = LocalVectorIndex(os.path.join(workdir, f"quantization-{quantization}"), ivf_min_rows=len(vectors) + 1,
+                             quantization=quantization, rerank_factor=rerank_factor)
+    index.upsert(vectors=[{"id": str(i), "values": vector} for i, vector in enumerate(vectors)])
+    _, seconds = timed(index.commit)
+    return index, seconds
+
+
+def run_quantization(workdir, rows=20000, dimension=768, queries=200, k=10, rerank_factors=(1, 10),
+                     modes=("none", "int8", "pq")):
+    """
+    The local index with float32, int8 and PQ search vectors over the same synthetic
+    embeddings: bytes per vector, commit time, query latency and recall@k against exact
+    search, with the approximate scores alone (rerank factor 1) and with exact re-ranking.
+    """
+    vectors = clustered_vectors(rows, dimension)
+    rng = np.random.default_rng(1)
+    probes = vectors[rng.integers(0, rows, queries)] + 0.3 * rng.standard_normal((queries, dimension)).astype(np.float32)
+    exact = np.argsort(-(probes / np.linalg.norm(probes, axis=1, keepdims=True)) @ vectors.T, axis=1)[:, :k]
+
+    results = {}
+    for mode in modes:
+        logger.info(f"Benchmarking local index search with quantization={mode} over {rows} vectors")
+        index, commit_seconds = _build(workdir, vectors, mode, rerank_factors[0])
+        stats = index.memory_stats()
+        for factor in (rerank_factors if mode != "none" else rerank_factors[:1]):
+            index.rerank_factor = factor
+            latencies, found = [], []
+            began = time.perf_counter()
+            for probe in probes:
+                matches, seconds = timed(index.query, probe, k)
+                latencies.append(seconds)
+                found.append([int(chunk_id) for _, chunk_id, _ in matches])
+            summary = summarize_latencies(latencies, time.perf_counter() - began)
+            name = mode if mode == "none" else f"{mode}/rerank={factor}"
+            results[name] = {
+                **summary,
+                "recall_at_k": recall_at_k(found, exact),
+                "k": k,
+                "commit_seconds": commit_seconds,
+                "bytes_per_vector": stats["bytes_per_vector"],
+                "compression": stats["compression"],
+            }
+    return results
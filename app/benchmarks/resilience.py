@@ -0,0 +1,108 @@
+from app.benchmarks.fakes import HttpEmbeddings, StubEmbeddingServer
+from app.benchmarks.measure import drive_threads
+
+from app.common.logger import get_logger
+
+logger = get_logger(__name__)
+
+
+def _counters(dependency):
+    from app.common.resilience import DEPENDENCY_CALLS, DEPENDENCY_HEDGES, DEPENDENCY_RETRIES
+
+    name = dependency.name
+    return {
+        "ok": DEPENDENCY_CALLS.value(dependency=name, result="ok"),
+        "rejected": DEPENDENCY_CALLS.value(dependency=name, result="rejected"),
+        "retries": DEPENDENCY_RETRIES.value(dependency=name),
+        "hedges_sent": DEPENDENCY_HEDGES.value(dependency=name, result="sent"),
+        "hedges_won": DEPENDENCY_HEDGES.value(dependency=name, result="won"),
+    }
+
+
+def _pooling(requests, concurrency, latency):
+    import httpx
+
+    results = {}
+    with StubEmbeddingServer(latency=latency) as server:
+        for mode in ("unpooled", "pooled"):
+            client = httpx.Client() if mode == "pooled" else None
+            embeddings = HttpEmbeddings(server.url, client)
+            opened = server.connections.stats()["calls"]
+            results[mode] = drive_threads(lambda i: embeddings.embed_query(f"question {i}"), requests, concurrency)
+            results[mode]["connections"] = server.connections.stats()["calls"] - opened
+            if client is not None:
+                client.close()
+    return results
+
+
+def _hedging(requests, concurrency, latency, slow_latency, slow_rate):
+    import httpx
+    from app.common.resilience import Dependency
+
+    results = {}
+    with StubEmbeddingServer(latency=latency, slow_latency=slow_latency, slow_rate=slow_rate) as server, \
+            httpx.Client() as client:
+        embeddings = HttpEmbeddings(server.url, client)
+        for mode in ("off", "on"):
+            dependency = Dependency(f"bench-hedging-{mode}", timeout=10.0, hedging=mode == "on")
+            # Primes the latency window the hedge delay is taken from
+            for i in range(30):
+                dependency.call(lambda: embeddings.embed_query(f"warm-up {i}"), idempotent=True)
+            before = _counters(dependency)
+            results[mode] = drive_threads(
+                lambda i: dependency.call(lambda: embeddings.embed_query(f"question {i}"), idempotent=True),
+                requests, concurrency)
+            after = _counters(dependency)
+            results[mode].update({key: after[key] - before[key] for key in ("hedges_sent", "hedges_won")})
+    return results
+
+
+def _outage(requests, latency):
+    import httpx
+    from app.common.resilience import CircuitBreaker, Dependency
+
+    results = {}
+    with StubEmbeddingServer(latency=latency) as server, httpx.Client() as client:
+        embeddings = HttpEmbeddings(server.url, client)
+        server.status = 503
+        for mode in ("no_breaker", "breaker"):
+            name = f"bench-outage-{mode}"
+            threshold = 5 if mode == "breaker" else 0
+            dependency = Dependency(name, timeout=2.0, breaker=CircuitBreaker(name, failure_threshold=threshold))
+            served = server.counter.stats()["calls"]
+            results[mode] = drive_threads(
+                lambda i: dependency.call(lambda: embeddings.embed_query(f"question {i}"), idempotent=True),
+                requests, 1)
+            results[mode]["server_requests"] = server.counter.stats()["calls"] - served
+            results[mode]["rejected"] = _counters(dependency)["rejected"]
+    return results
+
+
+def _deadline(requests, hang, timeout):
+    import httpx
+    from app.common.resilience import CircuitBreaker, Dependency
+
+    with StubEmbeddingServer() as server, httpx.Client() as client:
+        embeddings = HttpEmbeddings(server.url, client)
+        server.hang = hang
+        name = "bench-deadline"
+        dependency = Dependency(name, timeout=timeout, breaker=CircuitBreaker(name, failure_threshold=0))
+        result = drive_threads(lambda i: dependency.call(lambda: embeddings.embed_query(f"question {i}")), requests, 1)
+        result.update({"hang": hang, "timeout": timeout})
+        return result
+
+
+def run_resilience(requests=400, concurrency=8, latency=0.005, slow_latency=0.2, slow_rate=0.05):
+    """
+    The outbound resilience layer against a local stub HTTP embedding service: pooled
+    against per-call connections, p50/p99 with and without hedging under a slow tail,
+    per-call cost during an outage with and without the circuit breaker, and how long a
+    caller waits on a hung server.
+    """
+    logger.info(f"Benchmarking outbound calls against a stub server: {requests} requests, concurrency {concurrency}")
+    return {
+        "pooling": _pooling(requests, concurrency, latency),
+        "hedging": _hedging(requests, concurrency, latency, slow_latency, slow_rate),
+        "outage": _outage(max(20, requests // 20), latency),
+        "deadline": _deadline(5, hang=2.0, timeout=0.25),
+    }
@@ -0,0 +1,188 @@
+"""
+Offline benchmark suite. Runs the real ingestion and chat code paths against deterministic
+local stand-ins for Google embeddings, Groq, Pinecone and Mongo (see fakes.py), with
+injected latency, and writes the results as JSON so runs can be compared between commits.
+
+    python -m app.benchmarks.run --output bench.json
+    python -m app.benchmarks.run --suite chat --llm-latency 0.3 --concurrency 1,8,32
+    python -m app.benchmarks.run --output new.json --compare bench.json
+    python -m app.benchmarks.run --suite concurrency --concurrency 1,16,64
+    python -m app.benchmarks.run --suite startup
+    python -m app.benchmarks.run --suite quantization --quantization-rows 100000
+    python -m app.benchmarks.run --suite resilience --hedge-slow-rate 0.1
+    python -m app.benchmarks.run --suite coalescing --concurrency 1,16,64
+"""
+import argparse
+import glob
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Metrics where lower is better; everything else numeric is compared as higher-is-better
+_LOWER_IS_BETTER = ("seconds", "mean", "p50", "p95", "p99", "max", "ttft_p50", "ttft_p95", "max_rss_mb",
+                    "bytes_per_vector", "upstream_calls")
+_COMPARED = _LOWER_IS_BETTER + ("throughput_rps", "chunks_per_sec", "pages_per_sec", "recall_at_k")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--suite", choices=("all", "ingestion", "chat", "concurrency", "startup", "quantization",
+                                            "resilience", "coalescing"), default="all")
+    parser.add_argument("--output", help="Write the JSON results here (default: stdout)")
+    parser.add_argument("--compare", help="Earlier results file to print a comparison against")
+    parser.add_argument("--data-dir", default=os.path.join(REPO_ROOT, "data"), help="PDFs to ingest")
+    parser.add_argument("--corpus-copies", type=int, default=2, help="Also ingest this many copies of the PDFs")
+    parser.add_argument("--synthetic-pages", type=int, default=5000, help="Pages of a synthetic corpus (0 to skip)")
+    parser.add_argument("--parse-workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--concurrency", default="1,4,16", help="Comma-separated chat concurrency levels")
+    parser.add_argument("--requests", type=int, default=200, help="Chat requests per concurrency level")
+    parser.add_argument("--questions", type=int, default=50, help="Distinct chat questions")
+    parser.add_argument("--answer-cache", action="store_true", help="Leave the semantic answer cache on")
+    parser.add_argument("--dimension", type=int, default=768)
+    parser.add_argument("--embed-latency", type=float, default=0.05, help="Seconds per embedding call")
+    parser.add_argument("--embed-item-latency", type=float, default=0.0, help="Extra seconds per embedded text")
+    parser.add_argument("--index-latency", type=float, default=0.02, help="Seconds per vector index call")
+    parser.add_argument("--llm-latency", type=float, default=0.2, help="Seconds to the LLM's first token")
+    parser.add_argument("--token-latency", type=float, default=0.0, help="Seconds per streamed LLM token")
+    parser.add_argument("--mongo-latency", type=float, default=0.01, help="Seconds per Mongo write")
+    parser.add_argument("--import-runs", type=int, default=5, help="Fresh interpreters per import-time measurement")
+    parser.add_argument("--quantization-rows", type=int, default=20000, help="Vectors in the quantization benchmark")
+    parser.add_argument("--hedge-slow-latency", type=float, default=0.2,
+                        help="Seconds the stub server takes on its slow requests, in the resilience benchmark")
+    parser.add_argument("--hedge-slow-rate", type=float, default=0.05, help="Share of slow stub server requests")
+    return parser.parse_args(argv)
+
+
+def _git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], cwd=REPO_ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except Exception:
+        return None
+
+
+def _prepare_environment(args, workdir):
+    # All relative paths (vectorestore/, data2/, logs/) resolve inside the scratch directory,
+    # and the settings must be in place before app.config is first imported
+    os.chdir(workdir)
+    os.environ["VECTOR_STORE_BACKEND"] = "local"
+    os.environ["EMBEDDING_CACHE_ENABLED"] = "false"
+    os.environ["ANSWER_CACHE_ENABLED"] = "true" if args.answer_cache else "false"
+    os.environ["WARMUP_ON_START"] = "false"
+    os.environ["PDF_PARSE_WORKERS"] = str(args.parse_workers)
+
+
+def _flatten(results, prefix=""):
+    for key, value in results.items():
+        name = f"{prefix}{key}"
+        if isinstance(value, dict):
+            yield from _flatten(value, f"{name}.")
+        elif isinstance(value, (int, float)) and key in _COMPARED:
+            yield name, value
+
+
+def compare(current, baseline):
+    """Lines of 'metric: old -> new (change)', flagging changes for the worse by more than 10%."""
+    old = dict(_flatten(baseline["results"]))
+    lines = []
+    for name, value in _flatten(current["results"]):
+        if name not in old or not old[name]:
+            continue
+        change = (value - old[name]) / old[name]
+        worse = change > 0.1 if name.rsplit(".", 1)[-1] in _LOWER_IS_BETTER else change < -0.1
+        lines.append(f"{'REGRESSION ' if worse else ''}{name}: {old[name]:.4g} -> {value:.4g} ({change:+.1%})")
+    return lines
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    pdf_paths = sorted(os.path.abspath(path) for path in glob.glob(os.path.join(args.data_dir, "*.pdf")))
+    compare_with = os.path.abspath(args.compare) if args.compare else None
+    output = os.path.abspath(args.output) if args.output else None
+
+    workdir = tempfile.mkdtemp(prefix="rag-bench-")
+    _prepare_environment(args, workdir)
+
+    from app.benchmarks.chat import run_chat
+    from app.benchmarks.ingestion import IngestionBench, run_ingestion
+
+    report = {
+        "meta": {
+            "commit": _git_commit(),
+            "timestamp": time.time(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "args": vars(args),
+            "workdir": workdir,
+        },
+        "results": {},
+    }
+
+    began = time.perf_counter()
+    if args.suite in ("all", "startup"):
+        # Measured first, in fresh interpreters, so nothing imported here can hide a slow import
+        from app.benchmarks.startup import run_startup
+        report["results"]["startup"] = run_startup(REPO_ROOT, args.import_runs)
+
+    if args.suite in ("all", "ingestion"):
+        report["results"]["ingestion"] = run_ingestion(
+            workdir, pdf_paths, args.corpus_copies, args.synthetic_pages, args.parse_workers,
+            args.embed_latency, args.embed_item_latency, args.index_latency, args.dimension)
+
+    if args.suite in ("all", "quantization"):
+        from app.benchmarks.quantization import run_quantization
+        report["results"]["quantization"] = run_quantization(workdir, args.quantization_rows, args.dimension)
+
+    if args.suite in ("all", "resilience"):
+        from app.benchmarks.resilience import run_resilience
+        report["results"]["resilience"] = run_resilience(
+            args.requests * 2, max(int(level) for level in args.concurrency.split(",")), 0.005,
+            args.hedge_slow_latency, args.hedge_slow_rate)
+
+    if args.suite in ("all", "coalescing"):
+        from app.benchmarks.coalescing import run_coalescing
+        report["results"]["coalescing"] = run_coalescing(
+            [int(level) for level in args.concurrency.split(",")], args.requests, args.questions,
+            args.embed_latency, args.llm_latency, args.dimension)
+
+    if args.suite in ("all", "chat", "concurrency"):
+        from app.components.lexical_index import get_lexical_index
+
+        # The chat benchmarks need an index over the bundled PDFs, built without injected latency
+        bench = IngestionBench(workdir, 0.0, 0.0, 0.0, args.dimension)
+        bench.process(pdf_paths)
+        texts = get_lexical_index().load(force=True).texts
+        levels = [int(level) for level in args.concurrency.split(",")]
+        latencies = dict(embed_latency=args.embed_latency, index_latency=args.index_latency,
+                         llm_latency=args.llm_latency, token_latency=args.token_latency,
+                         mongo_latency=args.mongo_latency, dimension=args.dimension)
+        if args.suite in ("all", "chat"):
+            report["results"]["chat"] = run_chat(bench.index, texts, levels, args.requests, args.questions, **latencies)
+        if args.suite in ("all", "concurrency"):
+            from app.benchmarks.concurrency import run_concurrency
+            report["results"]["concurrency"] = run_concurrency(
+                bench.index, texts, levels, args.requests, args.questions, **latencies)
+    report["meta"]["seconds"] = time.perf_counter() - began
+
+    text = json.dumps(report, indent=2)
+    if output:
+        with open(output, "w", encoding="utf-8") as f:
+            f.write(text)
+    else:
+        print(text)
+
+    if compare_with:
+        with open(compare_with, "r", encoding="utf-8") as f:
+            lines = compare(report, json.load(f))
+        print("\n".join(lines), file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
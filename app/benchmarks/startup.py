@@ -0,0 +1,78 @@
+import json
+import os
+import subprocess
+import sys
+import time
+
+import numpy as np
+
+from app.common.logger import get_logger
+
+logger = get_logger(__name__)
+
+# Entry points a worker imports before it can take traffic
+ENTRY_MODULES = ("app.application", "app.asgi_application")
+# Heavy client libraries that must only load on first use or in the warm-up stage
+LAZY_MODULES = ("pinecone", "langchain_pinecone", "langchain_google_genai", "langchain_groq",
+                "pymongo", "langchain_community", "langchain.chains", "pypdf")
+
+_PROBE = """
+import json, sys, time
+began = time.perf_counter()
+import {module}
+seconds = time.perf_counter() - began
+print(json.dumps({{"seconds": seconds, "eager": [m for m in {lazy!r} if m in sys.modules]}}))
+"""
+
+
+def _run(args, repo_root):
+    env = dict(os.environ, PYTHONPATH=repo_root + os.pathsep + os.environ.get("PYTHONPATH", ""))
+    began = time.perf_counter()
+    completed = subprocess.run([sys.executable, *args], env=env, capture_output=True, text=True, check=True)
+    return completed, time.perf_counter() - began
+
+
+def slowest_imports(module, repo_root, count=10):
+    """The count slowest imports (cumulative seconds) under module, from python -X importtime."""
+    completed, _ = _run(["-X", "importtime", "-c", f"import {module}"], repo_root)
+    rows = []
+    for line in completed.stderr.splitlines():
+        parts = line.split("|")
+        if len(parts) == 3 and parts[1].strip().isdigit():
+            rows.append((int(parts[1]) / 1e6, parts[2].strip()))
+    return [{"module": name, "seconds": seconds} for seconds, name in sorted(rows, reverse=True)[:count]]
+
+
+def measure_import(module, repo_root, runs=5):
+    """Imports module in runs fresh interpreters; the first, untimed run fills the bytecode cache."""
+    _run(["-c", _PROBE.format(module=module, lazy=LAZY_MODULES)], repo_root)
+    import_seconds, process_seconds, eager = [], [], set()
+    for _ in range(runs):
+        completed, wall = _run(["-c", _PROBE.format(module=module, lazy=LAZY_MODULES)], repo_root)
+        probe = json.loads(completed.stdout.strip().splitlines()[-1])
+        import_seconds.append(probe["seconds"])
+        process_seconds.append(wall)
+        eager.update(probe["eager"])
+    return {
+        "runs": runs,
+        "p50": float(np.percentile(import_seconds, 50)),
+        "max": float(max(import_seconds)),
+        # Interpreter start included, i.e. what a freshly forked/spawned worker pays
+        "process": {"p50": float(np.percentile(process_seconds, 50))},
+        "eager_modules": sorted(eager),
+        "slowest_imports": slowest_imports(module, repo_root),
+    }
+
+
+def run_startup(repo_root, runs=5, modules=ENTRY_MODULES):
+    """
+    Import time of the web app entry points, each in a fresh interpreter. Lists any
+    LAZY_MODULES that got imported eagerly, which means startup has regressed.
+    """
+    results = {}
+    for module in modules:
+        logger.info(f"Measuring import time of {module}")
+        results[module] = measure_import(module, repo_root, runs)
+        if results[module]["eager_modules"]:
+            logger.warning(f"{module} imports {results[module]['eager_modules']} eagerly")
+    return results
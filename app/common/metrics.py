@@ -0,0 +1,283 @@
+"""
+Timing spans and Prometheus-style counters/histograms, with no client library needed.
+
+    with span("llm"):
+        ...
+
+observes the block's duration in the rag_stage_seconds{stage="llm"} histogram and, when
+REQUEST_TIMING_LOG is on, adds it to the timing log line of the current request or ingestion
+run. With METRICS_ENABLED off span() hands back one shared no-op object, so the cost is a
+function call.
+"""
+import bisect
+import contextvars
+import functools
+import threading
+import time
+
+from app.config.config import METRICS_ENABLED, REQUEST_TIMING_LOG
+from app.common.logger import get_logger
+
+logger = get_logger(__name__)
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def _label_key(labelnames, labels):
+    return tuple(str(labels.get(name, "")) for name in labelnames)
+
+
+def _escape(value):
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(labelnames, key, extra=()):
+    pairs = list(zip(labelnames, key)) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def inc(self, amount=1, **labels):
+        key = _label_key(self.labelnames, labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        with self._lock:
+            return self._values.get(_label_key(self.labelnames, labels), 0)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._lock = threading.Lock()
+        # label key -> [per-bucket counts (last one is +Inf), sum]
+        self._series = {}
+
+    def observe(self, value, **labels):
+        key = _label_key(self.labelnames, labels)
+        slot = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][slot] += 1
+            series[1] += value
+
+    def snapshot(self, **labels):
+        """(count, sum) of one series."""
+        with self._lock:
+            series = self._series.get(_label_key(self.labelnames, labels))
+            return (sum(series[0]), series[1]) if series else (0, 0.0)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = sorted((key, list(counts), total) for key, (counts, total) in self._series.items())
+        for key, counts, total in series:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = _format_labels(self.labelnames, key, [("le", _format_value(bound))])
+                lines.append(f"{self.name}_bucket{le} {cumulative}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+class Registry:
+    """Named metrics plus callbacks that report other modules' stats() at scrape time."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._metrics = {}
+        self._callbacks = {}
+
+    def _get_or_create(self, cls, name, *args, **kwargs):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = cls(name, *args, **kwargs)
+            return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._get_or_create(Counter, name, documentation, labelnames)
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._get_or_create(Histogram, name, documentation, labelnames, buckets)
+
+    def register_callback(self, name, documentation, fn, kind="gauge", labelname=None):
+        """
+        fn() returns a number, or a dict of label value -> number when labelname is given.
+        Registering the same name again replaces the callback.
+        """
+        with self._lock:
+            self._callbacks[name] = (documentation, fn, kind, labelname)
+
+    def _render_callback(self, name, documentation, fn, kind, labelname):
+        try:
+            values = fn()
+        except Exception as e:
+            logger.warning(f"Metrics callback {name} failed: {e}")
+            return []
+        if values is None:
+            return []
+        lines = [f"# HELP {name} {documentation}", f"# TYPE {name} {kind}"]
+        if labelname is None:
+            lines.append(f"{name} {_format_value(values)}")
+        else:
+            for label, value in sorted(values.items()):
+                lines.append(f"{name}{_format_labels((labelname,), (str(label),))} {_format_value(value)}")
+        return lines
+
+    def render(self):
+        """All metrics in the Prometheus text exposition format (version 0.0.4)."""
+        with self._lock:
+            metrics = [self._metrics[name] for name in sorted(self._metrics)]
+            callbacks = sorted(self._callbacks.items())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        for name, callback in callbacks:
+            lines.extend(self._render_callback(name, *callback))
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+STAGE_SECONDS = REGISTRY.histogram(
+    "rag_stage_seconds", "Time spent in each stage of the chat and ingestion paths", ("stage",))
+STAGE_ERRORS = REGISTRY.counter(
+    "rag_stage_errors_total", "Stages that ended with an exception", ("stage",))
+OPERATION_SECONDS = REGISTRY.histogram(
+    "rag_operation_seconds", "End-to-end latency of HTTP requests (by endpoint) and ingestion runs", ("operation",))
+OPERATIONS = REGISTRY.counter(
+    "rag_operations_total", "HTTP requests and ingestion runs by outcome", ("operation", "status"))
+
+# Spans of the operation being timed in this context; None when timing isn't being logged
+_timings = contextvars.ContextVar("timings", default=None)
+
+
+def record(stage, seconds, failed=False):
+    """Records a stage duration measured elsewhere, e.g. by a LangChain callback."""
+    if not METRICS_ENABLED:
+        return
+    STAGE_SECONDS.observe(seconds, stage=stage)
+    if failed:
+        STAGE_ERRORS.inc(stage=stage)
+    timings = _timings.get()
+    if timings is not None:
+        timings.append((stage, seconds))
+
+
+def timings_context():
+    """A copy of the current context, for running a helper thread whose spans belong to this operation."""
+    return contextvars.copy_context()
+
+
+class _Span:
+    __slots__ = ("stage", "began")
+
+    def __init__(self, stage):
+        self.stage = stage
+
+    def __enter__(self):
+        self.began = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        record(self.stage, time.perf_counter() - self.began, exc_type is not None)
+        return False
+
+
+class _NoopSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_NOOP_SPAN = _NoopSpan()
+
+
+def span(stage):
+    """Context manager timing a block as the given stage."""
+    return _Span(stage) if METRICS_ENABLED else _NOOP_SPAN
+
+
+def timed_stage(stage):
+    """Decorator timing every call of a function as the given stage; a no-op when metrics are off."""
+    def decorate(fn):
+        if not METRICS_ENABLED:
+            return fn
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with _Span(stage):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+def begin_timing():
+    """Starts timing an operation; pass the result to end_timing() when it's done."""
+    token = _timings.set([]) if METRICS_ENABLED and REQUEST_TIMING_LOG else None
+    return token, time.perf_counter()
+
+
+def end_timing(state, operation, status="ok"):
+    """Observes the operation's latency and, with REQUEST_TIMING_LOG on, logs its stages on one line."""
+    if not METRICS_ENABLED:
+        return
+    token, began = state
+    total = time.perf_counter() - began
+    OPERATION_SECONDS.observe(total, operation=operation)
+    OPERATIONS.inc(operation=operation, status=status)
+    if token is None:
+        return
+    timings = _timings.get()
+    try:
+        _timings.reset(token)
+    except ValueError:
+        # Ended from a different context than it began in, e.g. after a streamed response
+        pass
+
+    stages = {}
+    for stage, seconds in timings or ():
+        stages[stage] = stages.get(stage, 0.0) + seconds
+    fields = "".join(f" {stage}={seconds * 1000:.1f}ms" for stage, seconds in stages.items())
+    logger.info(f"timing operation={operation} status={status} total={total * 1000:.1f}ms{fields}")
+
+
+def render():
+    return REGISTRY.render()
@@ -0,0 +1,395 @@
+"""
+Resilience for outbound calls: a deadline per call, jittered retries within it, a circuit
+breaker per dependency and, for idempotent calls, optional hedging.
+
+    pinecone = get_dependency("pinecone")
+    results = pinecone.call(lambda: index.query(vector=vector, top_k=5), idempotent=True)
+
+A call runs on the dependency's bounded thread pool, so the caller stops waiting at the
+deadline even when the client library has no timeout of its own; the client's own timeout
+(set where the client is built) is what eventually frees the thread.
+"""
+import asyncio
+import contextvars
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from app.config.config import *
+from app.common.custom_exception import CustomException
+from app.common.logger import get_logger
+from app.common.metrics import REGISTRY
+
+logger = get_logger(__name__)
+
+_RETRYABLE_MARKERS = ("429", "rate limit", "resource_exhausted", "quota", "timeout", "temporarily", "unavailable")
+
+# Latencies kept per dependency for the hedge delay, and how many are needed before hedging
+_LATENCY_WINDOW = 200
+_HEDGE_MIN_SAMPLES = 20
+
+DEPENDENCY_CALLS = REGISTRY.counter(
+    "rag_dependency_calls_total", "Outbound calls by dependency and outcome (ok, error, timeout, rejected)",
+    ("dependency", "result"))
+DEPENDENCY_RETRIES = REGISTRY.counter(
+    "rag_dependency_retries_total", "Outbound attempts retried after a retryable error", ("dependency",))
+DEPENDENCY_HEDGES = REGISTRY.counter(
+    "rag_dependency_hedges_total", "Hedged requests sent, and how many answered first", ("dependency", "result"))
+
+
+class CircuitOpenError(CustomException):
+    """Raised instead of calling a dependency whose circuit is open."""
+
+    def __init__(self, dependency, retry_in):
+        super().__init__(f"Circuit for '{dependency}' is open (unavailable), retry in {retry_in:.1f}s")
+        self.dependency = dependency
+        self.retry_in = retry_in
+
+
+def is_retryable(error):
+    """True for throttling (429) and transient errors (5xx, timeouts, dropped connections)."""
+    if isinstance(error, CircuitOpenError):
+        return False
+    if isinstance(error, (TimeoutError, ConnectionError)):
+        return True
+    status = getattr(error, "status", None) or getattr(error, "status_code", None) or getattr(error, "code", None)
+    if isinstance(status, int) and (status == 429 or status >= 500):
+        return True
+    message = str(error).lower()
+    return any(marker in message for marker in _RETRYABLE_MARKERS)
+
+
+def backoff_delay(attempt, base_delay, max_delay):
+    """Exponential backoff with full jitter."""
+    return random.uniform(0, min(max_delay, base_delay * (2 ** attempt)))
+
+
+def call_with_backoff(fn, *args, max_retries=UPSERT_MAX_RETRIES, base_delay=UPSERT_BACKOFF_BASE,
+                      max_delay=UPSERT_BACKOFF_MAX, **kwargs):
+    """
+    Calls fn, retrying retryable errors with exponential backoff and full jitter. An open
+    circuit is waited out once if it lets a trial call through within max_delay, and
+    otherwise fails at once.
+    """
+    attempt, waited = 0, False
+    while True:
+        try:
+            return fn(*args, **kwargs)
+        except CircuitOpenError as e:
+            if waited or e.retry_in > max_delay:
+                raise
+            waited = True
+            logger.warning(f"{e}, waiting it out once")
+            time.sleep(e.retry_in)
+            continue
+        except Exception as e:
+            if attempt >= max_retries or not is_retryable(e):
+                raise
+            delay = backoff_delay(attempt, base_delay, max_delay)
+            attempt += 1
+            logger.warning(f"Retryable error ({e}), retry {attempt}/{max_retries} in {delay:.2f}s")
+            time.sleep(delay)
+
+
+class CircuitBreaker:
+    """
+    Closed until failure_threshold consecutive failures, then open: calls are rejected for
+    reset_timeout seconds. After that it is half-open and lets one trial call through; its
+    success closes the circuit, its failure opens it again. A trial that never reports back
+    (e.g. a cancelled stream) is given up on after another reset_timeout.
+    """
+
+    def __init__(self, name, failure_threshold=CIRCUIT_FAILURE_THRESHOLD, reset_timeout=CIRCUIT_RESET_TIMEOUT,
+                 clock=time.monotonic):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.clock = clock
+        self._lock = threading.Lock()
+        self._state = "closed"
+        self._failures = 0
+        self._opened_at = 0.0
+        self._trial_started = None
+
+    @property
+    def state(self):
+        with self._lock:
+            if self._state == "open" and self.clock() - self._opened_at >= self.reset_timeout:
+                return "half_open"
+            return self._state
+
+    def before(self):
+        """Raises CircuitOpenError if a call must not be made now."""
+        if self.failure_threshold <= 0:
+            return
+        with self._lock:
+            now = self.clock()
+            if self._state == "closed":
+                return
+            if self._state == "open":
+                retry_in = self.reset_timeout - (now - self._opened_at)
+                if retry_in > 0:
+                    raise CircuitOpenError(self.name, retry_in)
+                self._state = "half_open"
+                self._trial_started = None
+            if self._trial_started is not None and now - self._trial_started < self.reset_timeout:
+                raise CircuitOpenError(self.name, self.reset_timeout - (now - self._trial_started))
+            self._trial_started = now
+
+    def success(self):
+        with self._lock:
+            if self._state != "closed":
+                logger.info(f"Circuit for '{self.name}' closed")
+            self._state = "closed"
+            self._failures = 0
+            self._trial_started = None
+
+    def failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._state == "half_open" or (self._state == "closed" and 0 < self.failure_threshold <= self._failures):
+                if self._state == "closed":
+                    logger.warning(f"Circuit for '{self.name}' opened after {self._failures} failures")
+                self._state = "open"
+                self._opened_at = self.clock()
+                self._trial_started = None
+
+
+class Dependency:
+    """
+    One remote service: its deadline, retry budget, circuit breaker, thread pool and recent
+    latencies. call() and acall() run a no-argument function (or coroutine function) under
+    all of them. Only retryable errors count against the circuit; anything else means the
+    service answered.
+    """
+
+    def __init__(self, name, timeout, max_retries=OUTBOUND_MAX_RETRIES, hedging=HEDGING_ENABLED,
+                 max_workers=OUTBOUND_MAX_WORKERS, breaker=None):
+        self.name = name
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.hedging = hedging
+        self.max_workers = max_workers
+        self.breaker = breaker or CircuitBreaker(name)
+        self._latencies = deque(maxlen=_LATENCY_WINDOW)
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def _pool(self):
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(max_workers=self.max_workers,
+                                                        thread_name_prefix=f"outbound-{self.name}")
+        return self._executor
+
+    def hedge_delay(self):
+        """Seconds after which an idempotent call is sent again, or None while hedging is off or unprimed."""
+        if not self.hedging:
+            return None
+        with self._lock:
+            latencies = sorted(self._latencies)
+        if len(latencies) < _HEDGE_MIN_SAMPLES:
+            return None
+        return max(HEDGE_MIN_DELAY, latencies[int(0.95 * (len(latencies) - 1))])
+
+    def record_success(self, seconds=None):
+        if seconds is not None:
+            with self._lock:
+                self._latencies.append(seconds)
+        self.breaker.success()
+        DEPENDENCY_CALLS.inc(dependency=self.name, result="ok")
+
+    def record_failure(self, error):
+        if is_retryable(error):
+            self.breaker.failure()
+        else:
+            self.breaker.success()
+        result = "timeout" if isinstance(error, TimeoutError) else "error"
+        DEPENDENCY_CALLS.inc(dependency=self.name, result=result)
+
+    def admit(self):
+        """Raises CircuitOpenError (and counts the rejection) if a call must not be made now."""
+        try:
+            self.breaker.before()
+        except CircuitOpenError:
+            DEPENDENCY_CALLS.inc(dependency=self.name, result="rejected")
+            raise
+
+    def _submit(self, fn):
+        # Spans recorded inside the call still land in the caller's request timings
+        return self._pool().submit(contextvars.copy_context().run, fn)
+
+    def _attempt(self, fn, remaining, hedge):
+        began = time.perf_counter()
+        futures = [self._submit(fn)]
+        delay = self.hedge_delay() if hedge else None
+        if delay is not None and delay < remaining and not wait(futures, timeout=delay).done:
+            futures.append(self._submit(fn))
+            DEPENDENCY_HEDGES.inc(dependency=self.name, result="sent")
+        pending = set(futures)
+        error = None
+        while pending:
+            done, pending = wait(pending, timeout=max(0.0, remaining - (time.perf_counter() - began)),
+                                 return_when=FIRST_COMPLETED)
+            if not done:
+                break
+            for future in done:
+                if future.exception() is None:
+                    for other in pending:
+                        other.cancel()
+                    if len(futures) > 1 and future is futures[-1]:
+                        DEPENDENCY_HEDGES.inc(dependency=self.name, result="won")
+                    return future.result(), time.perf_counter() - began
+                error = future.exception()
+        for future in pending:
+            future.cancel()
+        if error is not None and not pending:
+            raise error
+        raise TimeoutError(f"'{self.name}' did not answer within {remaining:.2f}s")
+
+    def call(self, fn, idempotent=False, retries=None):
+        """fn() under the deadline; retried (and hedged, if idempotent) on retryable errors."""
+        retries = (self.max_retries if idempotent else 0) if retries is None else retries
+        deadline = time.perf_counter() + self.timeout
+        attempt = 0
+        while True:
+            self.admit()
+            try:
+                result, seconds = self._attempt(fn, deadline - time.perf_counter(), idempotent)
+            except Exception as e:
+                self.record_failure(e)
+                delay = backoff_delay(attempt, OUTBOUND_BACKOFF_BASE, OUTBOUND_BACKOFF_MAX)
+                if attempt >= retries or not is_retryable(e) or time.perf_counter() + delay >= deadline:
+                    raise
+                attempt += 1
+                DEPENDENCY_RETRIES.inc(dependency=self.name)
+                logger.warning(f"'{self.name}' call failed ({e}), retry {attempt}/{retries} in {delay:.2f}s")
+                time.sleep(delay)
+                continue
+            self.record_success(seconds)
+            return result
+
+    async def _aattempt(self, fn, remaining, hedge):
+        began = time.perf_counter()
+        tasks = [asyncio.ensure_future(fn())]
+        delay = self.hedge_delay() if hedge else None
+        try:
+            if delay is not None and delay < remaining and not (await asyncio.wait(tasks, timeout=delay))[0]:
+                tasks.append(asyncio.ensure_future(fn()))
+                DEPENDENCY_HEDGES.inc(dependency=self.name, result="sent")
+            pending = set(tasks)
+            error = None
+            while pending:
+                done, pending = await asyncio.wait(pending, timeout=max(0.0, remaining - (time.perf_counter() - began)),
+                                                   return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    break
+                for task in done:
+                    if task.exception() is None:
+                        if len(tasks) > 1 and task is tasks[-1]:
+                            DEPENDENCY_HEDGES.inc(dependency=self.name, result="won")
+                        return task.result(), time.perf_counter() - began
+                    error = task.exception()
+            if error is not None and not pending:
+                raise error
+            raise TimeoutError(f"'{self.name}' did not answer within {remaining:.2f}s")
+        finally:
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+
+    async def acall(self, fn, idempotent=False, retries=None):
+        """call() for a coroutine function, waiting without holding a thread."""
+        retries = (self.max_retries if idempotent else 0) if retries is None else retries
+        deadline = time.perf_counter() + self.timeout
+        attempt = 0
+        while True:
+            self.admit()
+            try:
+                result, seconds = await self._aattempt(fn, deadline - time.perf_counter(), idempotent)
+            except Exception as e:
+                self.record_failure(e)
+                delay = backoff_delay(attempt, OUTBOUND_BACKOFF_BASE, OUTBOUND_BACKOFF_MAX)
+                if attempt >= retries or not is_retryable(e) or time.perf_counter() + delay >= deadline:
+                    raise
+                attempt += 1
+                DEPENDENCY_RETRIES.inc(dependency=self.name)
+                logger.warning(f"'{self.name}' call failed ({e}), retry {attempt}/{retries} in {delay:.2f}s")
+                await asyncio.sleep(delay)
+                continue
+            self.record_success(seconds)
+            return result
+
+
+class GuardedClient:
+    """
+    Wraps a client object so the named methods go through a Dependency; methods maps each
+    name to whether the call is idempotent (retried and hedged) or not (tried once).
+    Everything else is passed through.
+    """
+
+    def __init__(self, client, dependency, methods):
+        self._client = client
+        self._dependency = dependency
+        self._methods = methods
+
+    def __getattr__(self, name):
+        attr = getattr(self._client, name)
+        if name not in self._methods or not callable(attr):
+            return attr
+        idempotent = self._methods[name]
+
+        def guarded(*args, **kwargs):
+            return self._dependency.call(lambda: attr(*args, **kwargs), idempotent=idempotent)
+        return guarded
+
+
+_TIMEOUTS = {
+    "llm": LLM_TIMEOUT,
+    "embeddings": EMBEDDING_TIMEOUT,
+    "embeddings_bulk": EMBEDDING_BULK_TIMEOUT,
+    "pinecone": PINECONE_TIMEOUT,
+    "mongo": MONGO_TIMEOUT,
+}
+
+_dependencies = {}
+_dependencies_lock = threading.Lock()
+
+
+def get_dependency(name):
+    """The shared Dependency for one of "llm", "embeddings", "embeddings_bulk", "pinecone" or "mongo"."""
+    dependency = _dependencies.get(name)
+    if dependency is None:
+        with _dependencies_lock:
+            dependency = _dependencies.get(name)
+            if dependency is None:
+                dependency = _dependencies[name] = Dependency(name, _TIMEOUTS[name])
+    return dependency
+
+
+REGISTRY.register_callback(
+    "rag_dependency_circuit_open", "1 while a dependency's circuit is open or half-open", labelname="dependency",
+    fn=lambda: {name: int(dependency.breaker.state != "closed") for name, dependency in list(_dependencies.items())})
+
+
+_http_client = None
+_http_client_lock = threading.Lock()
+
+
+def get_http_client():
+    """The process-wide pooled httpx client for HTTP APIs (Groq), keeping connections alive between calls."""
+    global _http_client
+    if _http_client is None:
+        with _http_client_lock:
+            if _http_client is None:
+                import httpx
+
+                _http_client = httpx.Client(
+                    limits=httpx.Limits(max_connections=HTTP_POOL_MAX_CONNECTIONS,
+                                        max_keepalive_connections=HTTP_POOL_MAX_KEEPALIVE),
+                    timeout=httpx.Timeout(LLM_TIMEOUT, connect=min(LLM_TIMEOUT, 5.0)),
+                )
+    return _http_client
@@ -0,0 +1,222 @@
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+from app.components.chain_registry import chain_fingerprint
+from app.components.collections import resolve_collections
+from app.components.embeddings import get_embeddings_model
+from app.config.config import *
+from app.common.logger import get_logger
+from app.common.metrics import REGISTRY
+
+logger = get_logger(__name__)
+
+
+def normalize_question(question):
+    return " ".join(question.lower().split())
+
+
+class SemanticAnswerCache:
+    """
+    Answers (result + source documents) for questions already asked.
+    A question hits on an exact normalized match, or when its embedding is within
+    `threshold` cosine similarity of a cached question. LRU-bounded with a TTL, and
+    emptied whenever the fingerprint of the chain over its collections changes, i.e. after
+    every ingestion into one of them.
+    """
+
+    def __init__(self, max_entries=ANSWER_CACHE_MAX_ENTRIES, ttl=ANSWER_CACHE_TTL,
+                 threshold=ANSWER_CACHE_SIMILARITY, embedding_model=None, collections=None):
+        self.collections = resolve_collections(collections)
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.threshold = threshold
+
+        self._embedding_model = embedding_model
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._matrix = None
+        self._matrix_keys = []
+        self._fingerprint = None
+
+        self.exact_hits = 0
+        self.semantic_hits = 0
+        self.misses = 0
+        self.seconds_saved = 0.0
+
+    @staticmethod
+    def _normalize(vector):
+        vector = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else None
+
+    def _embed(self, question):
+        try:
+            if self._embedding_model is None:
+                self._embedding_model = get_embeddings_model()
+            return self._normalize(self._embedding_model.embed_query(question))
+        except Exception as e:
+            # Without an embedding the cache still serves exact matches
+            logger.warning(f"Answer cache could not embed the question: {e}")
+            return None
+
+    def _check_fingerprint(self):
+        fingerprint = chain_fingerprint(self.collections)
+        if fingerprint != self._fingerprint:
+            if self._entries:
+                logger.info(f"Index or config changed, dropping {len(self._entries)} cached answers")
+            self._entries.clear()
+            self._matrix, self._matrix_keys = None, []
+            self._fingerprint = fingerprint
+
+    def _expire(self, now):
+        expired = [key for key, entry in self._entries.items() if now - entry["stored_at"] > self.ttl]
+        for key in expired:
+            del self._entries[key]
+        if expired:
+            self._matrix = None
+
+    def _semantic_match(self, vector):
+        if self._matrix is None:
+            self._matrix_keys = [key for key, entry in self._entries.items() if entry["vector"] is not None]
+            self._matrix = (np.stack([self._entries[key]["vector"] for key in self._matrix_keys])
+                            if self._matrix_keys else None)
+        if self._matrix is None:
+            return None
+        scores = self._matrix @ vector
+        best = int(np.argmax(scores))
+        return self._matrix_keys[best] if scores[best] >= self.threshold else None
+
+    def _lookup_exact(self, question, began):
+        key = normalize_question(question)
+        with self._lock:
+            self._check_fingerprint()
+            self._expire(time.time())
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            self._entries.move_to_end(key)
+            self.exact_hits += 1
+            self.seconds_saved += max(0.0, entry["compute_seconds"] - (time.perf_counter() - began))
+            return entry["response"], entry["vector"]
+
+    def _lookup_semantic(self, question, vector, began):
+        with self._lock:
+            match = self._semantic_match(vector) if vector is not None and self._entries else None
+            if match is not None and match in self._entries:
+                self._entries.move_to_end(match)
+                entry = self._entries[match]
+                self.semantic_hits += 1
+                self.seconds_saved += max(0.0, entry["compute_seconds"] - (time.perf_counter() - began))
+                logger.info(f"Answer cache semantic hit for '{question}' (matched '{entry['question']}')")
+                return entry["response"], vector
+            self.misses += 1
+        return None, vector
+
+    def lookup(self, question, vector=None):
+        """
+        Returns (response, vector). response is None on a miss; pass vector back to store().
+        vector, if given, is the question's embedding and saves embedding it again.
+        """
+        began = time.perf_counter()
+        hit = self._lookup_exact(question, began)
+        if hit is not None:
+            return hit
+
+        # A threshold above 1 turns semantic matching off
+        if self.threshold > 1.0:
+            vector = None
+        else:
+            vector = self._embed(question) if vector is None else self._normalize(vector)
+        return self._lookup_semantic(question, vector, began)
+
+    async def alookup(self, question, vector=None):
+        """lookup() with the question embedded asynchronously."""
+        began = time.perf_counter()
+        hit = self._lookup_exact(question, began)
+        if hit is not None:
+            return hit
+
+        if self.threshold > 1.0:
+            vector = None
+        elif vector is not None:
+            vector = self._normalize(vector)
+        else:
+            try:
+                if self._embedding_model is None:
+                    self._embedding_model = get_embeddings_model()
+                vector = self._normalize(await self._embedding_model.aembed_query(question))
+            except Exception as e:
+                logger.warning(f"Answer cache could not embed the question: {e}")
+        return self._lookup_semantic(question, vector, began)
+
+    def store(self, question, response, compute_seconds, vector=None):
+        key = normalize_question(question)
+        with self._lock:
+            self._check_fingerprint()
+            self._entries[key] = {
+                "question": question,
+                "response": response,
+                "vector": vector,
+                "compute_seconds": compute_seconds,
+                "stored_at": time.time(),
+            }
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+            self._matrix = None
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._matrix, self._matrix_keys = None, []
+
+    def stats(self):
+        hits = self.exact_hits + self.semantic_hits
+        lookups = hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "exact_hits": self.exact_hits,
+            "semantic_hits": self.semantic_hits,
+            "misses": self.misses,
+            "hit_rate": hits / lookups if lookups else 0.0,
+            "seconds_saved": self.seconds_saved,
+        }
+
+
+def _caches():
+    with _answer_caches_lock:
+        return list(_answer_caches.values())
+
+
+def _register_metrics():
+    # Summed over the caches of every set of collections
+    REGISTRY.register_callback(
+        "rag_answer_cache_lookups_total", "Answer cache lookups by result", kind="counter", labelname="result",
+        fn=lambda: {"exact_hit": sum(cache.exact_hits for cache in _caches()),
+                    "semantic_hit": sum(cache.semantic_hits for cache in _caches()),
+                    "miss": sum(cache.misses for cache in _caches())})
+    REGISTRY.register_callback(
+        "rag_answer_cache_seconds_saved_total", "QA chain seconds saved by answers served from the cache",
+        fn=lambda: sum(cache.seconds_saved for cache in _caches()), kind="counter")
+    REGISTRY.register_callback("rag_answer_cache_entries", "Answers in the cache",
+                               fn=lambda: sum(len(cache._entries) for cache in _caches()))
+
+
+# One cache per searched set of collections, since their answers differ
+_answer_caches = {}
+_answer_caches_lock = threading.Lock()
+
+
+def get_answer_cache(collections=None):
+    """The cache for answers over collections (see resolve_collections(), default the default collection)."""
+    scope = resolve_collections(collections)
+    with _answer_caches_lock:
+        cache = _answer_caches.get(scope)
+        if cache is None:
+            if not _answer_caches:
+                _register_metrics()
+            cache = _answer_caches[scope] = SemanticAnswerCache(collections=scope)
+        return cache
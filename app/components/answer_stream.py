@@ -0,0 +1,112 @@
+import threading
+import time
+
+from app.components.retriver import set_custom_prompt
+from app.common.logger import get_logger
+from app.common.metrics import span
+
+logger = get_logger(__name__)
+
+
+def chain_parts(qa_chain):
+    """The retriever and LLM inside a "stuff" RetrievalQA chain, for streaming the answer ourselves."""
+    return qa_chain.retriever, qa_chain.combine_documents_chain.llm_chain.llm
+
+
+def _chunk_text(chunk):
+    # Chat models stream message chunks, plain LLMs stream strings
+    return chunk if isinstance(chunk, str) else getattr(chunk, "content", "") or ""
+
+
+def stuff_prompt(question, source_docs, prompt=None):
+    """The prompt the "stuff" chain sends to the LLM for this question and context."""
+    context = "\n\n".join(doc.page_content for doc in source_docs)
+    return (prompt or set_custom_prompt()).format(context=context, question=question)
+
+
+def stream_answer(question, retriever, llm, prompt=None):
+    """
+    Yields ("sources", [Document]) once retrieval is done, then ("token", str) as the LLM
+    produces them, and finally ("done", {"result", "source_documents", "ttft", "total"}).
+    Builds the same prompt as the "stuff" chain, so answers match qa_chain.invoke().
+    Any LangChain retriever and streaming LLM work here, e.g. a fake streaming model in tests.
+    """
+    began = time.perf_counter()
+
+    with span("retrieval"):
+        source_docs = retriever.invoke(question)
+    yield "sources", source_docs
+
+    tokens, ttft = [], None
+    for chunk in llm.stream(stuff_prompt(question, source_docs, prompt)):
+        text = _chunk_text(chunk)
+        if not text:
+            continue
+        if ttft is None:
+            ttft = time.perf_counter() - began
+        tokens.append(text)
+        yield "token", text
+
+    total = time.perf_counter() - began
+    ttft = total if ttft is None else ttft
+    stream_stats.record(ttft, total)
+    logger.info(f"Streamed answer: time to first token {ttft:.3f}s, total {total:.3f}s")
+    yield "done", {"result": "".join(tokens), "source_documents": source_docs, "ttft": ttft, "total": total}
+
+
+async def astream_answer(question, retriever, llm, prompt=None):
+    """stream_answer() for the async app: the retriever and LLM are awaited, not run on threads."""
+    began = time.perf_counter()
+
+    with span("retrieval"):
+        source_docs = await retriever.ainvoke(question)
+    yield "sources", source_docs
+
+    tokens, ttft = [], None
+    async for chunk in llm.astream(stuff_prompt(question, source_docs, prompt)):
+        text = _chunk_text(chunk)
+        if not text:
+            continue
+        if ttft is None:
+            ttft = time.perf_counter() - began
+        tokens.append(text)
+        yield "token", text
+
+    total = time.perf_counter() - began
+    ttft = total if ttft is None else ttft
+    stream_stats.record(ttft, total)
+    logger.info(f"Streamed answer: time to first token {ttft:.3f}s, total {total:.3f}s")
+    yield "done", {"result": "".join(tokens), "source_documents": source_docs, "ttft": ttft, "total": total}
+
+
+class StreamStats:
+    """Running time-to-first-token and total latency of streamed answers."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.count = 0
+        self.ttft_sum = 0.0
+        self.total_sum = 0.0
+        self.ttft_max = 0.0
+        self.total_max = 0.0
+
+    def record(self, ttft, total):
+        with self._lock:
+            self.count += 1
+            self.ttft_sum += ttft
+            self.total_sum += total
+            self.ttft_max = max(self.ttft_max, ttft)
+            self.total_max = max(self.total_max, total)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "streams": self.count,
+                "avg_ttft": self.ttft_sum / self.count if self.count else 0.0,
+                "avg_total": self.total_sum / self.count if self.count else 0.0,
+                "max_ttft": self.ttft_max,
+                "max_total": self.total_max,
+            }
+
+
+stream_stats = StreamStats()
@@ -0,0 +1,299 @@
+import asyncio
+import json
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from app.components.answer_cache import get_answer_cache
+from app.components.answer_stream import chain_parts, stuff_prompt
+from app.components.chain_registry import aget_qa_chain, get_qa_chain
+from app.components.embedding_cache import aembed_queries, embed_queries
+from app.components.hybrid_retriever import CollectionsRetriever, HybridRetriever
+from app.components.context_packer import ContextPackingRetriever
+from app.components.mongodata import log_retrieval_source
+
+from app.config.config import *
+from app.common.logger import get_logger
+from app.common.custom_exception import CustomException
+from app.common.metrics import span
+
+logger = get_logger(__name__)
+
+
+def parse_questions(mimetype, body):
+    """
+    (questions, single, stream) from an /api/ask request body: JSON {"question": ...} or
+    {"questions": [...], "stream": bool}, or JSONL with one {"question": ...} (or plain
+    string) per line, which always streams. Raises ValueError on malformed input.
+    """
+    if mimetype in ("application/x-ndjson", "application/jsonl"):
+        items = [json.loads(line) for line in body.splitlines() if line.strip()]
+        questions = [item.get("question") if isinstance(item, dict) else item for item in items]
+        stream = True
+    else:
+        try:
+            payload = json.loads(body)
+        except json.JSONDecodeError:
+            payload = None
+        if not isinstance(payload, dict):
+            raise ValueError("Expected a JSON object with 'question' or 'questions'")
+        if "question" in payload:
+            questions, stream = payload["question"], False
+        else:
+            questions, stream = payload.get("questions"), bool(payload.get("stream"))
+        if questions is None:
+            raise ValueError("Expected 'question' or 'questions'")
+
+    single = isinstance(questions, str)
+    questions = [questions] if single else questions
+    if not isinstance(questions, list) or not questions:
+        raise ValueError("'questions' must be a non-empty list")
+    if not all(isinstance(question, str) and question.strip() for question in questions):
+        raise ValueError("Every question must be a non-empty string")
+    if len(questions) > BATCH_MAX_QUESTIONS:
+        raise ValueError(f"At most {BATCH_MAX_QUESTIONS} questions per request")
+    return questions, single, stream
+
+
+def _search_retriever(retriever):
+    """retriever without the context packing around it."""
+    return retriever.base_retriever if isinstance(retriever, ContextPackingRetriever) else retriever
+
+
+def _dense_retriever(retriever):
+    """The vector store retriever inside retriever, or None if it isn't one we can search by vector."""
+    retriever = _search_retriever(retriever)
+    if isinstance(retriever, CollectionsRetriever):
+        # Every collection is embedded with the same model, so one query vector serves them all
+        retriever = next(iter(retriever.retrievers.values()))
+    dense = retriever.dense_retriever if isinstance(retriever, HybridRetriever) else retriever
+    return dense if hasattr(dense, "vectorstore") else None
+
+
+def _retrieve(retriever, question, vector):
+    """retriever's documents for question, reusing the batch's query vector for the search and the packing."""
+    if isinstance(retriever, ContextPackingRetriever):
+        docs = _search(retriever.base_retriever, question, vector)
+        return retriever.packer.pack(question, docs, vector)
+    return _search(retriever, question, vector)
+
+
+async def _aretrieve(retriever, question, vector):
+    if isinstance(retriever, ContextPackingRetriever):
+        docs = await _asearch(retriever.base_retriever, question, vector)
+        return await retriever.packer.apack(question, docs, vector)
+    return await _asearch(retriever, question, vector)
+
+
+def _search(retriever, question, vector):
+    if isinstance(retriever, CollectionsRetriever):
+        return retriever.fuse([_search(one, question, vector) for one in retriever.retrievers.values()])
+    dense = _dense_retriever(retriever)
+    if dense is None or vector is None:
+        return retriever.invoke(question)
+
+    def dense_search():
+        return dense.vectorstore.similarity_search_by_vector(vector, **dense.search_kwargs)
+
+    if isinstance(retriever, HybridRetriever):
+        return retriever.retrieve(question, dense_search)
+    return dense_search()
+
+
+async def _asearch(retriever, question, vector):
+    if isinstance(retriever, CollectionsRetriever):
+        return retriever.fuse(await asyncio.gather(*(_asearch(one, question, vector)
+                                                     for one in retriever.retrievers.values())))
+    dense = _dense_retriever(retriever)
+    if dense is None or vector is None:
+        return await retriever.ainvoke(question)
+
+    async def dense_search():
+        return await dense.vectorstore.asimilarity_search_by_vector(vector, **dense.search_kwargs)
+
+    if isinstance(retriever, HybridRetriever):
+        return await retriever.aretrieve(question, dense_search)
+    return await dense_search()
+
+
+def _timed(fn, *args):
+    began = time.perf_counter()
+    return fn(*args), time.perf_counter() - began
+
+
+def _generate(llm, question, source_docs):
+    return _text(llm.invoke(stuff_prompt(question, source_docs)))
+
+
+def _text(message):
+    return message if isinstance(message, str) else getattr(message, "content", "") or ""
+
+
+def _result(index, question, answer, source_docs, cached, seconds):
+    return {
+        "index": index,
+        "question": question,
+        "answer": answer,
+        "sources": [doc.metadata for doc in source_docs],
+        "cached": cached,
+        "seconds": seconds,
+    }
+
+
+def _log_source(source_docs):
+    if not source_docs:
+        return
+    db_metadata = dict(source_docs[0].metadata)
+    db_metadata.pop("_id", None)
+    try:
+        log_retrieval_source(db_metadata)
+    except Exception as e:
+        logger.error(f"Failed to log retrieval source: {e}")
+
+
+def iter_answers(questions, search_concurrency=BATCH_SEARCH_CONCURRENCY, llm_concurrency=BATCH_LLM_CONCURRENCY,
+                 collections=None):
+    """
+    Answers a batch of questions over collections (see resolve_collections()), yielding one result dict per question as it completes
+    (not in input order; each carries its "index"). Failed questions yield {"index", "question", "error"}.
+
+    All questions are embedded in a single request, the vector searches run on a pool of
+    search_concurrency threads, and the LLM calls on a separate pool of llm_concurrency, so
+    a slow LLM never holds up retrieval for the rest of the batch.
+    """
+    qa_chain = get_qa_chain(collections)
+    if qa_chain is None:
+        raise CustomException("QA chain could not be created (LLM or VectorStore issue)")
+    retriever, llm = chain_parts(qa_chain)
+
+    vectors = [None] * len(questions)
+    dense = _dense_retriever(retriever)
+    if dense is not None and questions:
+        try:
+            with span("embed_queries"):
+                vectors = embed_queries(dense.vectorstore.embeddings, list(questions))
+        except Exception as e:
+            # Each question is then embedded on its own by the retriever
+            logger.warning(f"Batch query embedding failed, falling back to per-question embedding: {e}")
+
+    answer_cache = get_answer_cache(collections) if ANSWER_CACHE_ENABLED else None
+    misses = []
+    for index, (question, vector) in enumerate(zip(questions, vectors)):
+        cached, cache_vector = None, None
+        if answer_cache:
+            with span("answer_cache_lookup"):
+                cached, cache_vector = answer_cache.lookup(question, vector)
+        if cached is not None:
+            source_docs = cached.get("source_documents", [])
+            _log_source(source_docs)
+            yield _result(index, question, cached.get("result", "No response"), source_docs, True, 0.0)
+        else:
+            misses.append((index, question, vector, cache_vector))
+
+    with ThreadPoolExecutor(max_workers=search_concurrency, thread_name_prefix="batch-search") as search_pool, \
+            ThreadPoolExecutor(max_workers=llm_concurrency, thread_name_prefix="batch-llm") as llm_pool:
+        pending = {}
+        for miss in misses:
+            _, question, vector, _ = miss
+            pending[search_pool.submit(_timed, _retrieve, retriever, question, vector)] = ("search", miss, None, 0.0)
+        try:
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    stage, miss, source_docs, search_seconds = pending.pop(future)
+                    index, question, _, cache_vector = miss
+                    try:
+                        result, seconds = future.result()
+                    except Exception as e:
+                        logger.error(f"Batch question {index} failed during {stage}: {e}")
+                        yield {"index": index, "question": question, "error": str(e)}
+                        continue
+
+                    if stage == "search":
+                        future = llm_pool.submit(_timed, _generate, llm, question, result)
+                        pending[future] = ("llm", miss, result, seconds)
+                        continue
+
+                    seconds += search_seconds
+                    if answer_cache:
+                        answer_cache.store(question, {"result": result, "source_documents": source_docs}, seconds, cache_vector)
+                    _log_source(source_docs)
+                    yield _result(index, question, result, source_docs, False, seconds)
+        finally:
+            # A client that went away doesn't need the rest of the batch
+            for future in pending:
+                future.cancel()
+
+
+def answer_questions(questions, **kwargs):
+    """iter_answers() collected into a list in input order."""
+    results = [None] * len(questions)
+    for result in iter_answers(questions, **kwargs):
+        results[result["index"]] = result
+    return results
+
+
+async def aiter_answers(questions, search_concurrency=BATCH_SEARCH_CONCURRENCY, llm_concurrency=BATCH_LLM_CONCURRENCY,
+                        collections=None):
+    """
+    iter_answers() for the async app. The same single embedding request, with the vector
+    searches and LLM calls bounded by semaphores instead of thread pools.
+    """
+    qa_chain = await aget_qa_chain(collections)
+    if qa_chain is None:
+        raise CustomException("QA chain could not be created (LLM or VectorStore issue)")
+    retriever, llm = chain_parts(qa_chain)
+
+    vectors = [None] * len(questions)
+    dense = _dense_retriever(retriever)
+    if dense is not None and questions:
+        try:
+            with span("embed_queries"):
+                vectors = await aembed_queries(dense.vectorstore.embeddings, list(questions))
+        except Exception as e:
+            logger.warning(f"Batch query embedding failed, falling back to per-question embedding: {e}")
+
+    answer_cache = get_answer_cache(collections) if ANSWER_CACHE_ENABLED else None
+    misses = []
+    for index, (question, vector) in enumerate(zip(questions, vectors)):
+        cached, cache_vector = None, None
+        if answer_cache:
+            with span("answer_cache_lookup"):
+                cached, cache_vector = await answer_cache.alookup(question, vector)
+        if cached is not None:
+            source_docs = cached.get("source_documents", [])
+            _log_source(source_docs)
+            yield _result(index, question, cached.get("result", "No response"), source_docs, True, 0.0)
+        else:
+            misses.append((index, question, vector, cache_vector))
+
+    search_slots = asyncio.Semaphore(search_concurrency)
+    llm_slots = asyncio.Semaphore(llm_concurrency)
+
+    async def answer(index, question, vector, cache_vector):
+        stage = "search"
+        try:
+            async with search_slots:
+                began = time.perf_counter()
+                source_docs = await _aretrieve(retriever, question, vector)
+                seconds = time.perf_counter() - began
+            stage = "llm"
+            async with llm_slots:
+                began = time.perf_counter()
+                result = _text(await llm.ainvoke(stuff_prompt(question, source_docs)))
+                seconds += time.perf_counter() - began
+        except Exception as e:
+            logger.error(f"Batch question {index} failed during {stage}: {e}")
+            return {"index": index, "question": question, "error": str(e)}
+        if answer_cache:
+            answer_cache.store(question, {"result": result, "source_documents": source_docs}, seconds, cache_vector)
+        _log_source(source_docs)
+        return _result(index, question, result, source_docs, False, seconds)
+
+    tasks = [asyncio.ensure_future(answer(*miss)) for miss in misses]
+    try:
+        for next_result in asyncio.as_completed(tasks):
+            yield await next_result
+    finally:
+        # A client that went away doesn't need the rest of the batch
+        for task in tasks:
+            task.cancel()
@@ -0,0 +1,110 @@
+import asyncio
+import threading
+from collections import OrderedDict
+
+from app.components.retriver import create_qa_chain
+from app.components import vector_store
+from app.components.collections import get_collection, resolve_collections
+from app.components.manifest import manifest_mtime
+from app.config import config
+
+from app.common.logger import get_logger
+
+logger = get_logger(__name__)
+
+# Process-wide QA chains, one per searched set of collections. Building one costs a Pinecone
+# round trip plus fresh embedding/LLM clients, so it is built once and shared by every request.
+_lock = threading.Lock()
+# scope (sorted tuple of collection names) -> (chain, fingerprint it was built for)
+_chains = OrderedDict()
+_index_generations = {}
+# Cross-collection scopes can combine collections in many ways, only the recent ones are kept
+_MAX_CHAINS = 32
+
+
+def chain_fingerprint(collections=None):
+    """Everything the chain for collections depends on; a change in any of it forces a rebuild."""
+    scope = resolve_collections(collections)
+    return (
+        tuple(_index_generations.get(name, 0) for name in scope),
+        # Lets other worker processes notice ingestion done elsewhere
+        tuple(manifest_mtime(get_collection(name).manifest_path) for name in scope),
+        config.VECTOR_STORE_BACKEND,
+        vector_store.PINECONE_INDEX_NAME,
+        config.LLM_MODEL_NAME,
+        config.EMBEDDING_MODEL_NAME,
+        config.RETRIEVER_K,
+        config.HYBRID_RETRIEVAL_ENABLED,
+    )
+
+
+def _cached(scope, fingerprint):
+    entry = _chains.get(scope)
+    return entry[0] if entry is not None and entry[1] == fingerprint else None
+
+
+def get_qa_chain(collections=None):
+    """
+    Returns the shared QA chain over collections (see resolve_collections(), default the
+    default collection), building it on first use or after invalidation.
+    """
+    scope = resolve_collections(collections)
+    qa_chain = _cached(scope, chain_fingerprint(scope))
+    if qa_chain is not None:
+        return qa_chain
+
+    with _lock:
+        fingerprint = chain_fingerprint(scope)
+        qa_chain = _cached(scope, fingerprint)
+        if qa_chain is not None:
+            _chains.move_to_end(scope)
+            return qa_chain
+
+        logger.info(f"Building shared QA chain for collections {list(scope)}")
+        qa_chain = create_qa_chain(scope)
+        if qa_chain is None:
+            # Don't cache failures, the next request gets to retry
+            return None
+
+        _chains[scope] = (qa_chain, fingerprint)
+        _chains.move_to_end(scope)
+        while len(_chains) > _MAX_CHAINS:
+            _chains.popitem(last=False)
+        return qa_chain
+
+
+async def aget_qa_chain(collections=None):
+    """get_qa_chain() for async callers: only a (re)build is moved off the event loop."""
+    scope = resolve_collections(collections)
+    qa_chain = _cached(scope, chain_fingerprint(scope))
+    if qa_chain is not None:
+        return qa_chain
+    return await asyncio.to_thread(get_qa_chain, scope)
+
+
+def invalidate_qa_chain(collection=None):
+    """
+    Drops the shared chains that search a collection, or all of them without one.
+    Called by ingestion whenever a collection's index changes.
+    """
+    with _lock:
+        names = [collection] if collection is not None else {name for scope in _chains for name in scope} | set(_index_generations)
+        for name in names:
+            _index_generations[name] = _index_generations.get(name, 0) + 1
+        for scope in [scope for scope in _chains if collection is None or collection in scope]:
+            del _chains[scope]
+    logger.info(f"QA chains invalidated for {'all collections' if collection is None else f'collection {collection!r}'}")
+
+
+def get_index_generation(collection=None):
+    return _index_generations.get(collection or config.DEFAULT_COLLECTION, 0)
+
+
+def warm_up_qa_chain(collections=None):
+    """Builds the chain ahead of traffic so the first chat request doesn't pay for it."""
+    qa_chain = get_qa_chain(collections)
+    if qa_chain is None:
+        logger.warning("QA chain warm-up failed, it will be built on the first request")
+        return False
+    logger.info("QA chain warmed up")
+    return True
@@ -0,0 +1,236 @@
+import bisect
+import itertools
+import re
+
+from langchain_core.documents import Document
+
+from app.config.config import *
+from app.common.logger import get_logger
+
+logger = get_logger(__name__)
+
+# A newline, or a blank line (a paragraph break); the places a chunk prefers to end
+_NEWLINE_RE = re.compile(r"\n(?:[ \t\r\f\v]*\n)?")
+_NON_SPACE_RE = re.compile(r"\S")
+_WORD_START_RE = re.compile(r"(?<=\s)\S")
+# Token estimate: words in pieces of up to four characters, and every other symbol
+_TOKEN_RE = re.compile(r"\w{1,4}|[^\w\s]")
+
+# Joins a file's pages when chunks may span them, so a page end counts as a paragraph break
+PAGE_SEPARATOR = "\n\n"
+
+
+def count_tokens(text):
+    """Estimated LLM tokens in text, as CHUNK_UNIT="tokens" counts them."""
+    return len(_TOKEN_RE.findall(text))
+
+
+class _PageText:
+    """
+    The text of consecutive pages of one file, joined by PAGE_SEPARATOR, with its line and
+    paragraph breaks found in one pass as each page is appended. Token starts are only found
+    once a chunk could hold more tokens than fit, and then in one pass up to the end of the
+    text. Offsets are absolute from the start of the first page appended, so they stay valid
+    when the text before the current chunk is dropped.
+    """
+
+    def __init__(self, tokens=False):
+        self.text = ""
+        # Absolute offset of text[0]
+        self.base = 0
+        # Absolute start of each page's text, and (page Document, characters of it skipped)
+        self.starts = []
+        self.pages = []
+        self.lines = []
+        self.paragraphs = []
+        # Absolute token starts up to absolute offset tokenized, when sizes count tokens
+        self.tokens = [] if tokens else None
+        self.tokenized = 0
+
+    @property
+    def end(self):
+        return self.base + len(self.text)
+
+    def append(self, page, skipped=0):
+        body = page.page_content[skipped:] if skipped else page.page_content
+        if not body or body.isspace():
+            return
+        joiner = PAGE_SEPARATOR if self.text else ""
+        scan_from = len(self.text)
+        self.starts.append(self.base + scan_from + len(joiner))
+        self.pages.append((page, skipped))
+        self.text = self.text + joiner + body
+        for match in _NEWLINE_RE.finditer(self.text, scan_from):
+            breaks = self.paragraphs if match.end() - match.start() > 1 else self.lines
+            breaks.append(self.base + match.start())
+
+    def token_starts(self):
+        """Absolute token starts, up to the end of the text."""
+        if self.tokenized < self.end:
+            base = self.base
+            self.tokens.extend(base + match.start() for match in _TOKEN_RE.finditer(self.text, max(self.tokenized - base, 0)))
+            self.tokenized = self.end
+        return self.tokens
+
+    def drop(self, pos):
+        """Forgets the text before absolute offset pos."""
+        cut = pos - self.base
+        if cut <= 0:
+            return
+        self.text = self.text[cut:]
+        self.base = pos
+        del self.lines[:bisect.bisect_left(self.lines, pos)]
+        del self.paragraphs[:bisect.bisect_left(self.paragraphs, pos)]
+        if self.tokens is not None:
+            del self.tokens[:bisect.bisect_left(self.tokens, pos)]
+        first = max(0, bisect.bisect_right(self.starts, pos) - 1)
+        del self.starts[:first]
+        del self.pages[:first]
+
+    def page_at(self, pos):
+        """(page Document, offset into its page_content) of absolute offset pos."""
+        i = bisect.bisect_right(self.starts, pos) - 1
+        page, skipped = self.pages[i]
+        return page, pos - self.starts[i] + skipped
+
+
+class PageChunker:
+    """
+    Splits pages into chunks of at most chunk_size units (characters, or estimated tokens
+    with unit="tokens") that overlap by about chunk_overlap, word-aligned. Like
+    RecursiveCharacterTextSplitter a chunk ends at the last paragraph break that fits, else
+    the last line break, else the last space (breaks in its first half don't count), but a
+    chunk is located as a (start, end) range into the page text and sliced out once, without
+    splitting and re-joining pieces.
+
+    By default chunks end with their page. With across_pages a chunk runs on into the next
+    pages of the same file; it keeps its first page's metadata and adds page_end, the last
+    page it covers.
+    """
+
+    def __init__(self, chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP, unit=CHUNK_UNIT,
+                 across_pages=CHUNK_ACROSS_PAGES):
+        if unit not in ("chars", "tokens"):
+            raise ValueError(f"Unknown chunk unit '{unit}', use 'chars' or 'tokens'")
+        if not 0 <= chunk_overlap < chunk_size:
+            raise ValueError(f"Chunk overlap ({chunk_overlap}) must be smaller than the chunk size ({chunk_size})")
+        self.chunk_size = chunk_size
+        self.chunk_overlap = chunk_overlap
+        self.unit = unit
+        self.across_pages = across_pages
+
+    def _break(self, page_text, rel, limit):
+        """Offset in page_text.text of the separator a chunk in (rel, limit] ends at, or None."""
+        base = page_text.base
+        # A paragraph or line break only ends a chunk that is at least half full, so a page
+        # break near its start doesn't leave a sliver of a chunk behind
+        half = base + rel + (limit - rel) // 2
+        for breaks in (page_text.paragraphs, page_text.lines):
+            i = bisect.bisect_right(breaks, base + limit) - 1
+            if i >= 0 and breaks[i] > half:
+                return breaks[i] - base
+        space = page_text.text.rfind(" ", rel + 1, limit + 1)
+        return space if space > rel else None
+
+    def _cut(self, page_text, pos, final):
+        """
+        (end, next start) of the chunk starting at absolute offset pos, or None when the text
+        doesn't reach far enough yet to tell (only when more pages can follow).
+        """
+        text, base, tokens = page_text.text, page_text.base, page_text.tokens
+        rel = pos - base
+        if tokens is None:
+            limit = rel + self.chunk_size
+            fits = limit >= len(text)
+        elif len(text) - rel <= self.chunk_size:
+            # No text has more tokens than characters
+            fits = True
+        else:
+            # The token after chunk_size tokens from pos is the limit
+            tokens = page_text.token_starts()
+            first_token = bisect.bisect_left(tokens, pos)
+            fits = first_token + self.chunk_size >= len(tokens)
+            limit = len(text) if fits else tokens[first_token + self.chunk_size] - base
+        if fits:
+            if not final:
+                return None
+            end = len(text)
+        else:
+            end = self._break(page_text, rel, limit)
+            hard_cut = end is None
+            if hard_cut:
+                end = limit
+        stop = end
+        while stop > rel and text[stop - 1].isspace():
+            stop -= 1
+
+        if fits:
+            return base + stop, page_text.end
+        following = _NON_SPACE_RE.search(text, end)
+        next_start = following.start() if following else len(text)
+        if self.chunk_overlap:
+            if tokens is None:
+                target = end - self.chunk_overlap
+            else:
+                first = bisect.bisect_left(tokens, base + end) - self.chunk_overlap
+                target = tokens[first] - base if first > first_token else rel
+            if target > rel:
+                word = _WORD_START_RE.search(text, target, end)
+                if word:
+                    next_start = word.start()
+                elif hard_cut:
+                    next_start = target
+        return base + stop, base + next_start
+
+    def _chunk(self, page_text, start, stop):
+        page, offset = page_text.page_at(start)
+        metadata = dict(page.metadata)
+        last_page, _ = page_text.page_at(stop - 1)
+        if last_page is not page:
+            metadata["page_end"] = last_page.metadata.get("page")
+        content = page_text.text[start - page_text.base:stop - page_text.base]
+        return (page.metadata.get("page"), offset), Document(page_content=content, metadata=metadata)
+
+    def _drain(self, page_text, pos, final):
+        """Yields the chunks page_text can settle from pos on; returns where the next one starts."""
+        while True:
+            # A chunk never starts with whitespace
+            following = _NON_SPACE_RE.search(page_text.text, pos - page_text.base)
+            if following is None:
+                pos = page_text.end
+                break
+            pos = page_text.base + following.start()
+            cut = self._cut(page_text, pos, final)
+            if cut is None:
+                break
+            stop, next_start = cut
+            yield self._chunk(page_text, pos, stop)
+            pos = next_start
+        page_text.drop(pos)
+        return pos
+
+    def iter_chunks(self, pages, start_offset=0):
+        """
+        Yields ((page, offset), chunk Document) for one file's pages in order, where (page,
+        offset) is the page number and character offset into its page_content at which the
+        chunk starts. start_offset skips that many characters of the first page: resuming at
+        a chunk's start produces exactly the chunks that followed it before.
+        """
+        page_text, pos = _PageText(self.unit == "tokens"), 0
+        for page in pages:
+            if page_text.text and not self.across_pages:
+                yield from self._drain(page_text, pos, True)
+                page_text, pos = _PageText(self.unit == "tokens"), 0
+            page_text.append(page, start_offset)
+            start_offset = 0
+            if self.across_pages:
+                pos = yield from self._drain(page_text, pos, False)
+        yield from self._drain(page_text, pos, True)
+
+    def split_documents(self, documents):
+        """Chunks of the documents, each one a page, in order. With across_pages consecutive pages of a source are joined."""
+        chunks = []
+        key = (lambda document: document.metadata.get("source")) if self.across_pages else id
+        for _, pages in itertools.groupby(documents, key=key):
+            chunks.extend(chunk for _, chunk in self.iter_chunks(pages))
+        return chunks
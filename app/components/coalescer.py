@@ -0,0 +1,238 @@
+import asyncio
+import threading
+from concurrent.futures import Future, wait
+
+from langchain_core.embeddings import Embeddings
+
+from app.components.collections import resolve_collections
+from app.components.embedding_cache import aembed_queries, embed_queries, normalize_text
+from app.config.config import *
+from app.common.logger import get_logger
+from app.common.metrics import REGISTRY
+
+logger = get_logger(__name__)
+
+COALESCER_REQUESTS = REGISTRY.counter(
+    "rag_coalescer_requests_total", "Calls that went through a request coalescer", ("kind",))
+COALESCER_DEDUPLICATED = REGISTRY.counter(
+    "rag_coalescer_deduplicated_total", "Calls served by an identical call in the same batch or in flight", ("kind",))
+QUERY_EMBEDDING_BATCH_SIZE = REGISTRY.histogram(
+    "rag_query_embedding_batch_size", "Distinct texts per batched query embedding request",
+    buckets=(1, 2, 4, 8, 16, 32, 64, 128, 256))
+
+
+def _shared_future():
+    # A caller that stops waiting cancels its asyncio wrapper; the shared future must stay
+    # settable, and a running future can't be cancelled
+    future = Future()
+    future.set_running_or_notify_cancel()
+    return future
+
+
+class _Batch:
+    def __init__(self):
+        self.items = []
+        # Resolved when the batch is full, so the leader doesn't wait out the window
+        self.full = _shared_future()
+
+
+class MicroBatchingEmbeddings(Embeddings):
+    """
+    Wraps an embedding model so concurrent embed_query()/aembed_query() calls, from threads
+    or event loops, go upstream together: the first call of a batch waits up to window
+    seconds, or until max_batch_size calls have joined, then embeds the batch's distinct
+    texts in one embed_queries() request and hands every caller its vector. Document
+    embeddings are passed straight through.
+    """
+
+    def __init__(self, model, window=QUERY_BATCH_WINDOW, max_batch_size=QUERY_BATCH_MAX_SIZE):
+        self.model = model
+        self.window = window
+        self.max_batch_size = max_batch_size
+        self._lock = threading.Lock()
+        self._open = None
+        # Async leaders run as tasks of their own, so a cancelled caller can't strand its batch
+        self._tasks = set()
+
+    def _close(self, batch):
+        # Called with the lock held
+        if self._open is batch:
+            self._open = None
+        if not batch.full.done():
+            batch.full.set_result(None)
+
+    def _join(self, text):
+        """(batch, the caller's future, whether the caller leads the batch)."""
+        future = _shared_future()
+        with self._lock:
+            batch = self._open
+            leader = batch is None
+            if leader:
+                batch = self._open = _Batch()
+            batch.items.append((text, future))
+            if len(batch.items) >= self.max_batch_size:
+                self._close(batch)
+        return batch, future, leader
+
+    def _take(self, batch):
+        """Closes the batch and returns its distinct texts."""
+        with self._lock:
+            self._close(batch)
+        texts = list(dict.fromkeys(text for text, _ in batch.items))
+        COALESCER_REQUESTS.inc(len(batch.items), kind="embed_query")
+        if len(texts) < len(batch.items):
+            COALESCER_DEDUPLICATED.inc(len(batch.items) - len(texts), kind="embed_query")
+        QUERY_EMBEDDING_BATCH_SIZE.observe(len(texts))
+        return texts
+
+    def _settle(self, batch, texts, vectors=None, error=None):
+        by_text = dict(zip(texts, vectors)) if error is None else {}
+        for text, future in batch.items:
+            if error is None:
+                future.set_result(by_text[text])
+            else:
+                future.set_exception(error)
+
+    def _flush(self, batch):
+        wait([batch.full], timeout=self.window)
+        texts = self._take(batch)
+        try:
+            vectors = embed_queries(self.model, texts)
+        except BaseException as e:
+            # Every caller, the leader included, gets the error from its future
+            self._settle(batch, texts, error=e)
+            if not isinstance(e, Exception):
+                raise
+            return
+        self._settle(batch, texts, vectors)
+
+    async def _aflush(self, batch):
+        await asyncio.wait([asyncio.wrap_future(batch.full)], timeout=self.window)
+        texts = self._take(batch)
+        try:
+            vectors = await aembed_queries(self.model, texts)
+        except BaseException as e:
+            self._settle(batch, texts, error=e)
+            if not isinstance(e, Exception):
+                raise
+            return
+        self._settle(batch, texts, vectors)
+
+    def embed_query(self, text):
+        batch, future, leader = self._join(text)
+        if leader:
+            self._flush(batch)
+        return future.result()
+
+    async def aembed_query(self, text):
+        batch, future, leader = self._join(text)
+        if leader:
+            task = asyncio.get_running_loop().create_task(self._aflush(batch))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+        return await asyncio.wrap_future(future)
+
+    def embed_documents(self, texts, **kwargs):
+        return self.model.embed_documents(texts, **kwargs)
+
+    async def aembed_documents(self, texts, **kwargs):
+        return await self.model.aembed_documents(texts, **kwargs)
+
+    def embed_queries(self, texts):
+        return embed_queries(self.model, texts)
+
+    async def aembed_queries(self, texts):
+        return await aembed_queries(self.model, texts)
+
+
+class SingleFlight:
+    """
+    Runs one call per key at a time: a call made while an identical one (same key) is in
+    flight waits for that one and gets its result, or its exception, instead of running.
+    kind labels the coalescer metrics.
+    """
+
+    def __init__(self, kind):
+        self.kind = kind
+        self._lock = threading.Lock()
+        self._calls = {}
+        self._tasks = set()
+
+    def _join(self, key):
+        with self._lock:
+            future = self._calls.get(key)
+            leader = future is None
+            if leader:
+                future = self._calls[key] = _shared_future()
+        COALESCER_REQUESTS.inc(kind=self.kind)
+        if not leader:
+            COALESCER_DEDUPLICATED.inc(kind=self.kind)
+        return future, leader
+
+    def _finish(self, key, future, result=None, error=None):
+        with self._lock:
+            self._calls.pop(key, None)
+        if error is None:
+            future.set_result(result)
+        else:
+            future.set_exception(error)
+
+    def do(self, key, fn):
+        """(fn()'s result, whether this call ran fn)."""
+        future, leader = self._join(key)
+        if not leader:
+            return future.result(), False
+        try:
+            result = fn()
+        except BaseException as e:
+            self._finish(key, future, error=e)
+            raise
+        self._finish(key, future, result)
+        return result, True
+
+    async def ado(self, key, fn):
+        """
+        do() for a coroutine function. The call runs as a task of its own, so it finishes for
+        the others even if the caller that started it is cancelled.
+        """
+        future, leader = self._join(key)
+        if leader:
+            task = asyncio.get_running_loop().create_task(fn())
+            self._tasks.add(task)
+
+            def finished(task):
+                self._tasks.discard(task)
+                if task.cancelled():
+                    self._finish(key, future, error=asyncio.CancelledError())
+                elif task.exception() is not None:
+                    self._finish(key, future, error=task.exception())
+                else:
+                    self._finish(key, future, task.result())
+
+            task.add_done_callback(finished)
+        return await asyncio.wrap_future(future), leader
+
+
+_answers = SingleFlight("answer")
+
+
+def _answer_key(collections, question):
+    return resolve_collections(collections), normalize_text(question)
+
+
+def answer_once(collections, question, invoke):
+    """
+    invoke() to answer question over collections, unless the same question over the same
+    collections is already being answered, whose response is then shared. Returns
+    (response, whether this call produced it).
+    """
+    if not ANSWER_SINGLE_FLIGHT_ENABLED:
+        return invoke(), True
+    return _answers.do(_answer_key(collections, question), invoke)
+
+
+async def aanswer_once(collections, question, ainvoke):
+    """answer_once() for a coroutine function."""
+    if not ANSWER_SINGLE_FLIGHT_ENABLED:
+        return await ainvoke(), True
+    return await _answers.ado(_answer_key(collections, question), ainvoke)
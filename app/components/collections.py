@@ -0,0 +1,83 @@
+import os
+import re
+
+from app.config.config import *
+from app.common.logger import get_logger
+
+logger = get_logger(__name__)
+
+# Names become directory names and Pinecone namespaces; no dots, so they never clash with PDFs
+_NAME_RE = re.compile(r"^[a-z0-9][a-z0-9_-]{0,63}$")
+
+# Searches every collection
+ALL_COLLECTIONS = "*"
+
+
+def valid_collection_name(name):
+    return isinstance(name, str) and bool(_NAME_RE.match(name))
+
+
+class Collection:
+    """
+    A partition of the documents with its own data folder, manifest, checkpoint, lexical and
+    dedup indexes, and vector namespace. Ingesting or searching one never touches the others.
+    The default collection keeps the original paths and Pinecone's default namespace, so data
+    ingested before collections existed belongs to it.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.is_default = name == DEFAULT_COLLECTION
+        self.data_path = DATA_PATH if self.is_default else os.path.join(DATA_PATH, name)
+        self.manifest_path = self._state_path(INGESTION_MANIFEST_PATH)
+        self.checkpoint_path = self._state_path(INGESTION_CHECKPOINT_PATH)
+        self.lexical_index_path = self._state_path(LEXICAL_INDEX_PATH)
+        self.dedup_index_path = self._state_path(DEDUP_INDEX_PATH)
+        self.local_index_path = self._state_path(DB_FAISS_PATH)
+        self.namespace = None if self.is_default else name
+
+    def _state_path(self, path):
+        if self.is_default:
+            return path
+        return os.path.join(COLLECTIONS_STATE_PATH, self.name, os.path.basename(path))
+
+    def __repr__(self):
+        return f"Collection({self.name!r})"
+
+
+def get_collection(name=None):
+    """The Collection called name (default DEFAULT_COLLECTION). Raises ValueError for an invalid name."""
+    name = DEFAULT_COLLECTION if name is None else name
+    if not valid_collection_name(name):
+        raise ValueError(f"Invalid collection name '{name}': use 1-64 lowercase letters, digits, '-' or '_'")
+    return Collection(name)
+
+
+def list_collections():
+    """Names of the default collection and of every collection folder under DATA_PATH."""
+    names = {DEFAULT_COLLECTION}
+    if os.path.isdir(DATA_PATH):
+        names.update(name for name in os.listdir(DATA_PATH)
+                     if valid_collection_name(name) and os.path.isdir(os.path.join(DATA_PATH, name)))
+    return sorted(names)
+
+
+def resolve_collections(value=None):
+    """
+    The sorted tuple of collection names a search covers: None is the default collection,
+    a name or comma-separated names or a list of them select those, ALL_COLLECTIONS every one.
+    Raises ValueError for an invalid name.
+    """
+    if value is None:
+        return (DEFAULT_COLLECTION,)
+    names = value.split(",") if isinstance(value, str) else value
+    if not isinstance(names, (list, tuple)):
+        raise ValueError("Collections must be a name, comma-separated names or a list of names")
+    names = [name.strip() if isinstance(name, str) else name for name in names]
+    if ALL_COLLECTIONS in names:
+        return tuple(list_collections())
+    for name in names:
+        get_collection(name)
+    if not names:
+        raise ValueError("No collection given")
+    return tuple(sorted(set(names)))
@@ -0,0 +1,173 @@
+import math
+import re
+from typing import Any, List
+
+import numpy as np
+from langchain_core.callbacks import AsyncCallbackManagerForRetrieverRun, CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+
+from app.components.lexical_index import tokenize
+from app.config.config import *
+from app.common.logger import get_logger
+from app.common.metrics import REGISTRY, span
+
+logger = get_logger(__name__)
+
+_SENTENCE_END_RE = re.compile(r"(?<=[.!?])\s+|\n\s*\n")
+
+CONTEXT_TOKENS = REGISTRY.counter(
+    "rag_context_tokens_total", "Estimated prompt context tokens: retrieved, and sent after packing", ("kind",))
+
+
+def estimate_tokens(text):
+    """Rough token count (about 4 characters per token for English text)."""
+    return math.ceil(len(text) / 4)
+
+
+def split_passages(text, target_chars=CONTEXT_PASSAGE_CHARS):
+    """Splits text at sentence ends into passages of about target_chars, never breaking a sentence."""
+    passages, current = [], ""
+    for sentence in _SENTENCE_END_RE.split(text):
+        sentence = sentence.strip()
+        if not sentence:
+            continue
+        current = f"{current} {sentence}" if current else sentence
+        if len(current) >= target_chars:
+            passages.append(current)
+            current = ""
+    if current:
+        passages.append(current)
+    return passages
+
+
+def lexical_scores(query, passages):
+    """IDF-weighted share of the query's terms found in each passage, in [0, 1]."""
+    terms = set(tokenize(query))
+    if not terms:
+        return np.zeros(len(passages), dtype=np.float32)
+    passage_terms = [set(tokenize(passage)) for passage in passages]
+    weights = {}
+    for term in terms:
+        df = sum(1 for found in passage_terms if term in found)
+        weights[term] = math.log(1.0 + len(passages) / (1.0 + df))
+    total = sum(weights.values()) or 1.0
+    return np.array([sum(weights[term] for term in terms & found) / total for found in passage_terms], dtype=np.float32)
+
+
+def _cosine(query_vector, vectors):
+    matrix = np.asarray(vectors, dtype=np.float32)
+    query = np.asarray(query_vector, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=1) * (np.linalg.norm(query) or 1.0)
+    return matrix @ query / np.where(norms == 0, 1.0, norms)
+
+
+class ContextPacker:
+    """
+    Cuts retrieved chunks down to the passages that matter for the question. Chunks are
+    split into sentence-aligned passages, each scored by IDF-weighted term overlap with
+    the query and the best are packed into token_budget. With semantic_weight > 0 the
+    score is blended with cosine similarity to the query, which embeds every passage
+    (one embed_documents() call per packed question) with the vector store's model. A chunk with chosen passages
+    comes back as one Document with its metadata intact, holding those passages in their
+    original order; chunks are ordered by their best passage.
+    """
+
+    def __init__(self, embeddings=None, token_budget=CONTEXT_TOKEN_BUDGET,
+                 passage_chars=CONTEXT_PASSAGE_CHARS, semantic_weight=CONTEXT_SEMANTIC_WEIGHT):
+        self.embeddings = embeddings
+        self.token_budget = token_budget
+        self.passage_chars = passage_chars
+        self.semantic_weight = semantic_weight if embeddings is not None else 0.0
+
+    def _passages(self, docs):
+        """[(doc index, position, text)] over all docs."""
+        return [(i, position, text)
+                for i, doc in enumerate(docs)
+                for position, text in enumerate(split_passages(doc.page_content, self.passage_chars))]
+
+    def _within_budget(self, docs):
+        return sum(estimate_tokens(doc.page_content) for doc in docs) <= self.token_budget
+
+    def _select(self, query, docs, passages, semantic):
+        scores = (1.0 - self.semantic_weight) * lexical_scores(query, [text for _, _, text in passages])
+        if semantic is not None:
+            scores = scores + self.semantic_weight * semantic
+
+        chosen, used = [], 0
+        for slot in np.argsort(-scores, kind="stable"):
+            tokens = estimate_tokens(passages[slot][2])
+            # The best passage always goes in, even over budget
+            if chosen and used + tokens > self.token_budget:
+                continue
+            chosen.append(int(slot))
+            used += tokens
+
+        best, by_doc = {}, {}
+        for rank, slot in enumerate(chosen):
+            doc_index, position, text = passages[slot]
+            best.setdefault(doc_index, rank)
+            by_doc.setdefault(doc_index, []).append((position, text))
+        return [Document(page_content=" ".join(text for _, text in sorted(by_doc[doc_index])),
+                         metadata=dict(docs[doc_index].metadata), id=docs[doc_index].id)
+                for doc_index in sorted(best, key=best.get)]
+
+    def _report(self, docs, packed):
+        retrieved = sum(estimate_tokens(doc.page_content) for doc in docs)
+        sent = sum(estimate_tokens(doc.page_content) for doc in packed)
+        CONTEXT_TOKENS.inc(retrieved, kind="retrieved")
+        CONTEXT_TOKENS.inc(sent, kind="packed")
+        logger.info(f"Context packed to {sent} of {retrieved} estimated tokens ({retrieved - sent} saved)")
+
+    def pack(self, query, docs, query_vector=None):
+        """The packed Documents for query; docs already within budget are returned as they are."""
+        with span("context_packing"):
+            passages = self._passages(docs)
+            if len(passages) < 2 or self._within_budget(docs):
+                self._report(docs, docs)
+                return docs
+            semantic = None
+            if self.semantic_weight > 0:
+                try:
+                    query_vector = query_vector if query_vector is not None else self.embeddings.embed_query(query)
+                    semantic = _cosine(query_vector, self.embeddings.embed_documents([text for _, _, text in passages]))
+                except Exception as e:
+                    logger.warning(f"Passage embedding failed, packing on term overlap only: {e}")
+            packed = self._select(query, docs, passages, semantic)
+        self._report(docs, packed)
+        return packed
+
+    async def apack(self, query, docs, query_vector=None):
+        """pack() with the embedding calls awaited."""
+        with span("context_packing"):
+            passages = self._passages(docs)
+            if len(passages) < 2 or self._within_budget(docs):
+                self._report(docs, docs)
+                return docs
+            semantic = None
+            if self.semantic_weight > 0:
+                try:
+                    if query_vector is None:
+                        query_vector = await self.embeddings.aembed_query(query)
+                    vectors = await self.embeddings.aembed_documents([text for _, _, text in passages])
+                    semantic = _cosine(query_vector, vectors)
+                except Exception as e:
+                    logger.warning(f"Passage embedding failed, packing on term overlap only: {e}")
+            packed = self._select(query, docs, passages, semantic)
+        self._report(docs, packed)
+        return packed
+
+
+class ContextPackingRetriever(BaseRetriever):
+    """Any retriever, with its results cut down to a token budget by a ContextPacker."""
+
+    base_retriever: BaseRetriever
+    packer: Any
+
+    def _get_relevant_documents(self, query: str, *, run_manager: CallbackManagerForRetrieverRun) -> List[Document]:
+        docs = self.base_retriever.invoke(query, config={"callbacks": run_manager.get_child()})
+        return self.packer.pack(query, docs)
+
+    async def _aget_relevant_documents(self, query: str, *, run_manager: AsyncCallbackManagerForRetrieverRun) -> List[Document]:
+        docs = await self.base_retriever.ainvoke(query, config={"callbacks": run_manager.get_child()})
+        return await self.packer.apack(query, docs)
@@ -1,30 +1,173 @@
 import os
+import threading
 
-from app.components.vector_store import save_vector_store
-from app.components.pdf_loader import load_pdf_files, create_text_chunks
+from app.components.pdf_loader import iter_pdf_pages, text_splitter
+from app.components.ingestion_pipeline import release_chunks, stream_ingest
+from app.components.chain_registry import invalidate_qa_chain
+from app.components.collections import get_collection
+from app.components.lexical_index import get_lexical_index
+from app.components.dedup_index import get_dedup_index
+from app.components.manifest import load_manifest, save_manifest, plan_ingestion
 
-from app.config.config import * 
+from app.config.config import *
 from app.common.logger import get_logger
 from app.common.custom_exception import CustomException
+from app.common.metrics import begin_timing, end_timing, span
 
 logger = get_logger(__name__)
 
-def process_and_store_pdfs():
+# Uploads and removals both rewrite a collection's manifest, so they must not interleave;
+# different collections share nothing and can be ingested at the same time
+_ingestion_locks = {}
+_ingestion_locks_lock = threading.Lock()
+
+
+def _ingestion_lock(collection):
+    with _ingestion_locks_lock:
+        return _ingestion_locks.setdefault(collection.name, threading.Lock())
+
+
+def _backfill_lexical_index(manifest, lexical_index, dedup_index, skip, data_path):
+    """
+    Adds files that are in the manifest but not in the lexical index, e.g. ones ingested
+    before the index existed. Only parsing and chunking is redone, nothing is re-embedded.
+    """
+    # Chunks stored as a near-duplicate's vector are never in the lexical index themselves
+    missing = [
+        (filename, entry) for filename, entry in manifest["files"].items()
+        if filename not in skip and entry.get("chunk_ids")
+        and entry["chunk_ids"][0] not in lexical_index and entry["chunk_ids"][0] not in dedup_index
+    ]
+    if not missing:
+        return 0
+
+    logger.info(f"Adding {len(missing)} already ingested files to the lexical index")
+    splitter = text_splitter()
+    for filename, entry in missing:
+        # One file at a time, so memory is bounded by the largest file
+        try:
+            chunks = [chunk for _, chunk in splitter.iter_chunks(iter_pdf_pages(os.path.join(data_path, filename)))]
+        except Exception as e:
+            logger.warning(f"Skipping {filename} in the lexical index, it could not be parsed: {e}")
+            continue
+        if len(chunks) != len(entry["chunk_ids"]):
+            # Chunking settings changed since ingestion, IDs would not line up with the vectors
+            logger.warning(f"Skipping {filename} in the lexical index: {len(chunks)} chunks, manifest has {len(entry['chunk_ids'])}")
+            continue
+        lexical_index.add(entry["chunk_ids"], [chunk.page_content for chunk in chunks], [chunk.metadata for chunk in chunks])
+    return len(missing)
+
+
+def _backfill_dedup_index(manifest, lexical_index, dedup_index, skip):
+    """
+    Adds chunks that have a vector but aren't in the dedup index, e.g. ones ingested before it
+    existed, so new chunks are matched against them too. Their text comes from the lexical index.
+    """
+    added = 0
+    for filename, entry in manifest["files"].items():
+        if filename in skip:
+            continue
+        for chunk_id in entry.get("chunk_ids", []):
+            if chunk_id in dedup_index:
+                continue
+            chunk = lexical_index.chunk(chunk_id)
+            if chunk is None:
+                continue
+            text, metadata = chunk
+            dedup_index.add(chunk_id, dedup_index.signatures_for([text])[0], metadata)
+            added += 1
+    if added:
+        logger.info(f"Added {added} already ingested chunks to the dedup index")
+    return added
+
+
+def process_and_store_pdfs(progress=None, collection=None):
+    """
+    Brings the vectors of the named collection (default DEFAULT_COLLECTION) in line with its data folder:
+    only new or modified PDFs are embedded and upserted, and files that disappeared have their
+    vectors deleted. Other collections are not read or touched.
+    progress(field, amount), if given, receives files/chunks/vectors counts as work completes.
+    Returns a summary dict, or None if ingestion failed.
+    """
+    timing = begin_timing()
+    try:
+        collection = get_collection(collection)
+    except ValueError as e:
+        logger.error(str(CustomException("Failed to create vectorstore", e)))
+        end_timing(timing, "ingestion", "error")
+        return None
     try:
-        logger.info("Making the vectorestore....")
-        
-        documents = load_pdf_files()
-        
-        text_chunks = create_text_chunks(documents)
-        
-        save_vector_store(text_chunks)
-        
-        logger.info("Vectorstore created successfully ..")
-        
+        with _ingestion_lock(collection):
+            logger.info(f"Making the vectorestore for collection '{collection.name}'....")
+
+            with span("ingest_plan"):
+                manifest = load_manifest(collection.manifest_path)
+                changed, removed = plan_ingestion(manifest, collection.data_path)
+            if progress:
+                progress("files_total", len(changed))
+
+            lexical_index = get_lexical_index(collection.lexical_index_path)
+            dedup_index = get_dedup_index(collection.dedup_index_path)
+            skip = {name for name, _, _ in changed} | set(removed)
+            with span("ingest_lexical_backfill"):
+                backfilled = _backfill_lexical_index(manifest, lexical_index, dedup_index, skip, collection.data_path)
+            if DEDUP_ENABLED:
+                with span("ingest_dedup_backfill"):
+                    _backfill_dedup_index(manifest, lexical_index, dedup_index, skip)
+
+            if not changed and not removed:
+                if backfilled:
+                    lexical_index.commit()
+                    lexical_index.save()
+                    invalidate_qa_chain(collection.name)
+                dedup_index.save()
+                logger.info(f"Vectorstore is already up to date with the data folder of collection '{collection.name}'")
+                end_timing(timing, "ingestion", "unchanged")
+                return {"ingested_files": 0, "removed_files": 0, "chunks": 0, "chunks_deduplicated": 0, "failed_files": []}
+
+            with span("ingest_delete_removed"):
+                for filename in removed:
+                    release_chunks(manifest["files"][filename].get("chunk_ids", []), dedup_index, lexical_index,
+                                   collection=collection)
+                    del manifest["files"][filename]
+
+            chunk_count, failed_files, deduplicated = (
+                stream_ingest(manifest, changed, lexical_index, dedup_index, progress, collection=collection)
+                if changed else (0, [], 0)
+            )
+
+            # Saved before the manifest, whose mtime tells other processes to rebuild their chain
+            with span("ingest_save"):
+                lexical_index.commit()
+                lexical_index.save()
+                dedup_index.save()
+                save_manifest(manifest, collection.manifest_path)
+
+            # The collection's index changed, so the chains searching it must be rebuilt
+            invalidate_qa_chain(collection.name)
+
+            ingested = len(changed) - len(failed_files)
+            logger.info(f"Vectorstore of collection '{collection.name}' updated: {ingested} files ingested ({chunk_count} chunks, {deduplicated} near-duplicates removed), "
+                        f"{len(removed)} files removed")
+            if failed_files:
+                logger.error(f"Some chunks of these files could not be upserted, they will be retried on the next run: {failed_files}")
+            end_timing(timing, "ingestion", "partial" if failed_files else "ok")
+            return {"ingested_files": ingested, "removed_files": len(removed), "chunks": chunk_count,
+                    "chunks_deduplicated": deduplicated, "failed_files": failed_files}
+
     except Exception as e:
-        error_message = CustomException("Failed to create vectorstore")
+        try:
+            # Drop half-applied lexical and dedup index changes, the manifest wasn't saved either
+            get_lexical_index(collection.lexical_index_path).load(force=True)
+            get_dedup_index(collection.dedup_index_path).load(force=True)
+        except Exception as reload_error:
+            logger.error(f"Failed to reload the lexical index: {reload_error}")
+        error_message = CustomException("Failed to create vectorstore", e)
         logger.error(str(error_message))
+        end_timing(timing, "ingestion", "error")
+        return None
 
 
 if __name__ == "__main__":
-    process_and_store_pdfs()
\ No newline at end of file
+    import sys
+    process_and_store_pdfs(collection=sys.argv[1] if len(sys.argv) > 1 else None)
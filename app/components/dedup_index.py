@@ -0,0 +1,392 @@
+import json
+import os
+import re
+import threading
+import zlib
+
+import numpy as np
+from langchain_core.documents import Document
+
+from app.config.config import *
+from app.common.logger import get_logger
+from app.common.custom_exception import CustomException
+from app.common.metrics import REGISTRY
+
+logger = get_logger(__name__)
+
+_WORD_RE = re.compile(r"\w+")
+
+# Universal hashing (a * x + b) mod p over 32-bit shingle hashes, with p the first prime above 2**32
+_PRIME = np.uint64(4294967311)
+_MAX_HASH = np.uint64(0xFFFFFFFF)
+_SHINGLE_BASE = np.uint64(1099511628211)
+
+CHUNKS_DEDUPLICATED = REGISTRY.counter(
+    "rag_chunks_deduplicated_total", "Chunks not embedded because a near-duplicate is already indexed")
+
+
+def shingle_hashes(text, words=DEDUP_SHINGLE_WORDS):
+    """32-bit hashes of the text's overlapping word n-grams (lowercased). Empty if it has no words."""
+    tokens = _WORD_RE.findall(text.lower())
+    if not tokens:
+        return np.zeros(0, dtype=np.uint64)
+    hashes = np.fromiter((zlib.crc32(token.encode("utf-8")) for token in tokens), dtype=np.uint64, count=len(tokens))
+    n = max(1, len(tokens) - words + 1)
+    combined = np.zeros(n, dtype=np.uint64)
+    # Polynomial hash of each window of word hashes, wrapping at 64 bits
+    with np.errstate(over="ignore"):
+        for offset in range(min(words, len(tokens))):
+            combined = combined * _SHINGLE_BASE + hashes[offset:offset + n]
+    return np.unique((combined ^ (combined >> np.uint64(32))) & _MAX_HASH)
+
+
+class MinHasher:
+    """MinHash signatures: for each of num_perm hash functions, the smallest hash over a text's shingles."""
+
+    def __init__(self, num_perm=DEDUP_NUM_PERM, shingle_words=DEDUP_SHINGLE_WORDS, seed=1):
+        rng = np.random.default_rng(seed)
+        self.num_perm = num_perm
+        self.shingle_words = shingle_words
+        # Below 2**32, so a * x + b can't overflow 64 bits
+        self.a = rng.integers(1, 2 ** 32 - 1, num_perm, dtype=np.uint64)
+        self.b = rng.integers(0, 2 ** 32 - 1, num_perm, dtype=np.uint64)
+
+    def signature(self, text):
+        """uint32 signature of num_perm values, or None for a text without words."""
+        shingles = shingle_hashes(text, self.shingle_words)
+        if not len(shingles):
+            return None
+        hashed = (shingles[:, None] * self.a + self.b) % _PRIME
+        return (hashed & _MAX_HASH).min(axis=0).astype(np.uint32)
+
+
+def lsh_params(threshold, num_perm):
+    """
+    (bands, rows) for LSH banding of num_perm values: two signatures collide in a band with
+    probability s ** rows, so the candidate threshold (1 / bands) ** (1 / rows) is put as
+    close to the similarity threshold as possible.
+    """
+    best = None
+    for rows in range(1, num_perm + 1):
+        bands = num_perm // rows
+        error = abs((1.0 / bands) ** (1.0 / rows) - threshold)
+        if best is None or error < best[0]:
+            best = (error, bands, rows)
+    return best[1], best[2]
+
+
+def _band_hashes(signatures, bands, rows):
+    """(n, bands) uint64 hash of each band of each signature."""
+    signatures = np.asarray(signatures, dtype=np.uint64).reshape(-1, signatures.shape[-1])
+    hashes = np.zeros((len(signatures), bands), dtype=np.uint64)
+    with np.errstate(over="ignore"):
+        for row in range(rows):
+            hashes = hashes * _SHINGLE_BASE + signatures[:, row:bands * rows:rows]
+    return hashes
+
+
+def source_label(metadata):
+    return f"{metadata.get('source', '')}#page={metadata.get('page', '')}"
+
+
+class DedupIndex:
+    """
+    MinHash/LSH index of the chunks that have a vector, used to find near-duplicates of new
+    chunks without comparing them to every stored one.
+
+    Each signature is cut into bands; chunks sharing any band hash are candidates, and a
+    candidate is a duplicate if the share of equal signature values (an estimate of the
+    Jaccard similarity of their shingles) is at least threshold. Committed band hashes are
+    sorted arrays searched with searchsorted, chunks added since are in per-band dicts.
+
+    A stored chunk (the canonical) records every chunk it stands for as a holder
+    [chunk_id, source, page], itself first. Releasing a holder drops it; the canonical's vector
+    is only deleted once no holder is left, otherwise its metadata moves to the next holder.
+    The whole index is a single .npz file, replaced atomically on save().
+    """
+
+    def __init__(self, path=DEDUP_INDEX_PATH, threshold=DEDUP_THRESHOLD, num_perm=DEDUP_NUM_PERM,
+                 shingle_words=DEDUP_SHINGLE_WORDS):
+        self.path = path
+        self.threshold = threshold
+        self.hasher = MinHasher(num_perm, shingle_words)
+        self.bands, self.rows = lsh_params(threshold, num_perm)
+        self._lock = threading.RLock()
+        self._loaded_mtime = None
+        self._reset()
+        self._dirty = False
+
+    def _reset(self):
+        num_perm = self.hasher.num_perm
+        self.canonical_ids = []
+        self.holders = {}
+        self.canonical_of = {}
+        self._rows = {}
+        self.signatures = np.zeros((0, num_perm), dtype=np.uint32)
+        self.alive = np.zeros(0, dtype=bool)
+        self._pending_signatures = []
+        self._pending_bands = [{} for _ in range(self.bands)]
+        self.sorted_bands = np.zeros((self.bands, 0), dtype=np.uint64)
+        self.sorted_rows = np.zeros((self.bands, 0), dtype=np.int64)
+
+    def __len__(self):
+        return len(self._rows)
+
+    def __contains__(self, chunk_id):
+        """True for a stored chunk and for every chunk it stands for."""
+        return chunk_id in self.canonical_of
+
+    def signatures_for(self, texts):
+        return [self.hasher.signature(text) for text in texts]
+
+    def _signature(self, row):
+        committed = len(self.signatures)
+        return self.signatures[row] if row < committed else self._pending_signatures[row - committed]
+
+    def _candidates(self, band_hashes):
+        rows = set()
+        if self.sorted_bands.shape[1]:
+            for band in range(self.bands):
+                keys = self.sorted_bands[band]
+                lo, hi = np.searchsorted(keys, band_hashes[band], "left"), np.searchsorted(keys, band_hashes[band], "right")
+                rows.update(self.sorted_rows[band, lo:hi].tolist())
+        for band in range(self.bands):
+            rows.update(self._pending_bands[band].get(int(band_hashes[band]), ()))
+        return rows
+
+    def _best(self, signature, rows):
+        best, best_similarity = None, self.threshold
+        for row in rows:
+            if row < len(self.alive) and not self.alive[row]:
+                continue
+            if row >= len(self.alive) and self._rows.get(self.canonical_ids[row]) != row:
+                continue
+            similarity = float(np.mean(self._signature(row) == signature))
+            if similarity >= best_similarity:
+                best, best_similarity = row, similarity
+        return best
+
+    def match(self, signatures):
+        """
+        For each signature, the ID (str) of a stored chunk it duplicates, else the position (int)
+        of an earlier signature in the list it duplicates, else None. Changes nothing.
+        """
+        matches = []
+        with self._lock:
+            window = {}
+            for position, signature in enumerate(signatures):
+                if signature is None:
+                    matches.append(None)
+                    continue
+                band_hashes = _band_hashes(signature[None, :], self.bands, self.rows)[0]
+                stored = self._best(signature, self._candidates(band_hashes))
+                if stored is not None:
+                    matches.append(self.canonical_ids[stored])
+                    continue
+                earlier = None
+                seen = {i for band in range(self.bands) for i in window.get((band, int(band_hashes[band])), ())}
+                for i in sorted(seen):
+                    if float(np.mean(signatures[i] == signature)) >= self.threshold:
+                        earlier = i
+                        break
+                matches.append(earlier)
+                if earlier is None:
+                    for band in range(self.bands):
+                        window.setdefault((band, int(band_hashes[band])), []).append(position)
+        return matches
+
+    def add(self, chunk_id, signature, metadata):
+        """Records a chunk that got its own vector."""
+        with self._lock:
+            self._dirty = True
+            if chunk_id in self.canonical_of:
+                self.release([chunk_id])
+            self.canonical_of[chunk_id] = chunk_id
+            self.holders[chunk_id] = [[chunk_id, metadata.get("source"), metadata.get("page")]]
+            if signature is None:
+                return
+            row = len(self.canonical_ids)
+            self.canonical_ids.append(chunk_id)
+            self._rows[chunk_id] = row
+            self._pending_signatures.append(np.asarray(signature, dtype=np.uint32))
+            band_hashes = _band_hashes(signature[None, :], self.bands, self.rows)[0]
+            for band in range(self.bands):
+                self._pending_bands[band].setdefault(int(band_hashes[band]), []).append(row)
+
+    def alias(self, chunk_id, canonical_id, metadata):
+        """Records a chunk that is stored as canonical_id's vector. Returns that vector's new metadata."""
+        with self._lock:
+            self._dirty = True
+            if chunk_id in self.canonical_of:
+                self.release([chunk_id])
+            self.canonical_of[chunk_id] = canonical_id
+            self.holders[canonical_id].append([chunk_id, metadata.get("source"), metadata.get("page")])
+            return self.holder_metadata(canonical_id)
+
+    def holder_metadata(self, canonical_id):
+        """Metadata fields for a stored chunk: its first holder's source and page, and where its duplicates are."""
+        first, *rest = self.holders[canonical_id]
+        return {
+            "source": first[1],
+            "page": first[2],
+            "duplicate_sources": [source_label({"source": source, "page": page}) for _, source, page in rest],
+        }
+
+    def release(self, ids):
+        """
+        Forgets the chunks. Returns (ids whose vectors should be deleted, {canonical id:
+        metadata}) for the stored chunks that lost a holder but still stand for others.
+        """
+        delete, updates = [], {}
+        with self._lock:
+            for chunk_id in ids:
+                canonical_id = self.canonical_of.pop(chunk_id, None)
+                if canonical_id is None:
+                    # Ingested before deduplication, or never stored: the vector (if any) goes
+                    delete.append(chunk_id)
+                    continue
+                self._dirty = True
+                holders = self.holders[canonical_id]
+                holders[:] = [holder for holder in holders if holder[0] != chunk_id]
+                if holders:
+                    updates[canonical_id] = self.holder_metadata(canonical_id)
+                    continue
+                del self.holders[canonical_id]
+                updates.pop(canonical_id, None)
+                delete.append(canonical_id)
+                row = self._rows.pop(canonical_id, None)
+                if row is not None and row < len(self.alive):
+                    self.alive[row] = False
+        return delete, updates
+
+    def commit(self):
+        """Folds chunks added since the last commit into the sorted band arrays."""
+        with self._lock:
+            if self._pending_signatures:
+                self.signatures = np.concatenate([self.signatures, np.stack(self._pending_signatures)])
+                alive = np.zeros(len(self.signatures), dtype=bool)
+                alive[:len(self.alive)] = self.alive
+                for row in range(len(self.alive), len(alive)):
+                    alive[row] = self._rows.get(self.canonical_ids[row]) == row
+                self.alive = alive
+                self._pending_signatures = []
+                self._pending_bands = [{} for _ in range(self.bands)]
+
+            n_rows = len(self.canonical_ids)
+            if n_rows and (~self.alive).sum() * 4 >= n_rows:
+                self._compact()
+            self._build_bands()
+
+    def _compact(self):
+        keep = np.flatnonzero(self.alive)
+        self.canonical_ids = [self.canonical_ids[row] for row in keep]
+        self.signatures = self.signatures[keep]
+        self.alive = np.ones(len(keep), dtype=bool)
+        self._rows = {chunk_id: row for row, chunk_id in enumerate(self.canonical_ids)}
+        logger.info(f"Compacted dedup index to {len(keep)} chunks")
+
+    def _build_bands(self):
+        live = np.flatnonzero(self.alive)
+        band_hashes = _band_hashes(self.signatures[live], self.bands, self.rows).T
+        order = np.argsort(band_hashes, axis=1, kind="stable")
+        self.sorted_bands = np.take_along_axis(band_hashes, order, axis=1)
+        self.sorted_rows = live[order] if len(live) else np.zeros((self.bands, 0), dtype=np.int64)
+
+    def save(self):
+        """Writes the committed index, unless nothing changed since it was last saved or loaded."""
+        if self.path is None:
+            return
+        with self._lock:
+            if not self._dirty:
+                return
+            self.commit()
+            docs = json.dumps({
+                "settings": self._settings(),
+                "canonical_ids": self.canonical_ids,
+                "holders": self.holders,
+            }).encode("utf-8")
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, "wb") as f:
+                np.savez(f, docs=np.frombuffer(docs, dtype=np.uint8), signatures=self.signatures, alive=self.alive)
+            os.replace(tmp_path, self.path)
+            self._loaded_mtime = os.path.getmtime(self.path)
+            self._dirty = False
+            logger.info(f"Saved dedup index with {len(self)} chunks standing for {len(self.canonical_of)}")
+
+    def _settings(self):
+        return {"num_perm": self.hasher.num_perm, "shingle_words": self.hasher.shingle_words}
+
+    def load(self, force=False):
+        """
+        (Re)reads the index from disk if the file changed since it was last read.
+        force=True also throws away changes that were never saved.
+        """
+        if self.path is None:
+            return self
+        with self._lock:
+            if not os.path.exists(self.path):
+                if force:
+                    self._reset()
+                    self._dirty = False
+                return self
+            mtime = os.path.getmtime(self.path)
+            if mtime == self._loaded_mtime and not force:
+                return self
+            try:
+                with np.load(self.path) as data:
+                    docs = json.loads(data["docs"].tobytes().decode("utf-8"))
+                    signatures, alive = data["signatures"], data["alive"]
+            except Exception as e:
+                raise CustomException("Failed to read dedup index", e)
+            self._reset()
+            if docs["settings"] == self._settings():
+                self.canonical_ids, self.holders = docs["canonical_ids"], docs["holders"]
+                self.signatures, self.alive = signatures, alive
+                self.canonical_of = {holder[0]: canonical_id
+                                     for canonical_id, holders in self.holders.items() for holder in holders}
+                self._rows = {chunk_id: row for row, chunk_id in enumerate(self.canonical_ids) if self.alive[row]}
+            else:
+                # Signatures made with other settings can't be compared; stored chunks are added back by the backfill
+                logger.warning("Dedup settings changed, starting an empty dedup index")
+                self._dirty = True
+            self._build_bands()
+            self._loaded_mtime = mtime
+            if not self._dirty:
+                logger.info(f"Loaded dedup index with {len(self)} chunks")
+            return self
+
+
+def deduplicate_chunks(chunks, threshold=DEDUP_THRESHOLD):
+    """
+    Collapses near-duplicate chunks of one batch into the first of each group, whose metadata
+    lists the others under duplicate_sources. Returns (kept chunks, number removed).
+    """
+    index = DedupIndex(path=None, threshold=threshold)
+    matches = index.match(index.signatures_for([chunk.page_content for chunk in chunks]))
+    kept, duplicates = [], {}
+    for position, (chunk, match) in enumerate(zip(chunks, matches)):
+        if match is None:
+            kept.append(position)
+        else:
+            duplicates.setdefault(match, []).append(source_label(chunk.metadata))
+    removed = len(chunks) - len(kept)
+    if removed:
+        CHUNKS_DEDUPLICATED.inc(removed)
+        logger.info(f"Removed {removed} near-duplicate chunks of {len(chunks)}")
+    return [Document(page_content=chunks[i].page_content,
+                     metadata={**chunks[i].metadata, "duplicate_sources": duplicates[i]} if i in duplicates else chunks[i].metadata)
+            for i in kept], removed
+
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+def get_dedup_index(path=DEDUP_INDEX_PATH):
+    """The process-wide index for path, refreshed from disk if another process rewrote it."""
+    with _indexes_lock:
+        index = _indexes.get(path)
+        if index is None:
+            index = _indexes[path] = DedupIndex(path)
+    return index.load()
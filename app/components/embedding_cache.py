@@ -0,0 +1,454 @@
+import atexit
+import hashlib
+import itertools
+import json
+import os
+import re
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+from app.config.config import *
+from app.common.logger import get_logger
+
+try:
+    import fcntl
+except ImportError:  # not on POSIX, assume a single process uses the cache
+    fcntl = None
+
+logger = get_logger(__name__)
+
+# On-disk index record: 16-byte key digest, slot in the vector file, last access (ns since the
+# epoch). In the journal an all-zero key clears the slot.
+_INDEX_DTYPE = np.dtype([("key", "V16"), ("slot", "<u4"), ("tick", "<u8")])
+_CLEARED = bytes(16)
+_MIN_CAPACITY = 1024
+
+
+def normalize_text(text):
+    return " ".join(text.split())
+
+
+def cache_key(model_name, kind, text):
+    # kind matters: the query and document task types give different vectors for the same text
+    payload = f"{model_name}\x00{kind}\x00{normalize_text(text)}".encode("utf-8")
+    return hashlib.blake2b(payload, digest_size=16).digest()
+
+
+class EmbeddingCacheStore:
+    """
+    Persistent embedding store for one model: float32 rows in a memory-mapped file
+    (vectors.f32), a compact binary key index (index.bin), a journal of the index records
+    written since the index was saved (journal.bin) and meta.json with the dimension.
+    Bounded to max_entries; least recently used entries are evicted first.
+
+    Every process on the host reads and writes the same cache. put_many() and flush() hold
+    an exclusive lock on writer.lock while they catch up on the journal, claim free or
+    evicted rows and append their records, hits included, so eviction sees every process's
+    hits. A row is cleared in the journal before it is overwritten, and a lookup whose row
+    was cleared while it read it is a miss.
+    """
+
+    def __init__(self, path, model_name, max_entries=EMBEDDING_CACHE_MAX_ENTRIES,
+                 flush_interval=EMBEDDING_CACHE_FLUSH_INTERVAL):
+        self.path = path
+        self.model_name = model_name
+        self.max_entries = max_entries
+        self.flush_interval = flush_interval
+
+        self.dim = None
+        self.capacity = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        self._lock = threading.RLock()
+        self._slots = {}
+        self._slot_keys = []
+        self._ticks = np.zeros(0, dtype=np.uint64)
+        self._vectors = None
+        # Hits not yet written to the journal, {key: tick}
+        self._touched = {}
+        # Bytes of the journal applied here
+        self._journal_offset = 0
+        # Files as they were when loaded, how a process notices a grown or compacted cache
+        self._loaded_stamp = None
+        self._last_flush = time.monotonic()
+
+        os.makedirs(path, exist_ok=True)
+        self._load()
+
+    @property
+    def _meta_path(self):
+        return os.path.join(self.path, "meta.json")
+
+    @property
+    def _index_path(self):
+        return os.path.join(self.path, "index.bin")
+
+    @property
+    def _journal_path(self):
+        return os.path.join(self.path, "journal.bin")
+
+    @property
+    def _vectors_path(self):
+        return os.path.join(self.path, "vectors.f32")
+
+    @contextmanager
+    def _writer_lock(self):
+        if fcntl is None:
+            yield
+            return
+        with open(os.path.join(self.path, "writer.lock"), "w") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            yield
+
+    def _stamp(self):
+        """meta.json's and index.bin's (inode, mtime, size) and journal.bin's inode."""
+        stamp = []
+        for path in (self._meta_path, self._index_path, self._journal_path):
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                stamp.append(None)
+                continue
+            stamp.append(stat.st_ino if path == self._journal_path else (stat.st_ino, stat.st_mtime_ns, stat.st_size))
+        return tuple(stamp)
+
+    def _reset(self):
+        self.dim, self.capacity, self._vectors = None, 0, None
+        self._slots, self._slot_keys = {}, []
+        self._ticks = np.zeros(0, dtype=np.uint64)
+        self._journal_offset = 0
+
+    def _load(self):
+        self._reset()
+        # Taken before reading, so a save during the load is noticed on the next lookup
+        self._loaded_stamp = self._stamp()
+        if not os.path.exists(self._meta_path):
+            return
+        try:
+            with open(self._meta_path, "r", encoding="utf-8") as f:
+                meta = json.load(f)
+            if meta.get("model") != self.model_name:
+                logger.warning(f"Embedding cache {self.path} belongs to another model, ignoring it")
+                return
+
+            self.dim = meta["dim"]
+            self.capacity = meta["capacity"]
+            self._vectors = np.memmap(self._vectors_path, dtype=np.float32, mode="r+",
+                                      shape=(self.capacity, self.dim))
+            self._ticks = np.zeros(self.capacity, dtype=np.uint64)
+            self._slot_keys = [None] * self.capacity
+            if os.path.exists(self._index_path):
+                self._apply(np.fromfile(self._index_path, dtype=_INDEX_DTYPE))
+            self._read_journal()
+            logger.info(f"Loaded embedding cache {self.path}: {len(self._slots)} entries, dim={self.dim}")
+        except Exception as e:
+            logger.error(f"Embedding cache {self.path} is unreadable, starting empty: {e}")
+            self._reset()
+
+    def _apply(self, records):
+        """Applies index or journal records; returns the rows that lost their key."""
+        changed = set()
+        for record in records:
+            slot, key, tick = int(record["slot"]), bytes(record["key"]), int(record["tick"])
+            if slot >= self.capacity:
+                # Written by a process that grew the file after meta.json was read here
+                continue
+            current = self._slot_keys[slot]
+            if current is not None and current != key:
+                del self._slots[current]
+                self._slot_keys[slot] = None
+                changed.add(slot)
+            if key == _CLEARED:
+                continue
+            if current != key:
+                self._slots[key] = slot
+                self._slot_keys[slot] = key
+            self._ticks[slot] = max(int(self._ticks[slot]), tick)
+        return changed
+
+    def _read_journal(self):
+        try:
+            with open(self._journal_path, "rb") as f:
+                f.seek(self._journal_offset)
+                data = f.read()
+        except FileNotFoundError:
+            return set()
+        # A record still being written is read next time
+        usable = len(data) - len(data) % _INDEX_DTYPE.itemsize
+        self._journal_offset += usable
+        return self._apply(np.frombuffer(data[:usable], dtype=_INDEX_DTYPE))
+
+    def _refresh(self):
+        """Catches up with what other processes wrote: the rows that lost their key, or None after a reload."""
+        if self._stamp() != self._loaded_stamp:
+            self._load()
+            return None
+        return self._read_journal()
+
+    def _append_journal(self, records):
+        """Appends records to the journal and applies them. Called with the writer lock held."""
+        if not records:
+            return
+        with open(self._journal_path, "ab") as f:
+            # Drops a record a crashed process left half-written
+            f.truncate(self._journal_offset)
+            f.write(np.array(records, dtype=_INDEX_DTYPE).tobytes())
+        self._read_journal()
+
+    def _touch_records(self):
+        records = [(key, self._slots[key], tick) for key, tick in self._touched.items() if key in self._slots]
+        self._touched = {}
+        return records
+
+    def _compact(self):
+        """Saves the index and starts an empty journal once the journal outgrows it."""
+        if self._journal_offset // _INDEX_DTYPE.itemsize <= max(len(self._slots), _MIN_CAPACITY):
+            return
+        records = np.empty(len(self._slots), dtype=_INDEX_DTYPE)
+        for i, (key, slot) in enumerate(self._slots.items()):
+            records[i] = (key, slot, self._ticks[slot])
+        tmp_path = f"{self._index_path}.tmp"
+        records.tofile(tmp_path)
+        os.replace(tmp_path, self._index_path)
+        # Replaced rather than truncated, so other processes see a new file and reload
+        tmp_path = f"{self._journal_path}.tmp"
+        open(tmp_path, "wb").close()
+        os.replace(tmp_path, self._journal_path)
+        self._journal_offset = 0
+
+    def _write_meta(self):
+        tmp_path = f"{self._meta_path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"model": self.model_name, "dim": self.dim, "capacity": self.capacity}, f)
+        os.replace(tmp_path, self._meta_path)
+
+    def _grow(self, needed):
+        new_capacity = min(self.max_entries, max(_MIN_CAPACITY, self.capacity * 2, needed))
+        if new_capacity <= self.capacity:
+            return
+        if self._vectors is not None:
+            self._vectors.flush()
+            del self._vectors
+        with open(self._vectors_path, "ab") as f:
+            f.truncate(new_capacity * self.dim * 4)
+        self._vectors = np.memmap(self._vectors_path, dtype=np.float32, mode="r+",
+                                  shape=(new_capacity, self.dim))
+        self._ticks = np.concatenate([self._ticks, np.zeros(new_capacity - self.capacity, dtype=np.uint64)])
+        self._slot_keys.extend([None] * (new_capacity - self.capacity))
+        self.capacity = new_capacity
+        self._write_meta()
+
+    def _evict(self, count):
+        """The count least recently used rows."""
+        used = np.array(list(self._slots.values()), dtype=np.int64)
+        count = min(count, len(used))
+        if count <= 0:
+            return []
+        self.evictions += count
+        return used[np.argpartition(self._ticks[used], count - 1)[:count]].tolist()
+
+    def get_many(self, keys):
+        with self._lock:
+            self._refresh()
+            results, slots, now = [], [], time.time_ns()
+            for key in keys:
+                slot = self._slots.get(key)
+                slots.append(slot)
+                if slot is None:
+                    results.append(None)
+                else:
+                    self._ticks[slot] = now
+                    self._touched[key] = now
+                    results.append(self._vectors[slot].tolist())
+            # Rows are cleared in the journal before they are overwritten, so a row cleared
+            # while it was read here may already hold another text's vector
+            changed = self._refresh()
+            if changed is None:
+                results = [None] * len(keys)
+            elif changed:
+                results = [None if slot in changed else result for slot, result in zip(slots, results)]
+            hits = sum(result is not None for result in results)
+            self.hits += hits
+            self.misses += len(keys) - hits
+            if self._touched and time.monotonic() - self._last_flush >= self.flush_interval:
+                self.flush()
+            return results
+
+    def put_many(self, keys, vectors):
+        if not keys:
+            return
+        with self._lock, self._writer_lock():
+            self._refresh()
+            if self.dim is None:
+                self.dim = len(vectors[0])
+            new_items = [(key, vector) for key, vector in zip(keys, vectors) if key not in self._slots]
+            if new_items:
+                needed = len(self._slots) + len(new_items)
+                if needed > self.capacity:
+                    self._grow(needed)
+                new_items = new_items[-self.capacity:]
+                free = list(itertools.islice((slot for slot, key in enumerate(self._slot_keys) if key is None),
+                                             len(new_items)))
+                shortfall = len(new_items) - len(free)
+                if shortfall > 0:
+                    # Evict a tenth of the cache at once so eviction isn't paid on every insert
+                    evicted = self._evict(max(shortfall, self.max_entries // 10))
+                    # Cleared before the rows are overwritten, so no process maps a key to another text's vector
+                    self._append_journal([(_CLEARED, slot, 0) for slot in evicted])
+                    free.extend(evicted)
+
+                now = time.time_ns()
+                for (_, vector), slot in zip(new_items, free):
+                    self._vectors[slot] = vector
+                # Rows reach the file before the records that point at them
+                self._vectors.flush()
+                self._append_journal([(key, slot, now) for (key, _), slot in zip(new_items, free)])
+
+            if self._touched and time.monotonic() - self._last_flush >= self.flush_interval:
+                self._append_journal(self._touch_records())
+                self._last_flush = time.monotonic()
+            self._compact()
+            self._loaded_stamp = self._stamp()
+
+    def flush(self):
+        """Writes the hits recorded since the last flush, so other processes' eviction sees them."""
+        with self._lock:
+            if not self._touched:
+                return
+            with self._writer_lock():
+                self._refresh()
+                self._append_journal(self._touch_records())
+                self._compact()
+                self._loaded_stamp = self._stamp()
+            self._last_flush = time.monotonic()
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._slots),
+            "dim": self.dim,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+        }
+
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def get_cache_store(model_name, cache_dir=EMBEDDING_CACHE_DIR):
+    """One store per model and directory per process, shared by every CachedEmbeddings."""
+    path = os.path.join(cache_dir, re.sub(r"[^A-Za-z0-9_.-]+", "_", model_name))
+    with _stores_lock:
+        store = _stores.get(path)
+        if store is None:
+            store = EmbeddingCacheStore(path, model_name)
+            _stores[path] = store
+            atexit.register(store.flush)
+        return store
+
+
+def _is_google(model):
+    # Only a model that was already built can be one, so this never pays for the import
+    module = sys.modules.get("langchain_google_genai")
+    return module is not None and isinstance(model, module.GoogleGenerativeAIEmbeddings)
+
+
+def embed_queries(model, texts):
+    """
+    Query embeddings of many texts in one request. Models without a batched query
+    call get embed_documents(), which is the same thing for symmetric models.
+    """
+    if not texts:
+        return []
+    if hasattr(model, "embed_queries"):
+        return model.embed_queries(texts)
+    if _is_google(model):
+        return model.embed_documents(texts, task_type="RETRIEVAL_QUERY")
+    return model.embed_documents(texts)
+
+
+async def aembed_queries(model, texts):
+    """embed_queries() without blocking the event loop."""
+    if not texts:
+        return []
+    if hasattr(model, "aembed_queries"):
+        return await model.aembed_queries(texts)
+    if _is_google(model):
+        return await model.aembed_documents(texts, task_type="RETRIEVAL_QUERY")
+    return await model.aembed_documents(texts)
+
+
+class CachedEmbeddings(Embeddings):
+    """Wraps an embedding model; only texts missing from the persistent cache reach the model."""
+
+    def __init__(self, model, model_name, store=None):
+        self.model = model
+        self.model_name = model_name
+        self.store = store or get_cache_store(model_name)
+
+    @property
+    def dimension(self):
+        return self.store.dim
+
+    def _lookup(self, texts, kind):
+        """(keys, cached vectors with None for misses, {key: text} still to embed)."""
+        keys = [cache_key(self.model_name, kind, text) for text in texts]
+        vectors = self.store.get_many(keys)
+        # Duplicate texts in one call are embedded once
+        unique = {}
+        for i, vector in enumerate(vectors):
+            if vector is None:
+                unique.setdefault(keys[i], texts[i])
+        return keys, vectors, unique
+
+    def _fill(self, keys, vectors, unique, computed):
+        by_key = dict(zip(unique.keys(), computed))
+        self.store.put_many(list(by_key.keys()), list(by_key.values()))
+        return [list(by_key[key]) if vector is None else vector for key, vector in zip(keys, vectors)]
+
+    def _embed(self, texts, kind, embed_fn):
+        keys, vectors, unique = self._lookup(texts, kind)
+        if not unique:
+            return vectors
+        return self._fill(keys, vectors, unique, embed_fn(list(unique.values())))
+
+    async def _aembed(self, texts, kind, embed_fn):
+        keys, vectors, unique = self._lookup(texts, kind)
+        if not unique:
+            return vectors
+        return self._fill(keys, vectors, unique, await embed_fn(list(unique.values())))
+
+    def embed_documents(self, texts):
+        vectors = self._embed(texts, "document", self.model.embed_documents)
+        logger.info(f"Embedding cache: {len(texts)} texts, stats {self.store.stats()}")
+        return vectors
+
+    def embed_query(self, text):
+        return self._embed([text], "query", lambda batch: [self.model.embed_query(batch[0])])[0]
+
+    def embed_queries(self, texts):
+        return self._embed(texts, "query", lambda batch: embed_queries(self.model, batch))
+
+    async def aembed_documents(self, texts):
+        return await self._aembed(texts, "document", self.model.aembed_documents)
+
+    async def aembed_query(self, text):
+        async def embed(batch):
+            return [await self.model.aembed_query(batch[0])]
+        return (await self._aembed([text], "query", embed))[0]
+
+    async def aembed_queries(self, texts):
+        return await self._aembed(texts, "query", lambda batch: aembed_queries(self.model, batch))
+
+    def stats(self):
+        return self.store.stats()
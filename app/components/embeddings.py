@@ -1,6 +1,11 @@
-from langchain_google_genai import GoogleGenerativeAIEmbeddings
+import threading
+
+from langchain_core.embeddings import Embeddings
+from app.components.embedding_cache import CachedEmbeddings, aembed_queries, embed_queries
 from app.common.logger import get_logger
 from app.common.custom_exception import CustomException
+from app.common.resilience import get_dependency
+from app.config.config import EMBEDDING_MODEL_NAME, EMBEDDING_CACHE_ENABLED, EMBEDDING_TIMEOUT, QUERY_BATCHING_ENABLED
 from dotenv import load_dotenv
 
 # Load environment variables from .env file (e.g., GOOGLE_API_KEY)
@@ -8,19 +13,80 @@ load_dotenv()
 
 logger = get_logger(__name__)
 
-def get_embeddings_model() -> GoogleGenerativeAIEmbeddings:
-    
-    logger.info("Initializing GoogleGenerativeAIEmbeddings model...")
-    try:
-      
-        embeddings_model = GoogleGenerativeAIEmbeddings(model="models/embedding-001")
-        
-        logger.info("GoogleGenerativeAIEmbeddings model initialized successfully.")
-        return embeddings_model
-        
-    except Exception as e:
-     
-        logger.error(f"Failed to initialize embedding model: {e}")
-        
-       
-        raise CustomException("Error occurred while loading embedding model") from e
\ No newline at end of file
+
+class ResilientEmbeddings(Embeddings):
+    """
+    Wraps an embedding model so every request goes through a dependency: a deadline,
+    retries, the circuit breaker and, when enabled, hedging. Queries go through
+    "embeddings"; document batches, which take longer, through "embeddings_bulk", so they
+    neither time out on the query deadline nor open the circuit queries depend on. Document
+    batches are tried once: ingestion retries them itself (call_with_backoff), with the
+    longer backoff a rate-limited bulk job needs.
+    Embedding the same texts twice gives the same vectors, so every call is idempotent.
+    """
+
+    def __init__(self, model, dependency=None, bulk_dependency=None):
+        self.model = model
+        self.dependency = dependency or get_dependency("embeddings")
+        self.bulk_dependency = bulk_dependency or get_dependency("embeddings_bulk")
+
+    def embed_documents(self, texts, **kwargs):
+        return self.bulk_dependency.call(lambda: self.model.embed_documents(texts, **kwargs),
+                                         idempotent=True, retries=0)
+
+    def embed_query(self, text):
+        return self.dependency.call(lambda: self.model.embed_query(text), idempotent=True)
+
+    def embed_queries(self, texts):
+        return self.dependency.call(lambda: embed_queries(self.model, texts), idempotent=True)
+
+    async def aembed_documents(self, texts, **kwargs):
+        return await self.bulk_dependency.acall(lambda: self.model.aembed_documents(texts, **kwargs),
+                                                idempotent=True, retries=0)
+
+    async def aembed_query(self, text):
+        return await self.dependency.acall(lambda: self.model.aembed_query(text), idempotent=True)
+
+    async def aembed_queries(self, texts):
+        return await self.dependency.acall(lambda: aembed_queries(self.model, texts), idempotent=True)
+
+
+# Built once per process, so every caller shares the client and its open connections
+_embeddings_model = None
+_embeddings_model_lock = threading.Lock()
+
+
+def get_embeddings_model() -> Embeddings:
+    global _embeddings_model
+
+    if _embeddings_model is not None:
+        return _embeddings_model
+    with _embeddings_model_lock:
+        if _embeddings_model is not None:
+            return _embeddings_model
+        logger.info("Initializing GoogleGenerativeAIEmbeddings model...")
+        try:
+            # Imported on first use, it is the slowest import in the app
+            from langchain_google_genai import GoogleGenerativeAIEmbeddings
+
+            embeddings_model = GoogleGenerativeAIEmbeddings(model=EMBEDDING_MODEL_NAME,
+                                                            request_options={"timeout": EMBEDDING_TIMEOUT})
+
+            logger.info("GoogleGenerativeAIEmbeddings model initialized successfully.")
+
+            embeddings_model = ResilientEmbeddings(embeddings_model)
+            if QUERY_BATCHING_ENABLED:
+                # Under the cache, so cache hits never wait for a batch to fill
+                from app.components.coalescer import MicroBatchingEmbeddings
+                embeddings_model = MicroBatchingEmbeddings(embeddings_model)
+            if EMBEDDING_CACHE_ENABLED:
+                # Unchanged texts are served from the on-disk cache instead of the API
+                embeddings_model = CachedEmbeddings(embeddings_model, EMBEDDING_MODEL_NAME)
+            _embeddings_model = embeddings_model
+            return _embeddings_model
+
+        except Exception as e:
+
+            logger.error(f"Failed to initialize embedding model: {e}")
+
+            raise CustomException("Error occurred while loading embedding model") from e
@@ -0,0 +1,149 @@
+import asyncio
+import threading
+from typing import Any, Dict, List
+
+from langchain_core.callbacks import AsyncCallbackManagerForRetrieverRun, CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+
+from app.config.config import *
+from app.common.logger import get_logger
+from app.common.metrics import REGISTRY, span
+
+logger = get_logger(__name__)
+
+
+def _doc_key(doc):
+    return doc.id or (doc.metadata.get("source"), doc.metadata.get("page"), doc.page_content)
+
+
+def reciprocal_rank_fusion(rankings, k, rrf_k=RRF_K):
+    """Fuses ranked Document lists: each list adds 1 / (rrf_k + rank) to a document's score."""
+    scores, docs = {}, {}
+    for ranking in rankings:
+        for rank, doc in enumerate(ranking, start=1):
+            key = _doc_key(doc)
+            scores[key] = scores.get(key, 0.0) + 1.0 / (rrf_k + rank)
+            docs.setdefault(key, doc)
+    best = sorted(scores, key=scores.get, reverse=True)[:k]
+    return [docs[key] for key in best]
+
+
+class HybridRetriever(BaseRetriever):
+    """
+    Dense retrieval fused with BM25 over the local lexical index (reciprocal-rank fusion).
+
+    Short keyword queries skip the dense retriever, and with it the embedding call, when
+    BM25 alone is confident: the query has at most max_terms terms, all known to the index
+    and at least one in no more than max_df of the chunks, and the top hit reaches
+    min_confidence of the best score the query could get. That is the common case for
+    exact identifiers such as "GradientTape" or "tf.keras.layers.Conv2D".
+    """
+
+    dense_retriever: BaseRetriever
+    lexical_index: Any
+    k: int = RETRIEVER_K
+    candidates: int = HYBRID_CANDIDATES
+    rrf_k: int = RRF_K
+    fast_path: bool = LEXICAL_FAST_PATH_ENABLED
+    min_confidence: float = LEXICAL_FAST_PATH_MIN_CONFIDENCE
+    max_terms: int = LEXICAL_FAST_PATH_MAX_TERMS
+    max_df: float = LEXICAL_FAST_PATH_MAX_DF
+
+    def _is_confident(self, query, hits, confidence):
+        if not self.fast_path or not hits or confidence < self.min_confidence:
+            return False
+        fractions = self.lexical_index.term_frequencies(query)
+        if not fractions or None in fractions or len(fractions) > self.max_terms:
+            return False
+        return min(fractions) <= self.max_df
+
+    def _get_relevant_documents(self, query: str, *, run_manager: CallbackManagerForRetrieverRun) -> List[Document]:
+        return self.retrieve(query, lambda: self.dense_retriever.invoke(query, config={"callbacks": run_manager.get_child()}))
+
+    async def _aget_relevant_documents(self, query: str, *, run_manager: AsyncCallbackManagerForRetrieverRun) -> List[Document]:
+        async def dense_search():
+            return await self.dense_retriever.ainvoke(query, config={"callbacks": run_manager.get_child()})
+        return await self.aretrieve(query, dense_search)
+
+    def _lexical(self, query):
+        """(lexical hits, the final documents if the fast path applies else None)."""
+        with span("lexical_search"):
+            hits, confidence = self.lexical_index.search(query, self.candidates)
+        if self._is_confident(query, hits, confidence):
+            retrieval_stats.record("lexical_only")
+            logger.info(f"Lexical fast path for '{query}' (confidence {confidence:.2f})")
+            return hits, [doc for _, doc in hits[:self.k]]
+        return hits, None
+
+    def retrieve(self, query, dense_search):
+        """
+        The fast path / dense-only / hybrid choice for one query. dense_search() returns the
+        dense candidates and is only called when needed, e.g. a search by a precomputed vector.
+        """
+        hits, docs = self._lexical(query)
+        return docs if docs is not None else self._fuse(hits, dense_search())
+
+    async def aretrieve(self, query, dense_search):
+        """retrieve() with dense_search a coroutine function."""
+        hits, docs = self._lexical(query)
+        return docs if docs is not None else self._fuse(hits, await dense_search())
+
+    def _fuse(self, hits, dense_docs):
+        if not hits:
+            retrieval_stats.record("dense_only")
+            return dense_docs[:self.k]
+        retrieval_stats.record("hybrid")
+        return reciprocal_rank_fusion([dense_docs, [doc for _, doc in hits]], self.k, self.rrf_k)
+
+
+class CollectionsRetriever(BaseRetriever):
+    """
+    Searches several collections, each with its own retriever, and fuses their rankings with
+    reciprocal-rank fusion: scores from different indexes aren't comparable, ranks are.
+    Every result's metadata names the collection it came from.
+    """
+
+    retrievers: Dict[str, BaseRetriever]
+    k: int = RETRIEVER_K
+    rrf_k: int = RRF_K
+
+    def _get_relevant_documents(self, query: str, *, run_manager: CallbackManagerForRetrieverRun) -> List[Document]:
+        return self.fuse([retriever.invoke(query, config={"callbacks": run_manager.get_child()})
+                          for retriever in self.retrievers.values()])
+
+    async def _aget_relevant_documents(self, query: str, *, run_manager: AsyncCallbackManagerForRetrieverRun) -> List[Document]:
+        return self.fuse(await asyncio.gather(*(
+            retriever.ainvoke(query, config={"callbacks": run_manager.get_child()})
+            for retriever in self.retrievers.values()
+        )))
+
+    def fuse(self, rankings):
+        """The top k of rankings, one per collection in the order of retrievers."""
+        tagged = [
+            [Document(id=doc.id, page_content=doc.page_content, metadata={**doc.metadata, "collection": name})
+             for doc in ranking]
+            for name, ranking in zip(self.retrievers, rankings)
+        ]
+        return reciprocal_rank_fusion(tagged, self.k, self.rrf_k)
+
+
+class RetrievalStats:
+    """How often each retrieval path was taken; lexical_only queries skipped the embedding call."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counts = {"lexical_only": 0, "hybrid": 0, "dense_only": 0}
+
+    def record(self, path):
+        with self._lock:
+            self.counts[path] += 1
+
+    def stats(self):
+        with self._lock:
+            return dict(self.counts)
+
+
+retrieval_stats = RetrievalStats()
+REGISTRY.register_callback("rag_retrieval_paths_total", "Hybrid retriever queries by the path they took",
+                           retrieval_stats.stats, kind="counter", labelname="path")
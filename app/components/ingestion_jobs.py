@@ -0,0 +1,128 @@
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from app.config.config import *
+from app.common.logger import get_logger
+
+logger = get_logger(__name__)
+
+PROGRESS_FIELDS = ("files_total", "files_parsed", "chunks_total", "chunks_deduplicated", "chunks_embedded", "vectors_upserted")
+
+
+class IngestionJob:
+    def __init__(self, files, collection=DEFAULT_COLLECTION):
+        self.id = uuid.uuid4().hex
+        self.status = "queued"
+        self.collection = collection
+        self.files = list(files)
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.summary = None
+        self.error = None
+        self.progress = {field: 0 for field in PROGRESS_FIELDS}
+        self._lock = threading.Lock()
+
+    def add_progress(self, field, amount):
+        with self._lock:
+            self.progress[field] += amount
+
+    def to_dict(self):
+        with self._lock:
+            return {
+                "id": self.id,
+                "status": self.status,
+                "collection": self.collection,
+                "files": list(self.files),
+                "created_at": self.created_at,
+                "started_at": self.started_at,
+                "finished_at": self.finished_at,
+                "progress": dict(self.progress),
+                "summary": self.summary,
+                "error": self.error,
+            }
+
+
+class IngestionQueue:
+    """
+    Runs process_and_store_pdfs() on a bounded worker pool instead of inside the request.
+    Uploads that arrive while a job for the same collection is still queued join that job,
+    so a burst of uploads turns into a single ingestion run of that collection.
+    Job state lives in this process only.
+    """
+
+    def __init__(self, workers=INGESTION_WORKERS, history=INGESTION_JOB_HISTORY):
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="ingestion")
+        self._lock = threading.Lock()
+        self._jobs = OrderedDict()
+        # collection -> its queued (not yet started) job
+        self._queued = {}
+        self._history = history
+
+    def submit(self, files=(), collection=DEFAULT_COLLECTION):
+        with self._lock:
+            queued = self._queued.get(collection)
+            if queued is not None:
+                queued.files.extend(f for f in files if f not in queued.files)
+                logger.info(f"Coalesced upload of {list(files)} into queued ingestion job {queued.id}")
+                return queued
+
+            job = IngestionJob(files, collection)
+            self._queued[collection] = job
+            self._jobs[job.id] = job
+            while len(self._jobs) > self._history:
+                self._jobs.popitem(last=False)
+            self._executor.submit(self._run, job)
+            logger.info(f"Queued ingestion job {job.id} for {job.files} in collection '{collection}'")
+            return job
+
+    def _run(self, job):
+        with self._lock:
+            # From here on new uploads need a new run, since the data folder was already scanned
+            if self._queued.get(job.collection) is job:
+                del self._queued[job.collection]
+            job.status = "running"
+            job.started_at = time.time()
+
+        status, summary, error = "failed", None, "Ingestion failed, check the logs for details"
+        try:
+            # The PDF and ingestion stack loads with the first job, not with the web app
+            from app.components.data_loader import process_and_store_pdfs
+            summary = process_and_store_pdfs(progress=job.add_progress, collection=job.collection)
+            if summary is not None:
+                status, error = "done", None
+        except Exception as e:
+            # Raised here it would only reach the executor's future, leaving the job running forever
+            logger.error(f"Ingestion job {job.id} raised: {e}")
+            error = f"Ingestion failed: {e}"
+        finally:
+            with job._lock:
+                job.finished_at = time.time()
+                job.status, job.summary, job.error = status, summary, error
+        logger.info(f"Ingestion job {job.id} {job.status} in {job.finished_at - job.started_at:.2f}s")
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def latest(self):
+        with self._lock:
+            return next(reversed(self._jobs.values()), None)
+
+    def shutdown(self):
+        self._executor.shutdown(wait=True)
+
+
+_queue = None
+_queue_lock = threading.Lock()
+
+
+def get_ingestion_queue():
+    global _queue
+    with _queue_lock:
+        if _queue is None:
+            _queue = IngestionQueue()
+        return _queue
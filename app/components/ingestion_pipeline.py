@@ -0,0 +1,383 @@
+import json
+import os
+import queue
+import threading
+import time
+
+from langchain_core.documents import Document
+
+from app.components.collections import get_collection
+from app.components.dedup_index import CHUNKS_DEDUPLICATED, source_label
+from app.components.embeddings import get_embeddings_model
+from app.components.manifest import chunk_id_prefix, make_chunk_ids, record_file, save_manifest
+from app.components.pdf_loader import iter_pdf_pages, parse_pool, text_splitter
+from app.components.vector_store import (open_vector_index, upsert_text_chunks, flush_vector_index, delete_vectors,
+                                          update_vector_metadata)
+
+from app.config.config import *
+from app.common.logger import get_logger
+from app.common.custom_exception import CustomException
+from app.common.metrics import record, span, timed_stage, timings_context
+
+logger = get_logger(__name__)
+
+CHECKPOINT_VERSION = 1
+
+_END = "end"
+
+
+def _checkpoint_settings():
+    # Chunk IDs are positional, so a resumed run must split and embed exactly like the interrupted one
+    # and deduplicate the same way, or a resumed chunk could alias a vector it no longer matches
+    return {"embedding_model": EMBEDDING_MODEL_NAME, "chunk_size": CHUNK_SIZE, "chunk_overlap": CHUNK_OVERLAP,
+            "chunk_unit": CHUNK_UNIT, "chunk_across_pages": CHUNK_ACROSS_PAGES,
+            "dedup_threshold": DEDUP_THRESHOLD if DEDUP_ENABLED else None}
+
+
+def load_checkpoint(path=INGESTION_CHECKPOINT_PATH):
+    """
+    Reads the ingestion checkpoint: {"settings": {...}, "files": {filename: {sha256, chunks_done,
+    resume_page, resume_offset, resume_chunk}}} for files whose ingestion started but didn't finish.
+    """
+    if not os.path.exists(path):
+        return {"version": CHECKPOINT_VERSION, "settings": _checkpoint_settings(), "files": {}}
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            checkpoint = json.load(f)
+        checkpoint.setdefault("files", {})
+        return checkpoint
+    except Exception as e:
+        raise CustomException("Failed to read ingestion checkpoint", e)
+
+
+def save_checkpoint(checkpoint, path=INGESTION_CHECKPOINT_PATH):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    checkpoint["version"] = CHECKPOINT_VERSION
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(checkpoint, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+class _FileState:
+    def __init__(self, filename, path, file_hash, resume=None):
+        resume = resume or {}
+        self.filename = filename
+        self.path = path
+        self.file_hash = file_hash
+        self.prefix = chunk_id_prefix(filename, file_hash)
+        # Chunks [0, chunks_done) are upserted; chunking restarts at character resume_offset of
+        # resume_page, where chunk resume_chunk starts
+        self.chunks_done = resume.get("chunks_done", 0)
+        self.resume_page = resume.get("resume_page", 0)
+        self.resume_offset = resume.get("resume_offset", 0)
+        self.resume_chunk = resume.get("resume_chunk", 0)
+        self.total = None
+        self.failed = False
+        self.finished = False
+
+    def chunk_id(self, index):
+        return f"{self.prefix}-{index}"
+
+    def chunk_done(self, index, start):
+        """Chunk index, which starts at (page, offset), is upserted; a resumed run re-chunks from it."""
+        self.chunks_done = index + 1
+        (self.resume_page, self.resume_offset), self.resume_chunk = start, index
+
+    def checkpoint_entry(self):
+        return {
+            "sha256": self.file_hash,
+            "chunks_done": self.chunks_done,
+            "resume_page": self.resume_page,
+            "resume_offset": self.resume_offset,
+            "resume_chunk": self.resume_chunk,
+        }
+
+
+def release_chunks(ids, dedup_index, lexical_index, index=None, collection=None):
+    """
+    Removes a collection's chunks from the vector store and lexical index. A vector that also
+    stands for near-duplicates of other files is kept, with its metadata moved over to one of them.
+    Without an index from open_vector_index(), one is opened and flushed here.
+    """
+    delete, updates = dedup_index.release(ids)
+    delete_vectors(delete, collection=collection)
+    lexical_index.remove(delete)
+    if updates:
+        owned = index is None
+        if owned:
+            index = open_vector_index(get_embeddings_model(), collection)
+        update_vector_metadata(index, updates)
+        for chunk_id, metadata in updates.items():
+            lexical_index.update_metadata(chunk_id, metadata)
+        if owned:
+            flush_vector_index(index)
+
+
+def _discard_partial_files(checkpoint, manifest, resumable, lexical_index, dedup_index, collection):
+    """
+    Deletes the vectors of interrupted files that can't be resumed: the file changed or
+    disappeared since, or the chunking/embedding settings did.
+    """
+    same_settings = checkpoint.get("settings") == _checkpoint_settings()
+    for filename, entry in list(checkpoint["files"].items()):
+        if same_settings and resumable.get(filename) == entry["sha256"]:
+            continue
+        del checkpoint["files"][filename]
+        manifest_entry = manifest["files"].get(filename)
+        if manifest_entry and manifest_entry.get("sha256") == entry["sha256"]:
+            # Finished after all, the manifest just got saved before the checkpoint
+            continue
+        partial_ids = make_chunk_ids(filename, entry["sha256"], entry["chunks_done"])
+        logger.info(f"Discarding {len(partial_ids)} vectors of an interrupted ingestion of {filename}")
+        release_chunks(partial_ids, dedup_index, lexical_index, collection=collection)
+    checkpoint["settings"] = _checkpoint_settings()
+
+
+def _put(chunk_queue, item, stop):
+    while not stop.is_set():
+        try:
+            chunk_queue.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+
+def _produce(files, chunk_queue, stop, executor, max_in_flight):
+    """Parsing stage: pages -> chunks, one file after another, into the bounded chunk queue."""
+    splitter = text_splitter()
+    try:
+        for state in files:
+            began = time.perf_counter()
+            index = state.resume_chunk
+            # Time spent parsing and splitting, without the waits for room in the queue
+            parse_seconds = 0.0
+            try:
+                pages = iter_pdf_pages(state.path, state.resume_page, executor, max_in_flight)
+                chunks = splitter.iter_chunks(pages, state.resume_offset)
+                while True:
+                    parse_began = time.perf_counter()
+                    start, chunk = next(chunks, (None, None))
+                    parse_seconds += time.perf_counter() - parse_began
+                    if chunk is None:
+                        break
+                    # On resume the first chunk is the last one already upserted
+                    if index >= state.chunks_done:
+                        if not _put(chunk_queue, ("chunk", state, start, index, chunk), stop):
+                            return
+                    index += 1
+                record("ingest_parse", parse_seconds)
+                if not _put(chunk_queue, ("file_done", state, index), stop):
+                    return
+                logger.info(f"Parsed {state.path} in {time.perf_counter() - began:.2f}s")
+            except Exception as e:
+                record("ingest_parse", parse_seconds, failed=True)
+                if not _put(chunk_queue, ("file_failed", state, e), stop):
+                    return
+    finally:
+        _put(chunk_queue, (_END,), stop)
+
+
+class _Ingestion:
+    def __init__(self, manifest, checkpoint, lexical_index, dedup_index, embedding_model, index, progress, collection):
+        self.collection = collection
+        self.manifest = manifest
+        self.checkpoint = checkpoint
+        self.lexical_index = lexical_index
+        self.dedup_index = dedup_index
+        self.embedding_model = embedding_model
+        self.index = index
+        self.progress = progress
+        self.upserted = 0
+        self.deduplicated = 0
+        self.since_checkpoint = 0
+
+    def _match(self, chunks):
+        """(signatures, matches) from the dedup index, see DedupIndex.match()."""
+        if not DEDUP_ENABLED:
+            return [None] * len(chunks), [None] * len(chunks)
+        with span("ingest_dedup"):
+            signatures = self.dedup_index.signatures_for([chunk.page_content for chunk in chunks])
+            return signatures, self.dedup_index.match(signatures)
+
+    @timed_stage("ingest_upsert_window")
+    def upsert_window(self, window):
+        ids = [state.chunk_id(index) for state, _, index, _ in window]
+        chunks = [chunk for *_, chunk in window]
+        signatures, matches = self._match(chunks)
+
+        # Only chunks without a near-duplicate get a vector; one with duplicates later in the
+        # window lists their sources in its metadata
+        merged = {}
+        for chunk, match in zip(chunks, matches):
+            if isinstance(match, int):
+                merged.setdefault(match, []).append(source_label(chunk.metadata))
+        stored = {
+            i: Document(page_content=chunks[i].page_content, metadata={**chunks[i].metadata, "duplicate_sources": merged[i]})
+            if i in merged else chunks[i]
+            for i, match in enumerate(matches) if match is None
+        }
+        report = upsert_text_chunks(self.index, list(stored.values()), [ids[i] for i in stored],
+                                    self.embedding_model, self.progress)
+        failed_ids = set(report["failed_ids"])
+        if self.progress and len(stored) < len(window):
+            self.progress("chunks_deduplicated", len(window) - len(stored))
+
+        done, deduplicated, updates = [], 0, {}
+        for i, ((state, start, index, chunk), chunk_id, match) in enumerate(zip(window, ids, matches)):
+            if state.failed:
+                continue
+            canonical_id = ids[match] if isinstance(match, int) else match or chunk_id
+            # A duplicate of a chunk earlier in the window can only be recorded if that one was
+            if canonical_id in failed_ids or (isinstance(match, int) and match not in done):
+                # The checkpoint stays before this chunk, so the next run retries from here
+                state.failed = True
+                logger.error(f"Chunk {index} of {state.filename} could not be upserted, the file will be retried on the next run")
+                continue
+            state.chunk_done(index, start)
+            if match is None:
+                self.dedup_index.add(chunk_id, signatures[i], chunk.metadata)
+                done.append(i)
+            else:
+                metadata = self.dedup_index.alias(chunk_id, canonical_id, chunk.metadata)
+                if isinstance(match, str):
+                    updates[canonical_id] = metadata
+                deduplicated += 1
+
+        # Vectors stored before this window now also stand for chunks of it
+        update_vector_metadata(self.index, updates)
+        for chunk_id, metadata in updates.items():
+            self.lexical_index.update_metadata(chunk_id, metadata)
+
+        self.lexical_index.add([ids[i] for i in done], [stored[i].page_content for i in done],
+                               [stored[i].metadata for i in done])
+        if deduplicated:
+            CHUNKS_DEDUPLICATED.inc(deduplicated)
+        self.upserted += len(done)
+        self.deduplicated += deduplicated
+        self.since_checkpoint += len(done) + deduplicated
+
+    @timed_stage("ingest_finish_file")
+    def finish_file(self, state):
+        chunk_ids = make_chunk_ids(state.filename, state.file_hash, state.total)
+        old_entry = self.manifest["files"].get(state.filename)
+        if old_entry:
+            # IDs embed the file hash, so the previous version's vectors are all stale
+            stale_ids = sorted(set(old_entry.get("chunk_ids", [])) - set(chunk_ids))
+            release_chunks(stale_ids, self.dedup_index, self.lexical_index, self.index, self.collection)
+        record_file(self.manifest, state.filename, state.file_hash, chunk_ids)
+        self.checkpoint["files"].pop(state.filename, None)
+        state.finished = True
+
+    @timed_stage("ingest_checkpoint")
+    def save(self, files):
+        """Makes everything upserted so far durable, then records how far each file got."""
+        flush_vector_index(self.index)
+        self.lexical_index.commit()
+        self.lexical_index.save()
+        self.dedup_index.save()
+        save_manifest(self.manifest, self.collection.manifest_path)
+        for state in files:
+            if not state.finished and (state.chunks_done or state.failed):
+                self.checkpoint["files"][state.filename] = state.checkpoint_entry()
+        save_checkpoint(self.checkpoint, self.collection.checkpoint_path)
+        self.since_checkpoint = 0
+
+
+def stream_ingest(manifest, changed, lexical_index, dedup_index, progress=None, workers=None, collection=None):
+    """
+    Ingests the changed files (filename, path, sha256) as a pipeline: pages are parsed and
+    split in a background thread into a bounded queue of INGEST_QUEUE_SIZE chunks, and the
+    chunks are embedded and upserted INGEST_WINDOW_SIZE at a time, so memory stays flat
+    however many PDFs there are.
+
+    Every INGEST_CHECKPOINT_INTERVAL upserted chunks the vector store, lexical index and
+    manifest are saved and each file's position is written to the checkpoint. An interrupted
+    run resumes from there instead of starting over.
+
+    With DEDUP_ENABLED, a chunk that is a near-duplicate of one already stored (or earlier in
+    the run) isn't embedded; the stored vector's metadata lists it under duplicate_sources.
+    Everything is read from and written to one collection (default DEFAULT_COLLECTION), whose
+    manifest, lexical and dedup indexes the caller passes in.
+    Returns (chunk_count, failed_files, deduplicated_count).
+    """
+    collection = collection or get_collection()
+    checkpoint = load_checkpoint(collection.checkpoint_path)
+    _discard_partial_files(checkpoint, manifest, {filename: file_hash for filename, _, file_hash in changed},
+                           lexical_index, dedup_index, collection)
+
+    files = [_FileState(filename, path, file_hash, checkpoint["files"].get(filename))
+             for filename, path, file_hash in changed]
+    for state in files:
+        if state.chunks_done:
+            logger.info(f"Resuming {state.filename} at chunk {state.chunks_done} (page {state.resume_page})")
+
+    embedding_model = get_embeddings_model()
+    ingestion = _Ingestion(manifest, checkpoint, lexical_index, dedup_index, embedding_model,
+                           open_vector_index(embedding_model, collection), progress, collection)
+
+    workers = PDF_PARSE_WORKERS if workers is None else workers
+    chunk_queue = queue.Queue(maxsize=INGEST_QUEUE_SIZE)
+    stop = threading.Event()
+    executor = parse_pool(workers)
+    # The parser's spans count towards this ingestion run's timing log line
+    producer = threading.Thread(
+        target=timings_context().run, name="ingestion-parser", daemon=True,
+        args=(_produce, files, chunk_queue, stop, executor, 2 * workers),
+    )
+    producer.start()
+
+    began = time.perf_counter()
+    window, parsed = [], []
+    # Time the embed/upsert side sat idle waiting for the parser
+    waited = 0.0
+    try:
+        while True:
+            wait_began = time.perf_counter()
+            item = chunk_queue.get()
+            waited += time.perf_counter() - wait_began
+            if item[0] == _END:
+                break
+            state = item[1]
+            if item[0] == "chunk":
+                if progress:
+                    progress("chunks_total", 1)
+                if not state.failed:
+                    window.append(item[1:])
+            elif item[0] == "file_done":
+                state.total = item[2]
+                parsed.append(state)
+                if progress:
+                    progress("files_parsed", 1)
+            else:
+                state.failed = True
+                logger.error(f"Failed to parse {state.path}: {item[2]}")
+
+            if len(window) >= INGEST_WINDOW_SIZE:
+                ingestion.upsert_window(window)
+                window = []
+            for state in [state for state in parsed if not state.failed and state.chunks_done >= state.total]:
+                ingestion.finish_file(state)
+                parsed.remove(state)
+            if ingestion.since_checkpoint >= INGEST_CHECKPOINT_INTERVAL:
+                ingestion.save(files)
+
+        if window:
+            ingestion.upsert_window(window)
+        for state in parsed:
+            if not state.failed and state.chunks_done >= state.total:
+                ingestion.finish_file(state)
+        ingestion.save(files)
+    finally:
+        stop.set()
+        producer.join()
+        if executor is not None:
+            executor.shutdown(wait=True, cancel_futures=True)
+
+    record("ingest_queue_wait", waited)
+    seconds = time.perf_counter() - began
+    failed_files = [state.filename for state in files if not state.finished]
+    logger.info(f"Streamed {ingestion.upserted} chunks of {len(files)} files in {seconds:.2f}s, "
+                f"{ingestion.deduplicated} near-duplicate chunks removed")
+    return ingestion.upserted, failed_files, ingestion.deduplicated
@@ -0,0 +1,306 @@
+import json
+import os
+import re
+import threading
+
+import numpy as np
+from langchain_core.documents import Document
+
+from app.config.config import *
+from app.common.logger import get_logger
+from app.common.custom_exception import CustomException
+
+logger = get_logger(__name__)
+
+_TOKEN_RE = re.compile(r"[a-z0-9_]+")
+
+_STOPWORDS = frozenset("""
+a an and are as at be by can do does for from how i in is it its of on or that the this
+to was what when where which who why will with you your
+""".split())
+
+
+def tokenize(text):
+    """Lowercased word tokens; snake_case identifiers also yield their parts."""
+    tokens = []
+    for token in _TOKEN_RE.findall(text.lower()):
+        if token in _STOPWORDS:
+            continue
+        tokens.append(token)
+        if "_" in token:
+            tokens.extend(part for part in token.split("_") if part and part not in _STOPWORDS)
+    return tokens
+
+
+class LexicalIndex:
+    """
+    BM25 inverted index over text chunks, kept next to the vector store so keyword
+    lookups don't need an embedding call.
+
+    Postings are flat numpy arrays (term, row, tf) and are turned into per-term
+    slices (offsets into post_rows/post_tf) on commit(), together with the BM25 length
+    norms k1 * (1 - b + b * len / avgdl) for every row. Removed chunks are tombstoned
+    and compacted away once they make up a quarter of the rows.
+    The whole index is a single .npz file, replaced atomically on save().
+    """
+
+    def __init__(self, path=LEXICAL_INDEX_PATH, k1=BM25_K1, b=BM25_B):
+        self.path = path
+        self.k1 = k1
+        self.b = b
+        self._lock = threading.RLock()
+        self._loaded_mtime = None
+        self._reset()
+        self._dirty = False
+
+    def _reset(self):
+        self.terms = {}
+        self.chunk_ids = []
+        self.texts = []
+        self.metadatas = []
+        self._rows = {}
+        self.doc_len = np.zeros(0, dtype=np.int32)
+        self.alive = np.zeros(0, dtype=bool)
+        self._t_term = np.zeros(0, dtype=np.int32)
+        self._t_row = np.zeros(0, dtype=np.int32)
+        self._t_tf = np.zeros(0, dtype=np.uint16)
+        self._pending = []
+        self.offsets = np.zeros(1, dtype=np.int64)
+        self.post_rows = np.zeros(0, dtype=np.int32)
+        self.post_tf = np.zeros(0, dtype=np.float32)
+        self.idf = np.zeros(0, dtype=np.float32)
+        self.norms = np.zeros(0, dtype=np.float32)
+
+    def __len__(self):
+        return len(self._rows)
+
+    def __contains__(self, chunk_id):
+        return chunk_id in self._rows
+
+    def add(self, ids, texts, metadatas=None):
+        """Buffers chunks for the next commit(); an existing id is replaced."""
+        metadatas = metadatas or [{} for _ in ids]
+        with self._lock:
+            self._dirty = True
+            self.remove([chunk_id for chunk_id in ids if chunk_id in self._rows])
+            for chunk_id, text, metadata in zip(ids, texts, metadatas):
+                row = len(self.chunk_ids)
+                self.chunk_ids.append(chunk_id)
+                self.texts.append(text)
+                self.metadatas.append(dict(metadata))
+                self._rows[chunk_id] = row
+
+                counts = {}
+                tokens = tokenize(text)
+                for token in tokens:
+                    term = self.terms.setdefault(token, len(self.terms))
+                    counts[term] = counts.get(term, 0) + 1
+                self._pending.append((row, len(tokens), counts))
+
+    def remove(self, ids):
+        with self._lock:
+            self._dirty = self._dirty or bool(ids)
+            for chunk_id in ids:
+                row = self._rows.pop(chunk_id, None)
+                if row is not None and row < len(self.alive):
+                    self.alive[row] = False
+                elif row is not None:
+                    # Not committed yet, so it simply never becomes alive
+                    self._pending = [entry for entry in self._pending if entry[0] != row]
+
+    def chunk(self, chunk_id):
+        """(text, metadata) of an indexed chunk, or None."""
+        with self._lock:
+            row = self._rows.get(chunk_id)
+            return None if row is None else (self.texts[row], dict(self.metadatas[row]))
+
+    def update_metadata(self, chunk_id, metadata):
+        """Merges metadata into a chunk's metadata."""
+        with self._lock:
+            row = self._rows.get(chunk_id)
+            if row is not None:
+                self.metadatas[row] = {**self.metadatas[row], **metadata}
+                self._dirty = True
+
+    def commit(self):
+        """Folds buffered changes into the postings and recomputes idf and length norms."""
+        with self._lock:
+            n_rows = len(self.chunk_ids)
+            if self._pending or len(self.alive) != n_rows:
+                terms, rows, tfs = [], [], []
+                doc_len = np.zeros(n_rows, dtype=np.int32)
+                doc_len[:len(self.doc_len)] = self.doc_len
+                alive = np.zeros(n_rows, dtype=bool)
+                alive[:len(self.alive)] = self.alive
+                for row, length, counts in self._pending:
+                    doc_len[row] = length
+                    alive[row] = True
+                    terms.extend(counts.keys())
+                    rows.extend([row] * len(counts))
+                    tfs.extend(counts.values())
+                self.doc_len, self.alive = doc_len, alive
+                self._t_term = np.concatenate([self._t_term, np.asarray(terms, dtype=np.int32)])
+                self._t_row = np.concatenate([self._t_row, np.asarray(rows, dtype=np.int32)])
+                self._t_tf = np.concatenate([self._t_tf, np.minimum(np.asarray(tfs, dtype=np.int64), 65535).astype(np.uint16)])
+                self._pending = []
+
+            if n_rows and (~self.alive).sum() * 4 >= n_rows:
+                self._compact()
+            self._build_postings()
+
+    def _compact(self):
+        keep = np.flatnonzero(self.alive)
+        remap = np.full(len(self.alive), -1, dtype=np.int64)
+        remap[keep] = np.arange(len(keep))
+        live_postings = self.alive[self._t_row]
+        self._t_term = self._t_term[live_postings]
+        self._t_row = remap[self._t_row[live_postings]].astype(np.int32)
+        self._t_tf = self._t_tf[live_postings]
+
+        self.chunk_ids = [self.chunk_ids[row] for row in keep]
+        self.texts = [self.texts[row] for row in keep]
+        self.metadatas = [self.metadatas[row] for row in keep]
+        self.doc_len = self.doc_len[keep]
+        self.alive = np.ones(len(keep), dtype=bool)
+        self._rows = {chunk_id: row for row, chunk_id in enumerate(self.chunk_ids)}
+        logger.info(f"Compacted lexical index to {len(keep)} chunks")
+
+    def _build_postings(self):
+        live_postings = self.alive[self._t_row] if len(self._t_row) else np.zeros(0, dtype=bool)
+        order = np.argsort(self._t_term, kind="stable")
+        n_terms = len(self.terms)
+
+        self.post_rows = self._t_row[order]
+        self.post_tf = self._t_tf[order].astype(np.float32)
+        counts = np.bincount(self._t_term, minlength=n_terms)
+        self.offsets = np.zeros(n_terms + 1, dtype=np.int64)
+        np.cumsum(counts, out=self.offsets[1:])
+
+        n_docs = int(self.alive.sum())
+        df = np.bincount(self._t_term[live_postings], minlength=n_terms).astype(np.float64)
+        self.idf = np.log(1.0 + (n_docs - df + 0.5) / (df + 0.5)).astype(np.float32)
+
+        live_len = self.doc_len[self.alive]
+        avgdl = float(live_len.mean()) if len(live_len) else 1.0
+        self.norms = (self.k1 * (1.0 - self.b + self.b * self.doc_len / max(avgdl, 1.0))).astype(np.float32)
+
+    def term_frequencies(self, query):
+        """Fraction of chunks containing each query term, None for terms the index has never seen."""
+        with self._lock:
+            n_docs = max(int(self.alive.sum()), 1)
+            fractions = []
+            for token in dict.fromkeys(tokenize(query)):
+                term = self.terms.get(token)
+                if term is None or term >= len(self.idf):
+                    fractions.append(None)
+                else:
+                    start, stop = self.offsets[term], self.offsets[term + 1]
+                    fractions.append(int(self.alive[self.post_rows[start:stop]].sum()) / n_docs)
+            return fractions
+
+    def search(self, query, top_k):
+        """
+        Returns (hits, confidence): hits are (score, Document) pairs, best first, and
+        confidence is the best score over the highest score the query could reach,
+        or 0 when a query term isn't in the index at all.
+        """
+        with self._lock:
+            term_ids = []
+            missing = False
+            for token in dict.fromkeys(tokenize(query)):
+                term = self.terms.get(token)
+                if term is None or term >= len(self.idf):
+                    missing = True
+                else:
+                    term_ids.append(term)
+            if not term_ids or not len(self):
+                return [], 0.0
+
+            scores = np.zeros(len(self.alive), dtype=np.float32)
+            for term in term_ids:
+                start, stop = self.offsets[term], self.offsets[term + 1]
+                rows, tf = self.post_rows[start:stop], self.post_tf[start:stop]
+                scores[rows] += self.idf[term] * tf * (self.k1 + 1.0) / (tf + self.norms[rows])
+            scores[~self.alive] = 0.0
+
+            top_k = min(top_k, int(np.count_nonzero(scores)))
+            if top_k <= 0:
+                return [], 0.0
+            best = np.argpartition(-scores, top_k - 1)[:top_k]
+            best = best[np.argsort(-scores[best], kind="stable")]
+
+            ceiling = float(self.idf[term_ids].sum()) * (self.k1 + 1.0)
+            confidence = 0.0 if missing or ceiling <= 0 else float(scores[best[0]]) / ceiling
+            hits = [
+                (float(scores[row]), Document(id=self.chunk_ids[row], page_content=self.texts[row],
+                                              metadata=dict(self.metadatas[row])))
+                for row in best
+            ]
+            return hits, confidence
+
+    def save(self):
+        """Writes the committed index, unless nothing changed since it was last saved or loaded."""
+        with self._lock:
+            if not self._dirty:
+                return
+            if self._pending or len(self.alive) != len(self.chunk_ids):
+                self.commit()
+            docs = json.dumps({
+                "terms": sorted(self.terms, key=self.terms.get),
+                "chunk_ids": self.chunk_ids,
+                "texts": self.texts,
+                "metadatas": self.metadatas,
+            }).encode("utf-8")
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, "wb") as f:
+                np.savez(f, docs=np.frombuffer(docs, dtype=np.uint8), doc_len=self.doc_len, alive=self.alive,
+                         t_term=self._t_term, t_row=self._t_row, t_tf=self._t_tf)
+            os.replace(tmp_path, self.path)
+            self._loaded_mtime = os.path.getmtime(self.path)
+            self._dirty = False
+            logger.info(f"Saved lexical index with {len(self)} chunks and {len(self.terms)} terms")
+
+    def load(self, force=False):
+        """
+        (Re)reads the index from disk if the file changed since it was last read.
+        force=True also throws away changes that were never saved.
+        """
+        with self._lock:
+            if not os.path.exists(self.path):
+                if force:
+                    self._reset()
+                    self._dirty = False
+                return self
+            mtime = os.path.getmtime(self.path)
+            if mtime == self._loaded_mtime and not force:
+                return self
+            try:
+                with np.load(self.path) as data:
+                    docs = json.loads(data["docs"].tobytes().decode("utf-8"))
+                    self._reset()
+                    self.doc_len, self.alive = data["doc_len"], data["alive"]
+                    self._t_term, self._t_row, self._t_tf = data["t_term"], data["t_row"], data["t_tf"]
+            except Exception as e:
+                raise CustomException("Failed to read lexical index", e)
+            self.terms = {term: i for i, term in enumerate(docs["terms"])}
+            self.chunk_ids, self.texts, self.metadatas = docs["chunk_ids"], docs["texts"], docs["metadatas"]
+            self._rows = {chunk_id: row for row, chunk_id in enumerate(self.chunk_ids) if self.alive[row]}
+            self._build_postings()
+            self._loaded_mtime = mtime
+            self._dirty = False
+            logger.info(f"Loaded lexical index with {len(self)} chunks")
+            return self
+
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+def get_lexical_index(path=LEXICAL_INDEX_PATH):
+    """The process-wide index for path, refreshed from disk if another process rewrote it."""
+    with _indexes_lock:
+        index = _indexes.get(path)
+        if index is None:
+            index = _indexes[path] = LexicalIndex(path)
+    return index.load()
@@ -1,21 +1,120 @@
-from langchain_groq import ChatGroq
+import time
+
+from langchain_core.callbacks import BaseCallbackHandler
 from app.config.config import *
 
 
 from app.common.logger import get_logger
 from app.common.custom_exception import CustomException
+from app.common.metrics import record
+from app.common.resilience import get_dependency, get_http_client
 
 logger = get_logger(__name__)
 
 
+class LLMTimingHandler(BaseCallbackHandler):
+    """Records each LLM call as the "llm" stage, and streamed calls' time to first token as "llm_first_token"."""
+
+    # Cheap enough to run on the event loop; otherwise async calls hand every event to a thread
+    run_inline = True
+
+    def __init__(self):
+        self._started = {}
+
+    def _start(self, run_id):
+        # [start time, first token seen]
+        self._started[run_id] = [time.perf_counter(), False]
+
+    def on_llm_start(self, serialized, prompts, *, run_id, **kwargs):
+        self._start(run_id)
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, **kwargs):
+        self._start(run_id)
+
+    def on_llm_new_token(self, token, *, run_id, **kwargs):
+        started = self._started.get(run_id)
+        if started and not started[1]:
+            started[1] = True
+            record("llm_first_token", time.perf_counter() - started[0])
+
+    def _finish(self, run_id, failed):
+        started = self._started.pop(run_id, None)
+        if started:
+            record("llm", time.perf_counter() - started[0], failed)
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        self._finish(run_id, False)
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        self._finish(run_id, True)
+
+
+class CircuitBreakerHandler(BaseCallbackHandler):
+    """
+    Puts every LLM call behind the "llm" circuit breaker: while the circuit is open the call
+    fails with CircuitOpenError before a request is sent. A callback, rather than a wrapper,
+    so invoke(), stream() and their async forms are all covered.
+    """
+
+    run_inline = True
+    # Otherwise LangChain logs the CircuitOpenError and makes the call anyway
+    raise_error = True
+
+    def __init__(self, dependency=None):
+        self.dependency = dependency or get_dependency("llm")
+        self._started = {}
+
+    def _start(self, run_id):
+        self.dependency.admit()
+        self._started[run_id] = time.perf_counter()
+
+    def on_llm_start(self, serialized, prompts, *, run_id, **kwargs):
+        self._start(run_id)
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, **kwargs):
+        self._start(run_id)
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        started = self._started.pop(run_id, None)
+        self.dependency.record_success(None if started is None else time.perf_counter() - started)
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        self._started.pop(run_id, None)
+        self.dependency.record_failure(error)
+
+
+def instrument_llm(llm):
+    """
+    Adds the circuit breaker callback to llm and, when metrics are on, the timing callback,
+    so both invoke() and stream() are covered.
+    """
+    handlers = llm.callbacks or []
+    # A callback manager instead of a list is left alone
+    if not isinstance(handlers, list):
+        return llm
+    if not any(isinstance(h, CircuitBreakerHandler) for h in handlers):
+        handlers = [CircuitBreakerHandler(), *handlers]
+    if METRICS_ENABLED and not any(isinstance(h, LLMTimingHandler) for h in handlers):
+        handlers = [*handlers, LLMTimingHandler()]
+    llm.callbacks = handlers
+    return llm
+
+
 def load_llm():
     try:
         logger.info("Loading Groq LLM...")                                         
+        from langchain_groq import ChatGroq
+
         llm = ChatGroq(
-            model="gemma2-9b-it",
+            model=LLM_MODEL_NAME,
             max_tokens=500,
             temperature=0.7,
             api_key=GROQ_API_KEY,
+            # Groq's client retries 429s and 5xx itself, with backoff, within the timeout
+            timeout=LLM_TIMEOUT,
+            max_retries=OUTBOUND_MAX_RETRIES,
+            # One connection pool for every chain the process builds
+            http_client=get_http_client(),
         )
         
         return llm
@@ -0,0 +1,580 @@
+import glob
+import json
+import os
+import threading
+
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.runnables.config import run_in_executor
+from langchain_core.vectorstores import VectorStore
+
+from app.config.config import *
+from app.common.logger import get_logger
+from app.common.metrics import REGISTRY, span
+from app.components.quantization import QUANTIZERS
+from app.common.custom_exception import CustomException
+
+try:
+    import fcntl
+except ImportError:  # not on POSIX, assume a single writer process
+    fcntl = None
+
+logger = get_logger(__name__)
+
+
+def _normalize(matrix):
+    norms = np.linalg.norm(matrix, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+def _kmeans(vectors, n_clusters, iterations=10, seed=0):
+    """Plain spherical k-means on normalized vectors, enough for a coarse IVF partition."""
+    rng = np.random.default_rng(seed)
+    centroids = vectors[rng.choice(len(vectors), n_clusters, replace=False)].copy()
+    for _ in range(iterations):
+        assignments = np.argmax(vectors @ centroids.T, axis=1)
+        for cluster in range(n_clusters):
+            members = vectors[assignments == cluster]
+            if len(members):
+                centroids[cluster] = members.mean(axis=0)
+        centroids = _normalize(centroids)
+    return centroids, np.argmax(vectors @ centroids.T, axis=1)
+
+
+# A generation takes appended rows until it holds this many times the rows it was written
+# with, or until less than 1/_REWRITE_GROWTH of its rows are live; then a commit rewrites it
+_REWRITE_GROWTH = 2
+# Rows the clusters and quantizer of a rewritten generation are trained on
+_TRAIN_SAMPLE_ROWS = 50000
+_WRITE_BLOCK_ROWS = 16384
+
+
+class LocalVectorIndex:
+    """
+    In-process cosine index persisted under DB_FAISS_PATH.
+
+    Rows are L2-normalized float32 vectors in a memory-mapped file, so every worker process
+    maps the same pages instead of loading its own copy. Above LOCAL_INDEX_IVF_MIN_ROWS
+    rows are grouped by k-means cluster and a search only scans the nprobe closest clusters.
+
+    With quantization ("int8" or "pq", see quantization.py) each generation also gets a file
+    of compressed codes. Searches score the codes, which is all they keep in memory, and only
+    the best rerank_factor * top_k rows are re-scored exactly from the float32 file.
+
+    Writes (upsert/delete) are buffered and become visible on commit(). A commit appends to the
+    current generation: new rows go on the end of its vectors and codes files, assigned to the
+    nearest existing cluster, and new records, metadata changes and deletions on the end of its
+    records log; meta.json, swapped atomically, says how much of each file is published, and
+    readers pick up the tail on their next search. Once the generation has doubled, crosses
+    LOCAL_INDEX_IVF_MIN_ROWS or is half deleted, a commit writes a new one instead, with the
+    clusters and quantizer retrained on a sample and the rows streamed to disk in blocks.
+    Exposes the same upsert(vectors=..., namespace=...)/delete(ids=...)/update(id=...,
+    set_metadata=...) calls as a Pinecone index, so the upsert pipeline works unchanged.
+    """
+
+    def __init__(self, path=DB_FAISS_PATH, nprobe=LOCAL_INDEX_NPROBE, ivf_min_rows=LOCAL_INDEX_IVF_MIN_ROWS,
+                 quantization=LOCAL_INDEX_QUANTIZATION, rerank_factor=LOCAL_INDEX_RERANK_FACTOR):
+        self.path = path
+        self.nprobe = nprobe
+        self.ivf_min_rows = ivf_min_rows
+        if quantization not in QUANTIZERS and quantization != "none":
+            logger.warning(f"Unknown LOCAL_INDEX_QUANTIZATION '{quantization}', storing float32 only")
+            quantization = "none"
+        self.quantization = quantization
+        self.rerank_factor = rerank_factor
+
+        self._lock = threading.RLock()
+        self._pending_upserts = {}
+        self._pending_deletes = set()
+        self._pending_metadata = {}
+        self._loaded_meta_mtime = None
+        self._reset()
+
+        os.makedirs(path, exist_ok=True)
+        self._refresh()
+
+    def _reset(self):
+        self.generation = 0
+        self.dim = None
+        self.vectors = None
+        self.ids = []
+        self.metadatas = []
+        self.live = np.zeros(0, dtype=bool)
+        self.centroids = None
+        self.cluster_offsets = None
+        # Rows the generation was written with; the ones after it were appended by commits
+        self.base_count = 0
+        self.assignments = np.zeros(0, dtype=np.int32)
+        self.quantizer = None
+        self.codes = None
+        self._rows = {}
+        self._records_bytes = None
+
+    @property
+    def _meta_path(self):
+        return os.path.join(self.path, "meta.json")
+
+    def _file(self, name, generation):
+        return os.path.join(self.path, f"{name}.{generation}")
+
+    def __len__(self):
+        self._refresh()
+        return len(self._rows)
+
+    def _refresh(self):
+        """Maps whatever a commit, in this or another process, published since the last call."""
+        try:
+            mtime = os.stat(self._meta_path).st_mtime_ns
+        except OSError:
+            return
+        if mtime == self._loaded_meta_mtime:
+            return
+
+        with self._lock:
+            try:
+                with open(self._meta_path, "r", encoding="utf-8") as f:
+                    meta = json.load(f)
+                if (meta["generation"] == self.generation and self.vectors is not None
+                        and self._records_bytes is not None
+                        and meta.get("records_bytes", -1) >= self._records_bytes):
+                    self._load_tail(meta)
+                else:
+                    self._load(meta)
+            except FileNotFoundError:
+                # A writer published a newer generation mid-read; keep the current one and retry next time
+                return
+            self._loaded_meta_mtime = mtime
+
+    def _load(self, meta):
+        generation, count, dim = meta["generation"], meta["count"], meta["dim"]
+        base_count = meta.get("base_count", count)
+        records_bytes = meta.get("records_bytes")
+        if records_bytes is None:
+            # Written before generations took appends; the next commit rewrites it
+            with open(self._file("records", generation) + ".json", "r", encoding="utf-8") as f:
+                entries = [{"row": row, **record} for row, record in enumerate(json.load(f))]
+        else:
+            entries = self._read_records(generation, 0, records_bytes)
+        centroids = offsets = None
+        if meta.get("ivf"):
+            with np.load(self._file("ivf", generation) + ".npz") as ivf:
+                centroids, offsets = ivf["centroids"], ivf["offsets"]
+        quantizer = None
+        if meta.get("quantization") and count:
+            with np.load(self._file("quant", generation) + ".npz") as state:
+                quantizer = QUANTIZERS[meta["quantization"]].from_state(state)
+        vectors, codes, assignments = self._map(generation, count, dim, base_count, quantizer, centroids is not None)
+
+        ids, metadatas, rows, live = [], [], {}, np.ones(count, dtype=bool)
+        self._apply(entries, ids, metadatas, live, rows)
+        self.generation, self.dim, self.base_count = generation, dim, base_count
+        self.ids, self.metadatas, self.live, self._rows = ids, metadatas, live, rows
+        self.vectors, self.assignments = vectors, assignments
+        self.centroids, self.cluster_offsets = centroids, offsets
+        self.quantizer, self.codes = quantizer, codes
+        self._records_bytes = records_bytes
+        logger.info(f"Mapped local vector index generation {generation}: {len(rows)} vectors, dim={dim}")
+
+    def _load_tail(self, meta):
+        """Maps the rows and replays the records that commits appended to the loaded generation."""
+        count = meta["count"]
+        entries = self._read_records(self.generation, self._records_bytes, meta["records_bytes"])
+        vectors, codes, assignments = self._map(self.generation, count, self.dim, self.base_count,
+                                                self.quantizer, self.centroids is not None)
+        live = np.ones(count, dtype=bool)
+        live[:len(self.live)] = self.live
+        # ids and metadatas only grow, and rows are never reused within a generation, so a
+        # search's snapshot of them stays right for the rows it can see
+        self._apply(entries, self.ids, self.metadatas, live, self._rows)
+        self.vectors, self.codes, self.assignments, self.live = vectors, codes, assignments, live
+        self._records_bytes = meta["records_bytes"]
+
+    def _map(self, generation, count, dim, base_count, quantizer, ivf):
+        """(vectors, codes, clusters of the rows appended after base_count), for the first count rows."""
+        if not count:
+            return None, None, np.zeros(0, dtype=np.int32)
+        vectors = np.memmap(self._file("vectors", generation) + ".f32", dtype=np.float32,
+                            mode="r", shape=(count, dim))
+        codes = None
+        if quantizer is not None:
+            codes = np.memmap(self._file("codes", generation) + ".bin", dtype=quantizer.code_dtype,
+                              mode="r", shape=(count, quantizer.code_width(dim)))
+        assignments = np.zeros(0, dtype=np.int32)
+        if ivf and count > base_count:
+            assignments = np.fromfile(self._file("assign", generation) + ".i32", dtype=np.int32,
+                                      count=count - base_count)
+        return vectors, codes, assignments
+
+    def _read_records(self, generation, start, end):
+        with open(self._file("records", generation) + ".jsonl", "rb") as f:
+            f.seek(start)
+            data = f.read(end - start)
+        return [json.loads(line) for line in data.splitlines() if line]
+
+    @staticmethod
+    def _apply(entries, ids, metadatas, live, rows):
+        """Replays records log entries: a new row, a row's new metadata, or a deleted row."""
+        for entry in entries:
+            row = entry["row"]
+            if "id" in entry:
+                ids.append(entry["id"])
+                metadatas.append(entry["metadata"])
+                rows[entry["id"]] = row
+            elif entry.get("deleted"):
+                live[row] = False
+                if rows.get(ids[row]) == row:
+                    del rows[ids[row]]
+            else:
+                metadatas[row] = entry["metadata"]
+
+    def upsert(self, vectors, namespace=None):
+        with self._lock:
+            for record in vectors:
+                self._pending_deletes.discard(record["id"])
+                self._pending_upserts[record["id"]] = (
+                    np.asarray(record["values"], dtype=np.float32), record.get("metadata", {}),
+                )
+        return {"upserted_count": len(vectors)}
+
+    def delete(self, ids, namespace=None):
+        with self._lock:
+            for chunk_id in ids:
+                self._pending_upserts.pop(chunk_id, None)
+                self._pending_metadata.pop(chunk_id, None)
+                self._pending_deletes.add(chunk_id)
+
+    def update(self, id, set_metadata=None, namespace=None):
+        """Merges set_metadata into a vector's metadata on the next commit."""
+        with self._lock:
+            if id in self._pending_upserts:
+                vector, metadata = self._pending_upserts[id]
+                self._pending_upserts[id] = (vector, {**metadata, **(set_metadata or {})})
+            else:
+                self._pending_metadata.setdefault(id, {}).update(set_metadata or {})
+
+    def commit(self):
+        """Applies buffered writes on top of the latest state on disk and publishes them."""
+        with self._lock:
+            if not self._pending_upserts and not self._pending_deletes and not self._pending_metadata:
+                return
+            lock_file = open(os.path.join(self.path, "writer.lock"), "w")
+            try:
+                if fcntl is not None:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX)
+                self._refresh()
+                rewrite = self._needs_rewrite()
+                if rewrite:
+                    self._write_generation()
+                else:
+                    self._append()
+            finally:
+                lock_file.close()
+
+            self._pending_upserts.clear()
+            self._pending_deletes.clear()
+            self._pending_metadata.clear()
+            self._refresh()
+            if rewrite:
+                self._remove_old_generations(self.generation)
+            stats = self.memory_stats()
+            logger.info(f"Committed local vector index generation {self.generation} "
+                        f"({'rewritten' if rewrite else 'appended'}) with {stats['vectors']} vectors, "
+                        f"{stats['bytes_per_vector']} bytes per vector searched ({stats['quantization']})")
+
+    def _needs_rewrite(self):
+        if self.vectors is None or self._records_bytes is None:
+            return True
+        if self._pending_upserts and len(next(iter(self._pending_upserts.values()))[0]) != self.dim:
+            return True
+        if (self.quantizer.kind if self.quantizer is not None else "none") != self.quantization:
+            return True
+        count = len(self.ids) + len(self._pending_upserts)
+        removed = sum(1 for chunk_id in self._pending_deletes.union(self._pending_upserts) if chunk_id in self._rows)
+        live = len(self._rows) - removed + len(self._pending_upserts)
+        return (count > _REWRITE_GROWTH * self.base_count
+                or (self.centroids is None and live >= self.ivf_min_rows)
+                or live * _REWRITE_GROWTH < count)
+
+    def _append(self):
+        """Appends the buffered writes to the current generation."""
+        generation, count, dim = self.generation, len(self.ids), self.dim
+        entries = []
+        for chunk_id in self._pending_deletes.union(self._pending_upserts):
+            if chunk_id in self._rows:
+                entries.append({"row": self._rows[chunk_id], "deleted": True})
+        for chunk_id, metadata in self._pending_metadata.items():
+            row = self._rows.get(chunk_id)
+            if row is not None and chunk_id not in self._pending_deletes and chunk_id not in self._pending_upserts:
+                entries.append({"row": row, "metadata": {**self.metadatas[row], **metadata}})
+
+        added = len(self._pending_upserts)
+        if added:
+            vectors = _normalize(np.stack([vector for vector, _ in self._pending_upserts.values()])).astype(np.float32)
+            self._write_at(self._file("vectors", generation) + ".f32", count * vectors[0].nbytes, vectors)
+            if self.quantizer is not None:
+                codes = self.quantizer.encode(vectors)
+                self._write_at(self._file("codes", generation) + ".bin", count * codes[0].nbytes, codes)
+            if self.centroids is not None:
+                assignments = np.argmax(vectors @ self.centroids.T, axis=1).astype(np.int32)
+                self._write_at(self._file("assign", generation) + ".i32", (count - self.base_count) * 4, assignments)
+            entries += [{"row": count + i, "id": chunk_id, "metadata": metadata}
+                        for i, (chunk_id, (_, metadata)) in enumerate(self._pending_upserts.items())]
+
+        records = "".join(json.dumps(entry) + "\n" for entry in entries).encode("utf-8")
+        records_bytes = self._write_at(self._file("records", generation) + ".jsonl", self._records_bytes, records)
+        self._write_meta(generation, count + added, self.base_count, dim, records_bytes,
+                         self.centroids is not None, self.quantizer)
+
+    @staticmethod
+    def _write_at(path, offset, data):
+        """Writes data at offset, dropping whatever an interrupted commit left past it. Returns the new end."""
+        data = data if isinstance(data, bytes) else data.tobytes()
+        with open(path, "r+b" if os.path.exists(path) else "w+b") as f:
+            f.truncate(offset)
+            f.seek(offset)
+            f.write(data)
+        return offset + len(data)
+
+    def _write_meta(self, generation, count, base_count, dim, records_bytes, ivf, quantizer):
+        tmp_path = f"{self._meta_path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"generation": generation, "count": count, "base_count": base_count, "dim": dim,
+                       "ivf": ivf or None, "quantization": quantizer.kind if quantizer is not None else None,
+                       "records_bytes": records_bytes}, f)
+        os.replace(tmp_path, self._meta_path)
+
+    def _write_generation(self):
+        """
+        Writes a new generation of the live rows and the buffered writes. The clusters and
+        quantizer are trained on a sample, and rows are read, assigned and written in blocks,
+        so the matrix is never held in memory.
+        """
+        keep = np.array(sorted(row for chunk_id, row in self._rows.items()
+                               if chunk_id not in self._pending_deletes and chunk_id not in self._pending_upserts),
+                        dtype=np.int64)
+        ids = [self.ids[row] for row in keep] + list(self._pending_upserts)
+        metadatas = [{**self.metadatas[row], **self._pending_metadata.get(self.ids[row], {})} for row in keep]
+        metadatas += [metadata for _, metadata in self._pending_upserts.values()]
+        added = None
+        if self._pending_upserts:
+            added = _normalize(np.stack([vector for vector, _ in self._pending_upserts.values()])).astype(np.float32)
+        dim = added.shape[1] if added is not None else self.dim
+        total, current = len(ids), self.vectors
+
+        def rows_at(indices):
+            # Kept rows come from the current generation's map, the rest from the buffer
+            block = np.empty((len(indices), dim), dtype=np.float32)
+            kept = indices < len(keep)
+            if kept.any():
+                block[kept] = current[keep[indices[kept]]]
+            if not kept.all():
+                block[~kept] = added[indices[~kept] - len(keep)]
+            return block
+
+        generation = self.generation + 1
+        quantizer = centroids = None
+        order = np.arange(total)
+        if total:
+            rng = np.random.default_rng(0)
+            sample = order if total <= _TRAIN_SAMPLE_ROWS else np.sort(rng.choice(total, _TRAIN_SAMPLE_ROWS, replace=False))
+            training = rows_at(sample)
+            if self.quantization != "none":
+                quantizer = QUANTIZERS[self.quantization].fit(training)
+                logger.info(f"Trained {quantizer.kind} quantizer on {len(training)} vectors")
+            if total >= self.ivf_min_rows:
+                centroids, _ = _kmeans(training, int(np.sqrt(total)))
+                assignments = np.empty(total, dtype=np.int64)
+                for start in range(0, total, _WRITE_BLOCK_ROWS):
+                    block = rows_at(order[start:start + _WRITE_BLOCK_ROWS])
+                    assignments[start:start + len(block)] = np.argmax(block @ centroids.T, axis=1)
+                # Store rows grouped by cluster, so a probe reads contiguous slices of the map
+                order = np.argsort(assignments, kind="stable")
+                offsets = np.searchsorted(assignments[order], np.arange(len(centroids) + 1))
+                np.savez(self._file("ivf", generation) + ".npz", centroids=centroids, offsets=offsets)
+            del training
+
+        vectors_path = self._file("vectors", generation) + ".f32"
+        with open(vectors_path, "wb") as f:
+            for start in range(0, total, _WRITE_BLOCK_ROWS):
+                f.write(rows_at(order[start:start + _WRITE_BLOCK_ROWS]).tobytes())
+        if quantizer is not None:
+            written = np.memmap(vectors_path, dtype=np.float32, mode="r", shape=(total, dim))
+            with open(self._file("codes", generation) + ".bin", "wb") as f:
+                for start in range(0, total, _WRITE_BLOCK_ROWS):
+                    f.write(quantizer.encode(written[start:start + _WRITE_BLOCK_ROWS]).tobytes())
+            del written
+            np.savez(self._file("quant", generation) + ".npz", **quantizer.state())
+        with open(self._file("records", generation) + ".jsonl", "wb") as f:
+            for row, i in enumerate(order):
+                f.write((json.dumps({"row": row, "id": ids[i], "metadata": metadatas[i]}) + "\n").encode("utf-8"))
+            records_bytes = f.tell()
+
+        self._write_meta(generation, total, total, dim, records_bytes, centroids is not None, quantizer)
+
+    def memory_stats(self):
+        """What a search holds per vector: the codes with quantization, else the float32 vector."""
+        with self._lock:
+            dim = self.dim or 0
+            float32_bytes = 4 * dim
+            if self.codes is not None:
+                searched = self.codes.dtype.itemsize * self.codes.shape[1]
+            else:
+                searched = float32_bytes
+            return {
+                "vectors": len(self._rows),
+                "quantization": self.quantizer.kind if self.quantizer is not None else "none",
+                "bytes_per_vector": searched,
+                "float32_bytes_per_vector": float32_bytes,
+                "compression": float32_bytes / searched if searched else 1.0,
+            }
+
+    def _remove_old_generations(self, current):
+        # Processes that still map an old file keep it alive until they remap
+        for path in glob.glob(os.path.join(self.path, "*.*.*")):
+            try:
+                if int(path.rsplit(".", 2)[1]) < current:
+                    os.remove(path)
+            except (ValueError, OSError):
+                pass
+
+    def query(self, vector, top_k=RETRIEVER_K):
+        """Returns [(score, id, metadata)] for the top_k live rows by cosine similarity."""
+        self._refresh()
+        # One generation's rows and records together: a refresh after a rewrite swaps in new
+        # ones, whose row numbers mean other chunks
+        with self._lock:
+            vectors, centroids, offsets = self.vectors, self.centroids, self.cluster_offsets
+            base_count, assignments, live = self.base_count, self.assignments, self.live
+            quantizer, codes = self.quantizer, self.codes
+            ids, metadatas = self.ids, self.metadatas
+        if vectors is None or not len(vectors):
+            return []
+
+        query = _normalize(np.asarray(vector, dtype=np.float32))
+        rows = None
+        if centroids is not None:
+            probes = np.argsort(centroids @ query)[::-1][:self.nprobe]
+            parts = [np.arange(offsets[c], offsets[c + 1]) for c in probes]
+            # Rows appended since the clusters were trained, by the cluster each was assigned to
+            parts.append(base_count + np.flatnonzero(np.isin(assignments, probes)))
+            rows = np.concatenate(parts)
+        alive = live if rows is None else live[rows]
+        if quantizer is not None:
+            approximate = quantizer.scores(query, codes if rows is None else codes[rows])
+            approximate[~alive] = -np.inf
+            candidates = min(int(alive.sum()), max(top_k, top_k * self.rerank_factor))
+            if candidates == 0:
+                return []
+            best = np.argpartition(-approximate, candidates - 1)[:candidates]
+            # Sorted, so the exact re-rank reads the float32 file front to back
+            rows = np.sort(best if rows is None else rows[best])
+            alive = live[rows]
+        scores = np.asarray(vectors[rows] @ query if rows is not None else vectors @ query)
+        scores[~alive] = -np.inf
+
+        top_k = min(top_k, int(alive.sum()))
+        if top_k == 0:
+            return []
+        best = np.argpartition(-scores, top_k - 1)[:top_k]
+        best = best[np.argsort(-scores[best])]
+        found = [(float(scores[i]), int(rows[i]) if rows is not None else int(i)) for i in best]
+        return [(score, ids[row], metadatas[row]) for score, row in found]
+
+
+class LocalVectorStore(VectorStore):
+    """LangChain wrapper so the local index plugs into RetrievalQA like the Pinecone store."""
+
+    def __init__(self, index, embedding, text_key="text"):
+        self.index = index
+        self._embedding = embedding
+        self.text_key = text_key
+
+    @property
+    def embeddings(self):
+        return self._embedding
+
+    def add_texts(self, texts, metadatas=None, ids=None, **kwargs):
+        texts = list(texts)
+        metadatas = metadatas or [{} for _ in texts]
+        if ids is None:
+            raise CustomException("LocalVectorStore needs explicit ids")
+        vectors = self._embedding.embed_documents(texts)
+        self.index.upsert(vectors=[
+            {"id": chunk_id, "values": vector, "metadata": {**metadata, self.text_key: text}}
+            for chunk_id, vector, metadata, text in zip(ids, vectors, metadatas, texts)
+        ])
+        self.index.commit()
+        return ids
+
+    def delete(self, ids=None, **kwargs):
+        self.index.delete(ids=ids or [])
+        self.index.commit()
+        return True
+
+    def similarity_search_by_vector_with_score(self, embedding, k=RETRIEVER_K):
+        with span("vector_search"):
+            matches = self.index.query(embedding, top_k=k)
+        results = []
+        for score, chunk_id, metadata in matches:
+            metadata = dict(metadata)
+            text = metadata.pop(self.text_key, "")
+            results.append((Document(id=chunk_id, page_content=text, metadata=metadata), score))
+        return results
+
+    def similarity_search_by_vector(self, embedding, k=RETRIEVER_K, **kwargs):
+        return [doc for doc, _ in self.similarity_search_by_vector_with_score(embedding, k=k)]
+
+    def similarity_search_with_score(self, query, k=RETRIEVER_K, **kwargs):
+        with span("embed_query"):
+            embedding = self._embedding.embed_query(query)
+        return self.similarity_search_by_vector_with_score(embedding, k=k)
+
+    def similarity_search(self, query, k=RETRIEVER_K, **kwargs):
+        return [doc for doc, _ in self.similarity_search_with_score(query, k=k)]
+
+    # Async callers await the embedding API; only the in-memory search runs on a worker thread
+
+    async def asimilarity_search_by_vector(self, embedding, k=RETRIEVER_K, **kwargs):
+        return await run_in_executor(None, self.similarity_search_by_vector, embedding, k)
+
+    async def asimilarity_search_with_score(self, query, k=RETRIEVER_K, **kwargs):
+        with span("embed_query"):
+            embedding = await self._embedding.aembed_query(query)
+        return await run_in_executor(None, self.similarity_search_by_vector_with_score, embedding, k)
+
+    async def asimilarity_search(self, query, k=RETRIEVER_K, **kwargs):
+        return [doc for doc, _ in await self.asimilarity_search_with_score(query, k=k)]
+
+    def _select_relevance_score_fn(self):
+        # Scores are cosine similarities in [-1, 1]
+        return lambda score: (score + 1) / 2
+
+    @classmethod
+    def from_texts(cls, texts, embedding, metadatas=None, ids=None, **kwargs):
+        store = cls(get_local_index(), embedding)
+        store.add_texts(texts, metadatas=metadatas, ids=ids)
+        return store
+
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+def get_local_index(path=DB_FAISS_PATH):
+    """One LocalVectorIndex per path and process."""
+    with _indexes_lock:
+        index = _indexes.get(path)
+        if index is None:
+            index = LocalVectorIndex(path)
+            _indexes[path] = index
+            # One local index per collection, labelled by its path
+            REGISTRY.register_callback("rag_local_index_bytes_per_vector", "Bytes per vector a local index search scans",
+                                       fn=_bytes_per_vector, labelname="path")
+        return index
+
+
+def _bytes_per_vector():
+    with _indexes_lock:
+        indexes = dict(_indexes)
+    return {path: index.memory_stats()["bytes_per_vector"] for path, index in indexes.items()}
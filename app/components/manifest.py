@@ -0,0 +1,97 @@
+import hashlib
+import json
+import os
+from datetime import datetime, timezone
+
+from app.config.config import *
+from app.common.logger import get_logger
+from app.common.custom_exception import CustomException
+
+logger = get_logger(__name__)
+
+MANIFEST_VERSION = 1
+
+
+def file_sha256(path, block_size=1 << 20):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def chunk_id_prefix(filename, file_hash):
+    return hashlib.sha1(f"{filename}:{file_hash}".encode("utf-8")).hexdigest()[:16]
+
+
+def make_chunk_ids(filename, file_hash, count):
+    """Deterministic vector IDs, so a file's vectors can be found and deleted later."""
+    prefix = chunk_id_prefix(filename, file_hash)
+    return [f"{prefix}-{i}" for i in range(count)]
+
+
+def load_manifest(path=INGESTION_MANIFEST_PATH):
+    """Reads the ingestion manifest: {"files": {filename: {sha256, chunk_ids, embedding_model, ...}}}."""
+    if not os.path.exists(path):
+        return {"version": MANIFEST_VERSION, "files": {}}
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+        manifest.setdefault("files", {})
+        return manifest
+    except Exception as e:
+        raise CustomException("Failed to read ingestion manifest", e)
+
+
+def save_manifest(manifest, path=INGESTION_MANIFEST_PATH):
+    """Writes the manifest atomically so a crash never leaves it half written."""
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    manifest["version"] = MANIFEST_VERSION
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+def manifest_mtime(path=INGESTION_MANIFEST_PATH):
+    try:
+        return os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+
+
+def list_pdf_files(data_path=DATA_PATH):
+    if not os.path.exists(data_path):
+        return []
+    return sorted(name for name in os.listdir(data_path) if name.lower().endswith(".pdf"))
+
+
+def plan_ingestion(manifest, data_path=DATA_PATH):
+    """
+    Compares the files on disk with the manifest.
+    Returns (changed, removed): changed is a list of (filename, path, sha256) for new or
+    modified files, removed is a list of filenames that are in the manifest but gone from disk.
+    """
+    entries = manifest["files"]
+    on_disk = list_pdf_files(data_path)
+
+    changed = []
+    for filename in on_disk:
+        path = os.path.join(data_path, filename)
+        file_hash = file_sha256(path)
+        entry = entries.get(filename)
+        if entry and entry.get("sha256") == file_hash and entry.get("embedding_model") == EMBEDDING_MODEL_NAME:
+            continue
+        changed.append((filename, path, file_hash))
+
+    removed = sorted(set(entries) - set(on_disk))
+    return changed, removed
+
+
+def record_file(manifest, filename, file_hash, chunk_ids):
+    manifest["files"][filename] = {
+        "sha256": file_hash,
+        "chunk_ids": chunk_ids,
+        "embedding_model": EMBEDDING_MODEL_NAME,
+        "ingested_at": datetime.now(timezone.utc).isoformat(),
+    }
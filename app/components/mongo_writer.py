@@ -0,0 +1,218 @@
+import atexit
+import queue
+import threading
+import time
+
+from app.config.config import *
+from app.common.logger import get_logger
+from app.common.metrics import REGISTRY, span
+
+logger = get_logger(__name__)
+
+
+def _default_collection():
+    from app.configuration.mongo_db_connection import MongoDBClient
+    from app.common.resilience import GuardedClient, get_dependency
+
+    # Tried once under the circuit breaker; the writer does its own retries
+    return GuardedClient(MongoDBClient().database[COLLECTION_NAME], get_dependency("mongo"), {"insert_many": False})
+
+
+_DUPLICATE_KEY = 11000
+
+
+def _unwritten(batch, error):
+    """
+    The documents of batch an unordered insert_many() failed to write, from the write errors
+    of its BulkWriteError; None for any other error, after which none may have been written.
+    A duplicate key means the document is already in, e.g. from an attempt whose reply was lost.
+    """
+    details = getattr(error, "details", None)
+    if not isinstance(details, dict) or "writeErrors" not in details:
+        return None
+    return [batch[write_error["index"]] for write_error in details["writeErrors"]
+            if write_error.get("code") != _DUPLICATE_KEY]
+
+
+class BackgroundMongoWriter:
+    """
+    Takes documents off the request path: submit() only enqueues, and a daemon thread
+    writes them with insert_many once batch_size documents are waiting or flush_interval
+    seconds have passed.
+
+    The queue is bounded. When Mongo is slow or down and it fills up, drop_policy decides:
+    "drop_newest" rejects the new document, "drop_oldest" discards the oldest queued one,
+    "block" waits up to block_timeout for room and then drops the new one. A failing batch
+    is retried with backoff up to max_retries times before it is dropped; after a bulk write
+    error only the documents that weren't written are retried.
+
+    collection_factory returns something with insert_many(), e.g. a mongomock collection.
+    """
+
+    def __init__(self, collection_factory=None, max_queue=MONGO_WRITER_QUEUE_SIZE,
+                 batch_size=MONGO_WRITER_BATCH_SIZE, flush_interval=MONGO_WRITER_FLUSH_INTERVAL,
+                 drop_policy=MONGO_WRITER_DROP_POLICY, block_timeout=MONGO_WRITER_BLOCK_TIMEOUT,
+                 max_retries=MONGO_WRITER_MAX_RETRIES, max_backoff=MONGO_WRITER_MAX_BACKOFF):
+        self.collection_factory = collection_factory or _default_collection
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.drop_policy = drop_policy
+        self.block_timeout = block_timeout
+        self.max_retries = max_retries
+        self.max_backoff = max_backoff
+
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._collection = None
+        self._stop = threading.Event()
+        # Documents accepted but not yet written or dropped; flush() waits for zero
+        self._pending = 0
+        self._pending_changed = threading.Condition()
+        self._stats_lock = threading.Lock()
+        self.enqueued = 0
+        self.written = 0
+        self.dropped = 0
+        self.failed_batches = 0
+
+        self._thread = threading.Thread(target=self._run, name="mongo-writer", daemon=True)
+        self._thread.start()
+
+    def _count(self, field, amount=1):
+        with self._stats_lock:
+            setattr(self, field, getattr(self, field) + amount)
+
+    def _settle(self, amount):
+        with self._pending_changed:
+            self._pending -= amount
+            self._pending_changed.notify_all()
+
+    def submit(self, document):
+        """Queues a document for writing. Returns False if it was dropped."""
+        if self._stop.is_set():
+            self._count("dropped")
+            return False
+        with self._pending_changed:
+            self._pending += 1
+        try:
+            if self.drop_policy == "block":
+                self._queue.put(document, timeout=self.block_timeout)
+            else:
+                self._queue.put_nowait(document)
+        except queue.Full:
+            if self.drop_policy != "drop_oldest":
+                self._count("dropped")
+                self._settle(1)
+                logger.warning("Mongo writer queue is full, dropping the new document")
+                return False
+            try:
+                self._queue.get_nowait()
+                self._count("dropped")
+                self._settle(1)
+            except queue.Empty:
+                pass
+            try:
+                self._queue.put_nowait(document)
+            except queue.Full:
+                self._count("dropped")
+                self._settle(1)
+                return False
+        self._count("enqueued")
+        return True
+
+    def _next_batch(self):
+        try:
+            batch = [self._queue.get(timeout=self.flush_interval)]
+        except queue.Empty:
+            return []
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or self._stop.is_set():
+                # On shutdown take what is already queued without waiting for more
+                remaining = 0
+            try:
+                batch.append(self._queue.get(timeout=remaining) if remaining else self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _write(self, batch):
+        for attempt in range(self.max_retries + 1):
+            try:
+                if self._collection is None:
+                    self._collection = self.collection_factory()
+                with span("mongo_insert_many"):
+                    self._collection.insert_many(batch, ordered=False)
+                self._count("written", len(batch))
+                self._settle(len(batch))
+                return
+            except Exception as e:
+                unwritten = _unwritten(batch, e)
+                if unwritten is None:
+                    # A fresh client next time, in case the connection itself is broken
+                    self._collection = None
+                else:
+                    self._count("written", len(batch) - len(unwritten))
+                    self._settle(len(batch) - len(unwritten))
+                    batch = unwritten
+                    if not batch:
+                        return
+                if attempt == self.max_retries or (self._stop.is_set() and attempt):
+                    break
+                delay = min(self.max_backoff, 0.5 * (2 ** attempt))
+                logger.warning(f"Mongo insert_many of {len(batch)} documents failed ({e}), retrying in {delay:.1f}s")
+                self._stop.wait(delay)
+        self._count("failed_batches")
+        self._count("dropped", len(batch))
+        self._settle(len(batch))
+        logger.error(f"Dropped a batch of {len(batch)} documents after {self.max_retries} retries")
+
+    def _run(self):
+        while not (self._stop.is_set() and self._queue.empty()):
+            batch = self._next_batch()
+            if batch:
+                self._write(batch)
+
+    def flush(self, timeout=None):
+        """Blocks until everything queued so far has been written (or dropped)."""
+        with self._pending_changed:
+            return self._pending_changed.wait_for(lambda: self._pending <= 0, timeout)
+
+    def close(self, timeout=10.0):
+        """Writes what is still queued and stops the writer thread."""
+        self._stop.set()
+        self._thread.join(timeout)
+        if self._thread.is_alive():
+            logger.warning(f"Mongo writer did not finish within {timeout}s, {self._queue.qsize()} documents unwritten")
+
+    def stats(self):
+        with self._stats_lock:
+            return {
+                "enqueued": self.enqueued,
+                "written": self.written,
+                "dropped": self.dropped,
+                "failed_batches": self.failed_batches,
+                "queue_depth": self._queue.qsize(),
+            }
+
+
+def _register_metrics(writer):
+    REGISTRY.register_callback(
+        "rag_mongo_writer_documents_total", "Retrieval-source documents by outcome", kind="counter", labelname="outcome",
+        fn=lambda: {key: value for key, value in writer.stats().items() if key in ("enqueued", "written", "dropped")})
+    REGISTRY.register_callback(
+        "rag_mongo_writer_queue_depth", "Documents waiting to be written to Mongo",
+        fn=lambda: writer.stats()["queue_depth"])
+
+
+_writer = None
+_writer_lock = threading.Lock()
+
+
+def get_mongo_writer():
+    global _writer
+    with _writer_lock:
+        if _writer is None:
+            _writer = BackgroundMongoWriter()
+            atexit.register(_writer.close)
+            _register_metrics(_writer)
+        return _writer
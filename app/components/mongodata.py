@@ -1,7 +1,6 @@
 import os
 import sys
-import pymongo # Make sure pymongo is imported
-from app.configuration.mongo_db_connection import MongoDBClient
+from app.components.mongo_writer import get_mongo_writer
 from app.config.config import DATABASE_NAME, COLLECTION_NAME
 from app.common.custom_exception import CustomException
 from app.common.logger import get_logger
@@ -10,12 +9,13 @@ logger = get_logger(__name__)
 
 def insert_document(document):
     try:
+        from app.configuration.mongo_db_connection import MongoDBClient
         client_instance = MongoDBClient() 
         if client_instance.client:  
             
             collection = client_instance.database[COLLECTION_NAME]
             
-            logger.info(f"Inserted document is: {document}")
+            logger.debug(f"Inserted document is: {document}")
             result = collection.insert_one(document)
             inserted_id = result.inserted_id
             
@@ -28,6 +28,14 @@ def insert_document(document):
         logger.error(f"Error inserting document: {e}", exc_info=True)
         raise CustomException(e, sys)
 
+def log_retrieval_source(document):
+    """
+    Hands the document to the background writer and returns at once, so the chat
+    request never waits on MongoDB. Returns False if the writer's queue dropped it.
+    """
+    logger.debug(f"Queued retrieval source: {document}")
+    return get_mongo_writer().submit(document)
+
 if __name__ == "__main__":
     document_to_insert = {
         'author': 'Nishant Borkar',
@@ -1,6 +1,18 @@
 import os
-from langchain_community.document_loaders import DirectoryLoader, PyPDFLoader
-from langchain.text_splitter import RecursiveCharacterTextSplitter
+import time
+import itertools
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from pypdf import PdfReader
+from langchain_community.document_loaders import PyPDFLoader
+from langchain_core.documents import Document
+
+from app.components.chunker import PageChunker
+from app.components.dedup_index import deduplicate_chunks
+from app.components.manifest import list_pdf_files
+from app.components.pdf_parse_worker import extract_page_range, purge_metadata
 
 from app.common.logger import get_logger
 from app.common.custom_exception import CustomException
@@ -9,16 +21,137 @@ from app.config.config import *
 
 logger = get_logger(__name__)
 
-def load_pdf_files():
+def _load_sequential(file_paths, progress=None):
+    documents, parse_times = [], {}
+    for path in file_paths:
+        began = time.perf_counter()
+        documents.extend(PyPDFLoader(path).load())
+        parse_times[path] = time.perf_counter() - began
+        if progress:
+            progress("files_parsed", 1)
+    return documents, parse_times
+
+
+def _file_metadata(path, reader):
+    # Same document-level metadata PyPDFLoader attaches to every page
+    return purge_metadata(
+        {"producer": "PyPDF", "creator": "PyPDF", "creationdate": ""}
+        | dict(reader.metadata or {})
+        | {"source": path, "total_pages": len(reader.pages)}
+    )
+
+
+def _load_parallel(file_paths, workers, progress=None):
+    """
+    Spreads files, and page ranges of large files, over a process pool.
+    Results are collected in task order, so the output matches the sequential loader.
+    """
+    files, tasks = [], []
+    for file_index, path in enumerate(file_paths):
+        reader = PdfReader(path)
+        total_pages = len(reader.pages)
+        files.append((path, _file_metadata(path, reader), list(reader.page_labels)))
+        for start in range(0, total_pages, PDF_PAGES_PER_TASK):
+            tasks.append((file_index, start, min(start + PDF_PAGES_PER_TASK, total_pages)))
+
+    if progress:
+        # Files without pages have no tasks, count them right away
+        progress("files_parsed", sum(1 for _, _, page_labels in files if not page_labels))
+    if not tasks:
+        return [], {path: 0.0 for path in file_paths}
+
+    # spawn, not fork: the web app is multi-threaded and forking it is unsafe
+    context = multiprocessing.get_context("spawn")
+    documents, parse_times = [], {path: 0.0 for path in file_paths}
+    with ProcessPoolExecutor(max_workers=min(workers, len(tasks)), mp_context=context) as executor:
+        results = executor.map(
+            extract_page_range,
+            [files[file_index][0] for file_index, _, _ in tasks],
+            [start for _, start, _ in tasks],
+            [stop for _, _, stop in tasks],
+        )
+        for (file_index, start, stop), (texts, elapsed) in zip(tasks, results):
+            path, file_metadata, page_labels = files[file_index]
+            parse_times[path] += elapsed
+            for offset, text in enumerate(texts):
+                page_number = start + offset
+                documents.append(Document(
+                    page_content=text,
+                    metadata=file_metadata | {"page": page_number, "page_label": page_labels[page_number]},
+                ))
+            if progress and stop == len(page_labels):
+                progress("files_parsed", 1)
+
+    return documents, parse_times
+
+
+def iter_pdf_pages(path, start_page=0, executor=None, max_in_flight=None):
+    """
+    Yields the pages of one PDF as Documents, from start_page on, with the same text and
+    metadata as load_pdf_files(). Only a bounded number of pages is held at a time: with an
+    executor, at most max_in_flight page ranges are being parsed ahead of the consumer.
+    """
+    reader = PdfReader(path)
+    total_pages = len(reader.pages)
+    file_metadata = _file_metadata(path, reader)
+    page_labels = list(reader.page_labels)
+
+    def make_page(page_number, text):
+        return Document(page_content=text, metadata=file_metadata | {"page": page_number, "page_label": page_labels[page_number]})
+
+    if executor is None:
+        for page_number in range(start_page, total_pages):
+            yield make_page(page_number, reader.pages[page_number].extract_text(extraction_mode="plain").strip())
+        return
+
+    ranges = iter([(start, min(start + PDF_PAGES_PER_TASK, total_pages))
+                   for start in range(start_page, total_pages, PDF_PAGES_PER_TASK)])
+    in_flight = deque()
+    for start, stop in itertools.islice(ranges, max_in_flight or 2):
+        in_flight.append((start, executor.submit(extract_page_range, path, start, stop)))
+    while in_flight:
+        start, future = in_flight.popleft()
+        texts, _ = future.result()
+        for next_start, next_stop in itertools.islice(ranges, 1):
+            in_flight.append((next_start, executor.submit(extract_page_range, path, next_start, next_stop)))
+        for offset, text in enumerate(texts):
+            yield make_page(start + offset, text)
+
+
+def parse_pool(workers=None):
+    """A process pool for iter_pdf_pages(), or None when parsing runs in-process."""
+    workers = PDF_PARSE_WORKERS if workers is None else workers
+    if workers <= 1:
+        return None
+    # spawn, not fork: the web app is multi-threaded and forking it is unsafe
+    return ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+
+
+def load_pdf_files(file_paths=None, workers=None, progress=None):
+    """
+    Loads every PDF in DATA_PATH, or only the given files when file_paths is passed.
+    With more than one worker the pages are parsed in a process pool (PDF_PARSE_WORKERS).
+    progress(field, amount), if given, is called with "files_parsed" as files finish.
+    """
     try:
         if not os.path.exists(DATA_PATH):
             raise CustomException("Data path doesnt exist")
         
-        logger.info(f"Loading files from {DATA_PATH}")
+        if file_paths is None:
+            file_paths = [os.path.join(DATA_PATH, filename) for filename in list_pdf_files(DATA_PATH)]
+        workers = PDF_PARSE_WORKERS if workers is None else workers
         
-        loader = DirectoryLoader(DATA_PATH, glob="*.pdf", loader_cls=PyPDFLoader)
+        logger.info(f"Loading {len(file_paths)} files from {DATA_PATH} with {workers} parse workers")
         
-        documents = loader.load()
+        began = time.perf_counter()
+        if workers > 1:
+            documents, parse_times = _load_parallel(file_paths, workers, progress)
+        else:
+            documents, parse_times = _load_sequential(file_paths, progress)
+        
+        for path, seconds in parse_times.items():
+            logger.info(f"Parsed {path} in {seconds:.2f}s")
+        logger.info(f"Parsed {len(file_paths)} files in {time.perf_counter() - began:.2f}s")
         
         if not documents:
             logger.warning("No documents found in the specified directory.")
@@ -31,17 +164,22 @@ def load_pdf_files():
         logger.error(str(error_message))
          
 
+def text_splitter():
+    return PageChunker(chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP, unit=CHUNK_UNIT, across_pages=CHUNK_ACROSS_PAGES)
+
+
 def create_text_chunks(documents):
     try:
         if not documents:
             raise CustomException("No documents were found")
         logger.info(f"Splitting {len(documents)} documenst into chunks")
         
-        text_splitter = RecursiveCharacterTextSplitter(chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP) 
-        
-        text_chunks = text_splitter.split_documents(documents)   
+        text_chunks = text_splitter().split_documents(documents)   
         
         logger.info(f"Generated {len(text_chunks)} text chunks")
+
+        if DEDUP_ENABLED:
+            text_chunks, _ = deduplicate_chunks(text_chunks)
         
         return text_chunks
 
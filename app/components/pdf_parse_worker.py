@@ -0,0 +1,48 @@
+import time
+from datetime import datetime
+
+from pypdf import PdfReader
+
+# Runs inside the parsing process pool. Kept free of langchain/app imports so that
+# spawned workers start quickly; the parent turns the results into Documents.
+
+
+# Keys PyPDFLoader also reports under the names other PDF parsers use
+_METADATA_ALIASES = {"page_count": "total_pages", "file_path": "source"}
+
+
+def purge_metadata(metadata):
+    """
+    Normalizes PDF document info the way PyPDFLoader does: keys lowercased without their
+    leading "/", dates as ISO 8601, other values as stripped strings or ints. Copied from
+    langchain_community's private _purge_metadata, so a langchain upgrade can't change it.
+    """
+    purged = {}
+    for key, value in metadata.items():
+        if type(value) not in (str, int):
+            value = str(value)
+        key = key[1:].lower() if key.startswith("/") else key.lower()
+        if key in ("creationdate", "moddate"):
+            try:
+                purged[key] = datetime.strptime(value.replace("'", ""), "D:%Y%m%d%H%M%S%z").isoformat("T")
+            except ValueError:
+                purged[key] = value
+        elif key in _METADATA_ALIASES:
+            purged[_METADATA_ALIASES[key]] = value
+            purged[key] = value
+        elif isinstance(value, str):
+            purged[key] = value.strip()
+        elif isinstance(value, int):
+            purged[key] = value
+    return purged
+
+
+def extract_page_range(path, start, stop):
+    """Extracts the text of pages [start, stop) of one PDF. Returns (texts, elapsed_seconds)."""
+    began = time.perf_counter()
+    reader = PdfReader(path)
+    texts = [
+        reader.pages[page_number].extract_text(extraction_mode="plain").strip()
+        for page_number in range(start, stop)
+    ]
+    return texts, time.perf_counter() - began
@@ -0,0 +1,56 @@
+# Imported by vector_store only when the Pinecone backend is used
+import asyncio
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from langchain_pinecone import Pinecone as LangchainPinecone
+
+from app.config.config import PINECONE_QUERY_THREADS
+from app.common.metrics import span
+from app.common.resilience import get_dependency
+
+_query_pool = None
+_query_pool_lock = threading.Lock()
+
+
+def _get_query_pool():
+    """Threads for the async app's Pinecone queries, kept apart from the event loop's default executor."""
+    global _query_pool
+    if _query_pool is None:
+        with _query_pool_lock:
+            if _query_pool is None:
+                _query_pool = ThreadPoolExecutor(max_workers=PINECONE_QUERY_THREADS, thread_name_prefix="pinecone-query")
+    return _query_pool
+
+
+class TimedPinecone(LangchainPinecone):
+    """
+    The LangChain Pinecone store with the query embedding and the index query timed separately.
+    Index queries go through the "pinecone" dependency (deadline, retries, circuit breaker,
+    hedging) on the shared, pooled index. Async queries run the sync client on a pool of
+    PINECONE_QUERY_THREADS threads of their own.
+    """
+
+    def similarity_search_with_score(self, query, k=4, filter=None, namespace=None, **kwargs):
+        with span("embed_query"):
+            embedding = self._embedding.embed_query(query)
+        return self.similarity_search_by_vector_with_score(embedding, k=k, filter=filter, namespace=namespace, **kwargs)
+
+    def similarity_search_by_vector_with_score(self, embedding, **kwargs):
+        search = super().similarity_search_by_vector_with_score
+        with span("vector_search"):
+            return get_dependency("pinecone").call(lambda: search(embedding, **kwargs), idempotent=True)
+
+    async def asimilarity_search_with_score(self, query, k=4, filter=None, namespace=None, **kwargs):
+        with span("embed_query"):
+            embedding = await self._embedding.aembed_query(query)
+        return await self.asimilarity_search_by_vector_with_score(embedding, k=k, filter=filter, namespace=namespace, **kwargs)
+
+    async def asimilarity_search_by_vector_with_score(self, embedding, **kwargs):
+        # The sync query on the query pool: LangChain's async path opens a new HTTP session per
+        # query, and the default executor is shared with everything else the app runs off the loop
+        search = functools.partial(super().similarity_search_by_vector_with_score, embedding, **kwargs)
+        with span("vector_search"):
+            return await get_dependency("pinecone").acall(
+                lambda: asyncio.get_running_loop().run_in_executor(_get_query_pool(), search), idempotent=True)
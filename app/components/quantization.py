@@ -0,0 +1,159 @@
+import numpy as np
+
+from app.config.config import *
+from app.common.logger import get_logger
+
+logger = get_logger(__name__)
+
+# Rows assigned to centroids per step, and rows scored per step: small enough that the decoded
+# block stays in cache, which makes int8 scoring as fast as a float32 matrix product
+_BLOCK_ROWS = 16384
+_SCORE_BLOCK_ROWS = 1024
+
+
+def _kmeans_l2(vectors, n_clusters, iterations=10, seed=0):
+    """Plain Euclidean k-means, for PQ codebooks. Returns the (n_clusters, dim) centroids."""
+    rng = np.random.default_rng(seed)
+    centroids = vectors[rng.choice(len(vectors), n_clusters, replace=False)].copy()
+    for _ in range(iterations):
+        assignments = _nearest(vectors, centroids)
+        sums = np.stack([np.bincount(assignments, weights=column, minlength=n_clusters) for column in vectors.T], axis=1)
+        counts = np.bincount(assignments, minlength=n_clusters)
+        filled = counts > 0
+        centroids[filled] = sums[filled] / counts[filled, None]
+    return centroids
+
+
+def _nearest(vectors, centroids):
+    """Index of the closest centroid for every row, by squared L2 distance."""
+    # |x - c|^2 = |x|^2 - 2 x.c + |c|^2, and |x|^2 doesn't change the argmin
+    half_norms = 0.5 * (centroids ** 2).sum(axis=1)
+    assignments = np.empty(len(vectors), dtype=np.int64)
+    for start in range(0, len(vectors), _BLOCK_ROWS):
+        block = vectors[start:start + _BLOCK_ROWS]
+        assignments[start:start + len(block)] = np.argmax(block @ centroids.T - half_norms, axis=1)
+    return assignments
+
+
+class ScalarQuantizer:
+    """
+    Per-dimension int8 quantization: each dimension is scaled by its largest absolute value
+    to [-127, 127]. One byte per dimension, a quarter of float32. The scale folds into the
+    query, so scoring is a plain matrix product over the codes.
+    """
+
+    kind = "int8"
+    code_dtype = np.int8
+
+    def __init__(self, scale, trained_rows=0):
+        self.scale = np.asarray(scale, dtype=np.float32)
+        self.trained_rows = int(trained_rows)
+
+    @classmethod
+    def fit(cls, vectors):
+        scale = np.abs(vectors).max(axis=0) / 127.0 if len(vectors) else np.ones(vectors.shape[1])
+        return cls(np.where(scale == 0, 1.0, scale), len(vectors))
+
+    def code_width(self, dim):
+        return dim
+
+    def encode(self, vectors):
+        return np.clip(np.rint(vectors / self.scale), -127, 127).astype(np.int8)
+
+    def scores(self, query, codes):
+        """Approximate query . vector for every row of codes."""
+        folded = query * self.scale
+        scores = np.empty(len(codes), dtype=np.float32)
+        for start in range(0, len(codes), _SCORE_BLOCK_ROWS):
+            block = codes[start:start + _SCORE_BLOCK_ROWS]
+            scores[start:start + len(block)] = block.astype(np.float32) @ folded
+        return scores
+
+    def state(self):
+        return {"scale": self.scale, "trained_rows": np.int64(self.trained_rows)}
+
+    @classmethod
+    def from_state(cls, state):
+        return cls(state["scale"], int(state["trained_rows"]))
+
+
+class ProductQuantizer:
+    """
+    Product quantization: vectors are cut into subvectors of sub_dim dimensions, each replaced
+    by the index of its nearest centroid in a 256-entry codebook learned for that subspace.
+    One byte per subvector. Scoring looks the query's dot product with every centroid up in a
+    (subvectors, 256) table and sums the entries the codes point to.
+    """
+
+    kind = "pq"
+    code_dtype = np.uint8
+
+    def __init__(self, codebooks, dim, trained_rows=0):
+        # (subvectors, centroids, sub_dim)
+        self.codebooks = np.asarray(codebooks, dtype=np.float32)
+        self.dim = int(dim)
+        self.trained_rows = int(trained_rows)
+
+    @property
+    def sub_dim(self):
+        return self.codebooks.shape[2]
+
+    @classmethod
+    def fit(cls, vectors, sub_dim=LOCAL_INDEX_PQ_SUBVECTOR_DIM, sample=LOCAL_INDEX_PQ_TRAIN_ROWS, seed=0):
+        dim = vectors.shape[1]
+        rng = np.random.default_rng(seed)
+        rows = vectors if len(vectors) <= sample else vectors[np.sort(rng.choice(len(vectors), sample, replace=False))]
+        # (subvectors, n, sub_dim), each subspace contiguous
+        subspaces = np.ascontiguousarray(cls._split(np.asarray(rows, dtype=np.float32), sub_dim).transpose(1, 0, 2))
+        n_clusters = min(256, len(rows))
+        codebooks = np.stack([_kmeans_l2(subspace, n_clusters, seed=seed + m) for m, subspace in enumerate(subspaces)])
+        if n_clusters < 256:
+            # Unused codes, so every codebook has 256 entries
+            codebooks = np.concatenate([codebooks, np.zeros((len(codebooks), 256 - n_clusters, sub_dim), dtype=np.float32)], axis=1)
+        return cls(codebooks, dim, len(vectors))
+
+    @staticmethod
+    def _split(vectors, sub_dim):
+        """(n, subvectors, sub_dim), zero-padding the last subvector if dim isn't a multiple of sub_dim."""
+        n, dim = vectors.shape
+        subvectors = -(-dim // sub_dim)
+        if subvectors * sub_dim != dim:
+            vectors = np.concatenate([vectors, np.zeros((n, subvectors * sub_dim - dim), dtype=vectors.dtype)], axis=1)
+        return vectors.reshape(n, subvectors, sub_dim)
+
+    def code_width(self, dim):
+        return len(self.codebooks)
+
+    def encode(self, vectors):
+        codes = np.empty((len(vectors), len(self.codebooks)), dtype=np.uint8)
+        for start in range(0, len(vectors), _BLOCK_ROWS):
+            block = self._split(np.asarray(vectors[start:start + _BLOCK_ROWS], dtype=np.float32), self.sub_dim)
+            subspaces = np.ascontiguousarray(block.transpose(1, 0, 2))
+            for m, codebook in enumerate(self.codebooks):
+                codes[start:start + len(block), m] = _nearest(subspaces[m], codebook)
+        return codes
+
+    def scores(self, query, codes):
+        """Approximate query . vector for every row of codes."""
+        table = np.einsum("mks,ms->mk", self.codebooks, self._split(query[None, :], self.sub_dim)[0])
+        # Flat offsets into the table, so one take() gathers every subvector's entry
+        offsets = (np.arange(len(self.codebooks)) * table.shape[1]).astype(np.int32)
+        flat = table.ravel()
+        scores = np.empty(len(codes), dtype=np.float32)
+        for start in range(0, len(codes), _SCORE_BLOCK_ROWS):
+            block = codes[start:start + _SCORE_BLOCK_ROWS]
+            scores[start:start + len(block)] = flat.take(block.astype(np.int32) + offsets).sum(axis=1)
+        return scores
+
+    def state(self):
+        return {"codebooks": self.codebooks, "dim": np.int64(self.dim), "trained_rows": np.int64(self.trained_rows)}
+
+    @classmethod
+    def from_state(cls, state):
+        return cls(state["codebooks"], int(state["dim"]), int(state["trained_rows"]))
+
+
+QUANTIZERS = {
+    "int8": ScalarQuantizer,
+    "pq": ProductQuantizer,
+}
@@ -1,8 +1,11 @@
-from langchain.chains import retrieval_qa, RetrievalQA
 from langchain_core.prompts import PromptTemplate
 
-from app.components.llm import load_llm
+from app.components.llm import load_llm, instrument_llm
 from app.components.vector_store import load_vector_store
+from app.components.lexical_index import get_lexical_index
+from app.components.hybrid_retriever import CollectionsRetriever, HybridRetriever
+from app.components.collections import get_collection, resolve_collections
+from app.components.context_packer import ContextPacker, ContextPackingRetriever
 
 from app.config.config import *
 
@@ -26,12 +29,63 @@ def set_custom_prompt():
     return PromptTemplate(template=CUSTOM_PROMPT_TEMPLATE, input_variables=['context', 'question'])
 
 
-def create_qa_chain():
+def _packed(retriever, embeddings):
+    """retriever, with its results packed into the context token budget when packing is on."""
+    if not CONTEXT_PACKING_ENABLED:
+        return retriever
+    return ContextPackingRetriever(base_retriever=retriever, packer=ContextPacker(embeddings))
+
+
+def create_retriever(db, collection=None):
+    """create_search_retriever(db, collection), packed into the context token budget when packing is on."""
+    return _packed(create_search_retriever(db, collection), db.embeddings)
+
+
+def create_collections_retriever(stores):
+    """Search over several collections ({name: db}) with their results fused, packed like create_retriever()."""
+    retrievers = {name: create_search_retriever(db, get_collection(name)) for name, db in stores.items()}
+    return _packed(CollectionsRetriever(retrievers=retrievers, k=RETRIEVER_K), next(iter(stores.values())).embeddings)
+
+
+def create_search_retriever(db, collection=None):
+    """
+    Dense retriever over db, fused with the collection's BM25 index when hybrid retrieval is on
+    and that index isn't empty.
+    """
+    if not HYBRID_RETRIEVAL_ENABLED:
+        return db.as_retriever(search_kwargs={"k": RETRIEVER_K})
+
+    lexical_index = get_lexical_index((collection or get_collection()).lexical_index_path)
+    if not len(lexical_index):
+        logger.info("Lexical index is empty, using dense retrieval only")
+        return db.as_retriever(search_kwargs={"k": RETRIEVER_K})
+
+    return HybridRetriever(
+        dense_retriever=db.as_retriever(search_kwargs={"k": max(HYBRID_CANDIDATES, RETRIEVER_K)}),
+        lexical_index=lexical_index,
+        k=RETRIEVER_K,
+    )
+
+
+def create_qa_chain(collections=None):
+    """
+    RetrievalQA over collections (see resolve_collections(), default the default collection).
+    Several collections are searched separately and their results fused.
+    """
     try:
-        logger.info("Loading vector store for context")
-        db = load_vector_store()
+        from langchain.chains import RetrievalQA
+
+        scope = resolve_collections(collections)
+        logger.info(f"Loading vector stores for context from collections {list(scope)}")
+        stores = {}
+        for name in scope:
+            db = load_vector_store(get_collection(name))
+            if db is None:
+                logger.warning(f"Collection '{name}' has no vector store yet, it is left out of the search")
+            else:
+                stores[name] = db
         
-        if db is None:
+        if not stores:
             raise CustomException("Vector store is not present or empty")
         
         llm = load_llm()
@@ -40,9 +94,10 @@ def create_qa_chain():
             raise CustomException("LLM is not loaded properly")
         
         qa_chain = RetrievalQA.from_chain_type(
-            llm=llm,
+            llm=instrument_llm(llm),
             chain_type="stuff",
-            retriever=db.as_retriever(search_kwargs={"k": 3}),
+            retriever=(create_retriever(stores[scope[0]], get_collection(scope[0])) if len(scope) == 1
+                       else create_collections_retriever(stores)),
             return_source_documents=True,
             chain_type_kwargs={
                 "prompt": set_custom_prompt()
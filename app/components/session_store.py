@@ -0,0 +1,342 @@
+import json
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+
+from app.config.config import *
+from app.common.logger import get_logger
+from app.common.metrics import REGISTRY
+
+try:
+    import fcntl
+except ImportError:  # not on POSIX, assume a single process uses the store
+    fcntl = None
+
+logger = get_logger(__name__)
+
+# Chat messages are stored as compact [role, content] records
+_ROLE_CODES = {"user": "u", "assistant": "a", "metadata": "m"}
+_ROLES = {code: role for role, code in _ROLE_CODES.items()}
+
+_SESSION_ID_RE = re.compile(r"^[0-9a-f]{32}$")
+
+
+def compact_messages(messages):
+    """[{"role", "content"}, ...] -> [[role code, content], ...]"""
+    return [[_ROLE_CODES.get(message["role"], message["role"]), message["content"]] for message in messages]
+
+
+def expand_messages(records):
+    """compact_messages() reversed, for the templates."""
+    messages = [{"role": _ROLES.get(role, role), "content": content} for role, content in records]
+    # Trimming can cut a turn in half; the history starts at a question
+    while messages and messages[0]["role"] != "user":
+        messages.pop(0)
+    return messages
+
+
+def valid_session_id(sid):
+    return isinstance(sid, str) and bool(_SESSION_ID_RE.match(sid))
+
+
+class MemorySessionStore:
+    """
+    Sessions in this process only, least recently used ones evicted past max_sessions.
+    Fastest, but every worker has its own sessions and a restart loses them.
+    """
+
+    def __init__(self, max_sessions=SESSION_MAX_SESSIONS, ttl=SESSION_TTL, max_messages=CHAT_HISTORY_MAX_MESSAGES):
+        self.max_sessions = max_sessions
+        self.ttl = ttl
+        self.max_messages = max_messages
+        self._lock = threading.Lock()
+        # sid -> [data, records, last used]
+        self._sessions = OrderedDict()
+
+    def _entry(self, sid, create=False):
+        entry = self._sessions.get(sid)
+        now = time.time()
+        if entry is not None and now - entry[2] > self.ttl:
+            del self._sessions[sid]
+            entry = None
+        if entry is None:
+            if not create:
+                return None
+            entry = self._sessions[sid] = [{}, [], now]
+            while len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+        entry[2] = now
+        self._sessions.move_to_end(sid)
+        return entry
+
+    def load(self, sid):
+        with self._lock:
+            entry = self._entry(sid)
+            return dict(entry[0]) if entry else None
+
+    def save(self, sid, data):
+        with self._lock:
+            self._entry(sid, create=True)[0] = dict(data)
+
+    def messages(self, sid):
+        with self._lock:
+            entry = self._entry(sid)
+            return list(entry[1]) if entry else []
+
+    def append(self, sid, records):
+        with self._lock:
+            entry = self._entry(sid, create=True)
+            entry[1].extend(records)
+            del entry[1][:-self.max_messages]
+
+    def clear_messages(self, sid):
+        with self._lock:
+            entry = self._entry(sid)
+            if entry:
+                entry[1] = []
+
+    def delete(self, sid):
+        with self._lock:
+            self._sessions.pop(sid, None)
+
+    def __len__(self):
+        return len(self._sessions)
+
+
+class DiskSessionStore:
+    """
+    One small JSON file of session data and one append-only JSONL history file per session.
+    Adding a turn appends its lines, and cuts the file back to max_messages once it holds
+    twice that many, under an exclusive lock on the file, so workers sharing the directory
+    never lose each other's turns.
+    """
+
+    SWEEP_INTERVAL = 3600
+
+    def __init__(self, path=SESSION_STORE_PATH, ttl=SESSION_TTL, max_messages=CHAT_HISTORY_MAX_MESSAGES):
+        self.path = path
+        self.ttl = ttl
+        self.max_messages = max_messages
+        self._lock = threading.Lock()
+        self._last_sweep = 0.0
+        os.makedirs(path, exist_ok=True)
+
+    def _file(self, sid, suffix):
+        if not valid_session_id(sid):
+            raise ValueError(f"Invalid session id: {sid!r}")
+        return os.path.join(self.path, f"{sid}{suffix}")
+
+    def _expired(self, path):
+        try:
+            return time.time() - os.stat(path).st_mtime > self.ttl
+        except OSError:
+            return True
+
+    def load(self, sid):
+        path = self._file(sid, ".json")
+        if self._expired(path):
+            return None
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def save(self, sid, data):
+        path = self._file(sid, ".json")
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f, separators=(",", ":"))
+        os.replace(tmp_path, path)
+        self._maybe_sweep()
+
+    def _read_records(self, path):
+        records = []
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        records.append(json.loads(line))
+                    except ValueError:
+                        # A write cut short by a crash
+                        continue
+        except OSError:
+            pass
+        return records
+
+    def messages(self, sid):
+        path = self._file(sid, ".history.jsonl")
+        if self._expired(path):
+            return []
+        return self._read_records(path)[-self.max_messages:]
+
+    @contextmanager
+    def _locked_history(self, path):
+        """The history file opened for appending and reading, locked against other processes."""
+        while True:
+            f = open(path, "a+", encoding="utf-8")
+            if fcntl is None:
+                break
+            fcntl.flock(f, fcntl.LOCK_EX)
+            # A trim or clear elsewhere may have replaced the file while this one waited
+            try:
+                if os.fstat(f.fileno()).st_ino == os.stat(path).st_ino:
+                    break
+            except FileNotFoundError:
+                pass
+            f.close()
+        try:
+            yield f
+        finally:
+            f.close()
+
+    def append(self, sid, records):
+        path = self._file(sid, ".history.jsonl")
+        lines = "".join(json.dumps(record, separators=(",", ":")) + "\n" for record in records)
+        with self._lock, self._locked_history(path) as f:
+            f.write(lines)
+            f.flush()
+            f.seek(0)
+            if sum(1 for _ in f) <= 2 * self.max_messages:
+                return
+            # Replaced while the old file is still locked, so no append lands in between
+            kept = self._read_records(path)[-self.max_messages:]
+            tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as tmp:
+                tmp.writelines(json.dumps(record, separators=(",", ":")) + "\n" for record in kept)
+            os.replace(tmp_path, path)
+
+    def clear_messages(self, sid):
+        try:
+            os.remove(self._file(sid, ".history.jsonl"))
+        except FileNotFoundError:
+            pass
+
+    def delete(self, sid):
+        for suffix in (".json", ".history.jsonl"):
+            try:
+                os.remove(self._file(sid, suffix))
+            except FileNotFoundError:
+                pass
+
+    def _maybe_sweep(self):
+        now = time.time()
+        if now - self._last_sweep < self.SWEEP_INTERVAL:
+            return
+        self._last_sweep = now
+        removed = 0
+        for name in os.listdir(self.path):
+            path = os.path.join(self.path, name)
+            if self._expired(path):
+                try:
+                    os.remove(path)
+                    removed += 1
+                except OSError:
+                    pass
+        if removed:
+            logger.info(f"Removed {removed} expired session files")
+
+
+def _default_collection():
+    from app.configuration.mongo_db_connection import MongoDBClient
+    from app.common.resilience import GuardedClient, get_dependency
+
+    # Reads are retried; a retried $push could append a message twice, so writes are tried once
+    return GuardedClient(MongoDBClient().database[SESSION_COLLECTION_NAME], get_dependency("mongo"), {
+        "find_one": True, "update_one": False, "delete_one": False, "create_index": False,
+    })
+
+
+class MongoSessionStore:
+    """
+    One document per session, {_id: sid, data, messages, updated_at}. A turn is a single
+    $push with $slice, so the history stays bounded without reading it; a TTL index on
+    updated_at expires idle sessions.
+    """
+
+    def __init__(self, collection_factory=None, ttl=SESSION_TTL, max_messages=CHAT_HISTORY_MAX_MESSAGES):
+        self.collection_factory = collection_factory or _default_collection
+        self.ttl = ttl
+        self.max_messages = max_messages
+        self._collection = None
+        self._lock = threading.Lock()
+
+    @property
+    def collection(self):
+        if self._collection is None:
+            with self._lock:
+                if self._collection is None:
+                    collection = self.collection_factory()
+                    try:
+                        collection.create_index("updated_at", expireAfterSeconds=int(self.ttl))
+                    except Exception as e:
+                        logger.warning(f"Could not create the session TTL index: {e}")
+                    self._collection = collection
+        return self._collection
+
+    def _now(self):
+        return datetime.now(timezone.utc)
+
+    def _fresh(self, document):
+        if document is None:
+            return False
+        updated_at = document.get("updated_at")
+        if updated_at is None:
+            return True
+        if updated_at.tzinfo is None:
+            updated_at = updated_at.replace(tzinfo=timezone.utc)
+        # The TTL monitor only runs once a minute
+        return self._now() - updated_at <= timedelta(seconds=self.ttl)
+
+    def load(self, sid):
+        document = self.collection.find_one({"_id": sid}, {"data": 1, "updated_at": 1})
+        return document.get("data", {}) if self._fresh(document) else None
+
+    def save(self, sid, data):
+        self.collection.update_one({"_id": sid}, {"$set": {"data": dict(data), "updated_at": self._now()}}, upsert=True)
+
+    def messages(self, sid):
+        document = self.collection.find_one({"_id": sid}, {"messages": 1, "updated_at": 1})
+        return document.get("messages", []) if self._fresh(document) else []
+
+    def append(self, sid, records):
+        self.collection.update_one(
+            {"_id": sid},
+            {"$push": {"messages": {"$each": list(records), "$slice": -self.max_messages}},
+             "$set": {"updated_at": self._now()}},
+            upsert=True)
+
+    def clear_messages(self, sid):
+        self.collection.update_one({"_id": sid}, {"$set": {"messages": [], "updated_at": self._now()}})
+
+    def delete(self, sid):
+        self.collection.delete_one({"_id": sid})
+
+
+SESSION_BACKENDS = {
+    "memory": MemorySessionStore,
+    "disk": DiskSessionStore,
+    "mongo": MongoSessionStore,
+}
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_session_store():
+    global _store
+    with _store_lock:
+        if _store is None:
+            backend = SESSION_BACKENDS.get(SESSION_BACKEND)
+            if backend is None:
+                logger.warning(f"Unknown SESSION_BACKEND '{SESSION_BACKEND}', using memory")
+                backend = MemorySessionStore
+            _store = backend()
+            logger.info(f"Session store: {type(_store).__name__}")
+            if isinstance(_store, MemorySessionStore):
+                REGISTRY.register_callback("rag_sessions", "Sessions held in memory", fn=lambda: len(_store))
+        return _store
@@ -0,0 +1,107 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from app.config.config import *
+from app.common.logger import get_logger
+from app.common.metrics import span
+from app.common.resilience import call_with_backoff
+
+logger = get_logger(__name__)
+
+
+class _Batch:
+    def __init__(self, ids, texts, metadatas):
+        self.ids = ids
+        self.texts = texts
+        self.metadatas = metadatas
+        # Kept once embedded, so a failed upsert is retried without re-embedding
+        self.vectors = None
+        # Records before this offset are already upserted and are not sent again
+        self.upserted = 0
+        self.error = None
+
+
+def _process_batch(batch, embedding_model, index, upsert_batch_size, namespace, text_key, progress):
+    try:
+        if batch.vectors is None:
+            with span("embed_documents"):
+                batch.vectors = call_with_backoff(embedding_model.embed_documents, batch.texts)
+            if progress:
+                progress("chunks_embedded", len(batch.ids))
+
+        records = [
+            {"id": chunk_id, "values": list(vector), "metadata": {**metadata, text_key: text}}
+            for chunk_id, vector, metadata, text in zip(batch.ids, batch.vectors, batch.metadatas, batch.texts)
+        ]
+        for start in range(batch.upserted, len(records), upsert_batch_size):
+            chunk = records[start:start + upsert_batch_size]
+            with span("vector_upsert"):
+                call_with_backoff(index.upsert, vectors=chunk, namespace=namespace)
+            batch.upserted = start + len(chunk)
+            if progress:
+                progress("vectors_upserted", len(chunk))
+        batch.error = None
+    except Exception as e:
+        batch.error = e
+    return batch
+
+
+def _run_batches(batches, embedding_model, index, upsert_batch_size, max_in_flight, namespace, text_key, progress):
+    # The pool size bounds the number of requests in flight against the APIs
+    with ThreadPoolExecutor(max_workers=max_in_flight) as executor:
+        return list(executor.map(
+            lambda batch: _process_batch(batch, embedding_model, index, upsert_batch_size, namespace, text_key, progress),
+            batches,
+        ))
+
+
+def embed_and_upsert(texts, metadatas, ids, embedding_model, index,
+                     embed_batch_size=EMBED_BATCH_SIZE, upsert_batch_size=UPSERT_BATCH_SIZE,
+                     max_in_flight=UPSERT_MAX_IN_FLIGHT, retry_passes=UPSERT_RETRY_PASSES,
+                     namespace=None, text_key="text", progress=None):
+    """
+    Embeds texts and upserts them in batches, with at most max_in_flight batches running at once.
+    A batch that still fails after its backoff retries doesn't fail the others; failed batches
+    get retry_passes extra passes at the end, and whatever still fails is reported in failed_ids.
+
+    embedding_model needs embed_documents(texts), index needs upsert(vectors=..., namespace=...),
+    so local fakes can stand in for Google and Pinecone. progress(field, amount) is called
+    with "chunks_embedded" and "vectors_upserted" as batches complete.
+    """
+    began = time.perf_counter()
+
+    batches = [
+        _Batch(ids[start:start + embed_batch_size], texts[start:start + embed_batch_size],
+               metadatas[start:start + embed_batch_size])
+        for start in range(0, len(texts), embed_batch_size)
+    ]
+
+    pending = batches
+    for attempt in range(retry_passes + 1):
+        if attempt:
+            logger.warning(f"Retrying {len(pending)} failed batches (pass {attempt}/{retry_passes})")
+        pending = [
+            batch for batch in _run_batches(pending, embedding_model, index, upsert_batch_size,
+                                            max_in_flight, namespace, text_key, progress)
+            if batch.error is not None
+        ]
+        if not pending:
+            break
+
+    for batch in pending:
+        logger.error(f"Batch of {len(batch.ids)} chunks failed: {batch.error}")
+
+    failed_ids = [chunk_id for batch in pending for chunk_id in batch.ids]
+    seconds = time.perf_counter() - began
+    upserted = len(texts) - len(failed_ids)
+    report = {
+        "chunks": len(texts),
+        "upserted": upserted,
+        "failed_ids": failed_ids,
+        "batches": len(batches),
+        "failed_batches": len(pending),
+        "seconds": seconds,
+        "chunks_per_sec": upserted / seconds if seconds > 0 else 0.0,
+    }
+    logger.info(f"Upserted {upserted}/{len(texts)} chunks in {seconds:.2f}s ({report['chunks_per_sec']:.1f} chunks/sec)")
+    return report
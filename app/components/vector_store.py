@@ -1,11 +1,15 @@
-from pinecone import Pinecone, ServerlessSpec
 import os
+import threading
 from app.components.embeddings import get_embeddings_model
 
-# Assuming langchain_pinecone is installed for Pinecone integration with Langchain
-# If you don't have it, install it: pip install langchain-pinecone
-from langchain_pinecone import Pinecone as LangchainPinecone
 from langchain_core.documents import Document
+from uuid import uuid4
+
+from app.components.upsert_pipeline import embed_and_upsert
+from app.components.local_vector_index import LocalVectorStore, get_local_index
+from app.components.collections import get_collection
+
+from app.config.config import VECTOR_STORE_BACKEND, PINECONE_POOL_THREADS, HTTP_POOL_MAX_CONNECTIONS
 
 from app.common.logger import get_logger
 from app.common.custom_exception import CustomException
@@ -18,26 +22,97 @@ load_dotenv()
 PINECONE_API_KEY = os.environ.get('PINECONE_API_KEY')
 PINECONE_API_ENV = os.environ.get('PINECONE_API_ENV')
 PINECONE_INDEX_NAME = os.environ.get('PINECONE_INDEX_NAME', 'my-knowledge-index')
+# Optional data-plane host, e.g. a local Pinecone emulator for testing the upsert pipeline
+PINECONE_HOST = os.environ.get('PINECONE_HOST')
 
 
 logger = get_logger(__name__)
 
-pc = None
-try:
-    if PINECONE_API_KEY :
-       
-        pc = Pinecone(api_key=PINECONE_API_KEY)
-        logger.info("Pinecone client initialized successfully.")
-    else:
-        logger.error("PINECONE_API_KEY or PINECONE_API_ENV not found in environment variables. Please set them.")
-except Exception as e:
-    logger.error(f"Failed to initialize Pinecone client: {e}")
-    pc = None 
+# The Pinecone client (and the pinecone package) is only loaded when first needed,
+# so importing this module, e.g. with the local backend, costs nothing
+_pc = None
+_pc_lock = threading.Lock()
 
-def load_vector_store():
-    
+
+def get_pinecone_client():
+    """The shared Pinecone client, created on first use. None if it can't be created."""
+    global _pc
+
+    if _pc is not None:
+        return _pc
+    with _pc_lock:
+        if _pc is not None:
+            return _pc
+        try:
+            if PINECONE_API_KEY :
+                from pinecone import Pinecone
+
+                _pc = Pinecone(api_key=PINECONE_API_KEY)
+                logger.info("Pinecone client initialized successfully.")
+            else:
+                logger.error("PINECONE_API_KEY or PINECONE_API_ENV not found in environment variables. Please set them.")
+        except Exception as e:
+            logger.error(f"Failed to initialize Pinecone client: {e}")
+        return _pc
+
+class _NamespacedIndex:
+    """A Pinecone index whose upserts, deletes, updates and queries go to one namespace unless given another."""
+
+    _SCOPED = ("upsert", "delete", "update", "query", "fetch")
+
+    def __init__(self, index, namespace):
+        self._index = index
+        self.namespace = namespace
+
+    def __getattr__(self, name):
+        attr = getattr(self._index, name)
+        if name not in self._SCOPED or not callable(attr):
+            return attr
+
+        def scoped(*args, **kwargs):
+            if kwargs.get("namespace") is None:
+                kwargs["namespace"] = self.namespace
+            return attr(*args, **kwargs)
+        return scoped
+
+
+# One data-plane handle per process: each Index() opens its own connection pool
+_index = None
+
+
+def _get_index(pc, collection=None):
+    global _index
+
+    if _index is None:
+        with _pc_lock:
+            if _index is None:
+                options = dict(pool_threads=PINECONE_POOL_THREADS, connection_pool_maxsize=HTTP_POOL_MAX_CONNECTIONS)
+                if PINECONE_HOST:
+                    options["host"] = PINECONE_HOST
+                _index = pc.Index(PINECONE_INDEX_NAME, **options)
+    index = _index
+    if collection is None or collection.namespace is None:
+        return index
+    return _NamespacedIndex(index, collection.namespace)
+
+
+def _load_local_vector_store(collection):
+    index = get_local_index(collection.local_index_path)
+    if not len(index):
+        logger.warning(f"Local vector index at '{index.path}' is empty. It will be filled when data is saved.")
+        return None
+    logger.info(f"Local vector index loaded with {len(index)} vectors.")
+    return LocalVectorStore(index, get_embeddings_model())
+
+
+def load_vector_store(collection=None):
+    """The LangChain vector store over one collection (default DEFAULT_COLLECTION), or None if there is none yet."""
     try:
+        collection = collection or get_collection()
+        if VECTOR_STORE_BACKEND == "local":
+            return _load_local_vector_store(collection)
  
+        pc = get_pinecone_client()
         if pc is None:
             raise CustomException("Pinecone client is not initialized. Cannot load vector store.")
 
@@ -48,11 +123,14 @@ def load_vector_store():
         index_names = [idx.name for idx in existing_indexes_response.indexes]
 
         if PINECONE_INDEX_NAME in index_names:
-            logger.info(f"Connecting to existing Pinecone index: '{PINECONE_INDEX_NAME}'")
-            
-            vector_store = LangchainPinecone.from_existing_index(
-                index_name=PINECONE_INDEX_NAME, 
+            logger.info(f"Connecting to existing Pinecone index: '{PINECONE_INDEX_NAME}' (collection '{collection.name}')")
+            from app.components.pinecone_store import TimedPinecone
+
+            # The shared index rather than from_existing_index(), which builds a new client each time
+            vector_store = TimedPinecone(
+                index=_get_index(pc),
                 embedding=embedding_model,
+                namespace=collection.namespace,
             )
             logger.info("Vector store loaded from Pinecone successfully.")
             return vector_store
@@ -65,57 +143,141 @@ def load_vector_store():
         logger.error(str(error_message))
         return None
     
-def save_vector_store(text_chunks: list[Document]):
+def _run_pipeline(text_chunks, ids, embedding_model, index, progress=None):
+    if ids is None:
+        ids = [str(uuid4()) for _ in text_chunks]
+    
+    # Batched, bounded-concurrency embedding + upsert; a throttled batch is retried on its own
+    return embed_and_upsert(
+        texts=[chunk.page_content for chunk in text_chunks],
+        metadatas=[dict(chunk.metadata) for chunk in text_chunks],
+        ids=ids,
+        embedding_model=embedding_model,
+        index=index,
+        progress=progress,
+    )
+
+
+def open_vector_index(embedding_model, collection=None):
+    """
+    The index to upsert into for a collection (default DEFAULT_COLLECTION): its local index,
+    or the Pinecone index (created if missing) scoped to its namespace.
+    Raises CustomException if it can't be opened.
+    """
+    collection = collection or get_collection()
+    if VECTOR_STORE_BACKEND == "local":
+        return get_local_index(collection.local_index_path)
+
+    pc = get_pinecone_client()
+    if pc is None:
+        raise CustomException("Pinecone client is not initialized. Cannot save vector store.")
+
     try:
-        if pc is None:
-            raise CustomException("Pinecone client is not initialized. Cannot save vector store.")
+        # The embedding cache knows the dimension, so this usually costs no API call
+        dimension = getattr(embedding_model, "dimension", None)
+        if dimension is None:
+            sample_embedding = embedding_model.embed_query("A test sentence for dimension calculation.")
+            dimension = len(sample_embedding)
+    except Exception as embed_err:
+        raise CustomException(f"Failed to get embedding dimension from the model: {embed_err}. Ensure the embedding model is functional.")
 
+    index_names = pc.list_indexes().names()
+
+    if PINECONE_INDEX_NAME not in index_names:
+        logger.info(f"Pinecone index '{PINECONE_INDEX_NAME}' does not exist. Creating a new one with dimension={dimension} and metric='cosine'.")
+        from pinecone import ServerlessSpec
+
+        pc.create_index(
+            name=PINECONE_INDEX_NAME,
+            dimension=dimension,
+            metric='cosine',
+            spec=ServerlessSpec(
+                cloud='aws',
+                region='us-east-1'
+            )
+        )
+        logger.info(f"Pinecone index '{PINECONE_INDEX_NAME}' created successfully.")
+    else:
+        logger.info(f"Pinecone index '{PINECONE_INDEX_NAME}' already exists. Appending new data (upserting).")
+
+    return _get_index(pc, collection)
+
+
+def upsert_text_chunks(index, text_chunks, ids, embedding_model, progress=None):
+    """Embeds and upserts one group of chunks into an index from open_vector_index(). Returns the pipeline report."""
+    return _run_pipeline(text_chunks, ids, embedding_model, index, progress)
+
+
+def flush_vector_index(index):
+    """Makes upserted vectors durable. Pinecone writes are durable already; the local index needs a commit."""
+    if VECTOR_STORE_BACKEND == "local":
+        index.commit()
+        logger.info(f"Local vector index now holds {len(index)} vectors.")
+
+
+def save_vector_store(text_chunks: list[Document], ids: list[str] = None, progress=None, collection=None):
+    """
+    Embeds and upserts the chunks. Returns the pipeline report (see embed_and_upsert),
+    whose failed_ids lists chunks that are not in the index, or None if nothing could be saved.
+    """
+    try:
         if not text_chunks:
             raise CustomException("No text chunks provided to save in vector store.")
-        
-        logger.info("Preparing to save new vector store data to Pinecone...")
+
+        logger.info(f"Preparing to save new vector store data ({VECTOR_STORE_BACKEND} backend)...")
 
         embedding_model = get_embeddings_model()
-        
-        
-        try:
-            
-            sample_embedding = embedding_model.embed_query("A test sentence for dimension calculation.")
-            dimension = len(sample_embedding)
-        except Exception as embed_err:
-            raise CustomException(f"Failed to get embedding dimension from the model: {embed_err}. Ensure the embedding model is functional.")
+        index = open_vector_index(embedding_model, collection)
 
-        
-        index_names = pc.list_indexes().names() 
-        
-        if PINECONE_INDEX_NAME not in index_names:
-            logger.info(f"Pinecone index '{PINECONE_INDEX_NAME}' does not exist. Creating a new one with dimension={dimension} and metric='cosine'.")
-            
-            pc.create_index(
-                name=PINECONE_INDEX_NAME,
-                dimension=dimension,
-                metric='cosine', 
-                spec=ServerlessSpec(
-                    cloud='aws', 
-                    region='us-east-1'
-                )
-            )
-            logger.info(f"Pinecone index '{PINECONE_INDEX_NAME}' created successfully.")
+        report = upsert_text_chunks(index, text_chunks, ids, embedding_model, progress)
+        flush_vector_index(index)
+
+        if report["failed_ids"]:
+            logger.error(f"{len(report['failed_ids'])} of {len(text_chunks)} chunks could not be upserted.")
         else:
-            logger.info(f"Pinecone index '{PINECONE_INDEX_NAME}' already exists. Appending new data (upserting).")
-        
-        
-        db = LangchainPinecone.from_documents(
-            text_chunks, 
-            embedding_model, 
-            index_name=PINECONE_INDEX_NAME,
-            # environment=PINECONE_API_ENV 
-        )
-        
-        logger.info("Vector store data saved/upserted to Pinecone successfully.")
-        
-        return db
+            logger.info("Vector store data saved/upserted successfully.")
+
+        return report
     except Exception as e:
-        error_message = CustomException(f"Failed to create or save new vector store in Pinecone: {e}", e)
+        error_message = CustomException(f"Failed to create or save new vector store: {e}", e)
         logger.error(str(error_message))
         return None
+
+
+def delete_vectors(ids: list[str], batch_size: int = 1000, collection=None):
+    """Deletes a collection's vectors by ID. Raises on failure so callers don't drop them from the manifest."""
+    if not ids:
+        return
+    collection = collection or get_collection()
+    if VECTOR_STORE_BACKEND == "local":
+        index = get_local_index(collection.local_index_path)
+        index.delete(ids=ids)
+        index.commit()
+        logger.info(f"Deleted {len(ids)} vectors from the local vector index.")
+        return
+    pc = get_pinecone_client()
+    if pc is None:
+        raise CustomException("Pinecone client is not initialized. Cannot delete vectors.")
+
+    try:
+        if PINECONE_INDEX_NAME not in pc.list_indexes().names():
+            logger.warning(f"Pinecone index '{PINECONE_INDEX_NAME}' not found. Nothing to delete.")
+            return
+
+        index = _get_index(pc, collection)
+        for start in range(0, len(ids), batch_size):
+            index.delete(ids=ids[start:start + batch_size])
+        logger.info(f"Deleted {len(ids)} vectors of collection '{collection.name}' from Pinecone index '{PINECONE_INDEX_NAME}'.")
+    except Exception as e:
+        raise CustomException(f"Failed to delete vectors from Pinecone: {e}", e)
+
+
+def update_vector_metadata(index, updates):
+    """
+    Merges {id: metadata} into the metadata of stored vectors of an index from open_vector_index().
+    The local index applies them on its next commit; Pinecone updates one vector per call.
+    """
+    for chunk_id, metadata in updates.items():
+        index.update(id=chunk_id, set_metadata=metadata)
+    if updates:
+        logger.info(f"Updated the metadata of {len(updates)} vectors.")
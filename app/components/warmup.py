@@ -0,0 +1,66 @@
+"""
+Heavy clients (Pinecone, Google embeddings, Groq, MongoDB) are created on first use, so a
+worker imports quickly and can take traffic right after it forks. warm_up() loads them
+ahead of the first request instead; the apps call it on start when WARMUP_ON_START is on.
+
+    python -m app.components.warmup
+"""
+import time
+
+from app.config.config import *
+from app.common.logger import get_logger
+from app.common.metrics import span
+
+logger = get_logger(__name__)
+
+
+def _warm_chain():
+    from app.components.chain_registry import warm_up_qa_chain
+    return warm_up_qa_chain()
+
+
+def _warm_answer_cache():
+    if not ANSWER_CACHE_ENABLED:
+        return True
+    from app.components.answer_cache import get_answer_cache
+    get_answer_cache()
+    return True
+
+
+def _warm_mongo():
+    from app.components.mongo_writer import get_mongo_writer
+    from app.configuration.mongo_db_connection import MongoDBClient
+    get_mongo_writer()
+    # The client is shared, the writer thread picks up this one; pymongo connects in the background
+    MongoDBClient()
+    return True
+
+
+WARMUP_STEPS = {
+    "chain": _warm_chain,
+    "answer_cache": _warm_answer_cache,
+    "mongo": _warm_mongo,
+}
+
+
+def warm_up(stages=None):
+    """Runs the given warm-up stages (default WARMUP_STAGES). Returns {stage: ok}; failures are only logged."""
+    results = {}
+    for stage in WARMUP_STAGES if stages is None else stages:
+        step = WARMUP_STEPS.get(stage)
+        if step is None:
+            logger.warning(f"Unknown warm-up stage '{stage}', expected one of {sorted(WARMUP_STEPS)}")
+            continue
+        began = time.perf_counter()
+        try:
+            with span(f"warmup_{stage}"):
+                results[stage] = bool(step())
+        except Exception as e:
+            logger.warning(f"Warm-up stage '{stage}' failed, it will load on first use: {e}")
+            results[stage] = False
+        logger.info(f"Warm-up stage '{stage}' {'done' if results[stage] else 'failed'} in {time.perf_counter() - began:.2f}s")
+    return results
+
+
+if __name__ == "__main__":
+    warm_up()
@@ -5,8 +5,171 @@ GROQ_API_KEY = os.getenv("GROQ_API_KEY")
 GOOGLE_API_KEY = os.getenv("GOOGLE_API_KEY")
 DB_FAISS_PATH = "vectorestore/db_faiss"
 DATA_PATH = "data2/"
-CHUNK_SIZE = 10000
-CHUNK_OVERLAP = 1000
+# Chunk sizes count CHUNK_UNIT: "chars", or "tokens" (words cut into pieces of up to four
+# characters, close to what an LLM tokenizer counts). CHUNK_ACROSS_PAGES lets a chunk run on
+# into the next page instead of ending with its page
+CHUNK_SIZE = int(os.getenv("CHUNK_SIZE", "10000"))
+CHUNK_OVERLAP = int(os.getenv("CHUNK_OVERLAP", "1000"))
+CHUNK_UNIT = os.getenv("CHUNK_UNIT", "chars").lower()
+CHUNK_ACROSS_PAGES = os.getenv("CHUNK_ACROSS_PAGES", "false").lower() == "true"
 
 DATABASE_NAME = "rag_db"
-COLLECTION_NAME = "rag_collection"
\ No newline at end of file
+COLLECTION_NAME = "rag_collection"
+
+LLM_MODEL_NAME = "gemma2-9b-it"
+EMBEDDING_MODEL_NAME = "models/embedding-001"
+RETRIEVER_K = 3
+
+# Build the QA chain before the first request instead of on it
+WARMUP_ON_START = os.getenv("WARMUP_ON_START", "true").lower() == "true"
+# What the warm-up stage loads: "chain" (LLM, embeddings, vector store), "answer_cache", "mongo"
+WARMUP_STAGES = [stage.strip() for stage in os.getenv("WARMUP_STAGES", "chain,answer_cache,mongo").split(",") if stage.strip()]
+
+# Per-file hashes and vector IDs of everything ingested so far
+INGESTION_MANIFEST_PATH = "vectorestore/ingestion_manifest.json"
+
+# PDF parsing: >1 worker parses files and page ranges in a process pool
+PDF_PARSE_WORKERS = int(os.getenv("PDF_PARSE_WORKERS", os.cpu_count() or 1))
+PDF_PAGES_PER_TASK = int(os.getenv("PDF_PAGES_PER_TASK", "25"))
+
+# Embedding/upsert pipeline
+EMBED_BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", "100"))
+UPSERT_BATCH_SIZE = int(os.getenv("UPSERT_BATCH_SIZE", "100"))
+UPSERT_MAX_IN_FLIGHT = int(os.getenv("UPSERT_MAX_IN_FLIGHT", "4"))
+UPSERT_MAX_RETRIES = int(os.getenv("UPSERT_MAX_RETRIES", "5"))
+UPSERT_RETRY_PASSES = int(os.getenv("UPSERT_RETRY_PASSES", "1"))
+UPSERT_BACKOFF_BASE = float(os.getenv("UPSERT_BACKOFF_BASE", "1.0"))
+UPSERT_BACKOFF_MAX = float(os.getenv("UPSERT_BACKOFF_MAX", "30.0"))
+
+# Persistent embedding cache (keyed by normalized text hash + model)
+EMBEDDING_CACHE_ENABLED = os.getenv("EMBEDDING_CACHE_ENABLED", "true").lower() == "true"
+EMBEDDING_CACHE_DIR = "vectorestore/embedding_cache"
+EMBEDDING_CACHE_MAX_ENTRIES = int(os.getenv("EMBEDDING_CACHE_MAX_ENTRIES", "200000"))
+EMBEDDING_CACHE_FLUSH_INTERVAL = float(os.getenv("EMBEDDING_CACHE_FLUSH_INTERVAL", "5.0"))
+
+# Vector store backend: "pinecone" (remote) or "local" (memory-mapped index under DB_FAISS_PATH)
+VECTOR_STORE_BACKEND = os.getenv("VECTOR_STORE_BACKEND", "pinecone").lower()
+LOCAL_INDEX_IVF_MIN_ROWS = int(os.getenv("LOCAL_INDEX_IVF_MIN_ROWS", "20000"))
+LOCAL_INDEX_NPROBE = int(os.getenv("LOCAL_INDEX_NPROBE", "8"))
+# Compressed copy of the local index's vectors that searches scan: "none", "int8" (per-dimension
+# scalar) or "pq" (product quantization). The best LOCAL_INDEX_RERANK_FACTOR * k rows by code
+# are re-ranked against the float32 vectors on disk
+LOCAL_INDEX_QUANTIZATION = os.getenv("LOCAL_INDEX_QUANTIZATION", "none").lower()
+LOCAL_INDEX_RERANK_FACTOR = int(os.getenv("LOCAL_INDEX_RERANK_FACTOR", "10"))
+# Dimensions per PQ code byte, and rows sampled to learn the PQ codebooks
+LOCAL_INDEX_PQ_SUBVECTOR_DIM = int(os.getenv("LOCAL_INDEX_PQ_SUBVECTOR_DIM", "8"))
+LOCAL_INDEX_PQ_TRAIN_ROWS = int(os.getenv("LOCAL_INDEX_PQ_TRAIN_ROWS", "10000"))
+
+# Semantic answer cache in front of the QA chain
+ANSWER_CACHE_ENABLED = os.getenv("ANSWER_CACHE_ENABLED", "true").lower() == "true"
+ANSWER_CACHE_MAX_ENTRIES = int(os.getenv("ANSWER_CACHE_MAX_ENTRIES", "1000"))
+ANSWER_CACHE_TTL = float(os.getenv("ANSWER_CACHE_TTL", "3600"))
+ANSWER_CACHE_SIMILARITY = float(os.getenv("ANSWER_CACHE_SIMILARITY", "0.95"))
+
+# Background ingestion jobs
+INGESTION_WORKERS = int(os.getenv("INGESTION_WORKERS", "1"))
+INGESTION_JOB_HISTORY = int(os.getenv("INGESTION_JOB_HISTORY", "50"))
+
+# Background MongoDB writer for retrieval-source logging
+MONGO_WRITER_QUEUE_SIZE = int(os.getenv("MONGO_WRITER_QUEUE_SIZE", "10000"))
+MONGO_WRITER_BATCH_SIZE = int(os.getenv("MONGO_WRITER_BATCH_SIZE", "100"))
+MONGO_WRITER_FLUSH_INTERVAL = float(os.getenv("MONGO_WRITER_FLUSH_INTERVAL", "1.0"))
+MONGO_WRITER_DROP_POLICY = os.getenv("MONGO_WRITER_DROP_POLICY", "drop_oldest")
+MONGO_WRITER_BLOCK_TIMEOUT = float(os.getenv("MONGO_WRITER_BLOCK_TIMEOUT", "0.05"))
+MONGO_WRITER_MAX_RETRIES = int(os.getenv("MONGO_WRITER_MAX_RETRIES", "5"))
+MONGO_WRITER_MAX_BACKOFF = float(os.getenv("MONGO_WRITER_MAX_BACKOFF", "30.0"))
+
+# BM25 lexical index and hybrid (dense + lexical) retrieval
+LEXICAL_INDEX_PATH = "vectorestore/lexical_index.npz"
+BM25_K1 = float(os.getenv("BM25_K1", "1.2"))
+BM25_B = float(os.getenv("BM25_B", "0.75"))
+HYBRID_RETRIEVAL_ENABLED = os.getenv("HYBRID_RETRIEVAL_ENABLED", "true").lower() == "true"
+HYBRID_CANDIDATES = int(os.getenv("HYBRID_CANDIDATES", "10"))
+RRF_K = int(os.getenv("RRF_K", "60"))
+LEXICAL_FAST_PATH_ENABLED = os.getenv("LEXICAL_FAST_PATH_ENABLED", "true").lower() == "true"
+LEXICAL_FAST_PATH_MIN_CONFIDENCE = float(os.getenv("LEXICAL_FAST_PATH_MIN_CONFIDENCE", "0.6"))
+LEXICAL_FAST_PATH_MAX_TERMS = int(os.getenv("LEXICAL_FAST_PATH_MAX_TERMS", "4"))
+LEXICAL_FAST_PATH_MAX_DF = float(os.getenv("LEXICAL_FAST_PATH_MAX_DF", "0.1"))
+
+# Streaming ingestion: bounded chunk queue between parsing and embedding, resumable checkpoints
+INGESTION_CHECKPOINT_PATH = "vectorestore/ingestion_checkpoint.json"
+INGEST_QUEUE_SIZE = int(os.getenv("INGEST_QUEUE_SIZE", "1000"))
+INGEST_WINDOW_SIZE = int(os.getenv("INGEST_WINDOW_SIZE", str(EMBED_BATCH_SIZE * UPSERT_MAX_IN_FLIGHT)))
+INGEST_CHECKPOINT_INTERVAL = int(os.getenv("INGEST_CHECKPOINT_INTERVAL", "2000"))
+
+# Per-stage timing spans, exported on /metrics; REQUEST_TIMING_LOG also logs each request's stages
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "true").lower() == "true"
+REQUEST_TIMING_LOG = os.getenv("REQUEST_TIMING_LOG", "false").lower() == "true"
+
+# Context packing: retrieved chunks are cut to the passages most relevant to the question,
+# within a token budget, before they go into the prompt
+CONTEXT_PACKING_ENABLED = os.getenv("CONTEXT_PACKING_ENABLED", "true").lower() == "true"
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "1500"))
+CONTEXT_PASSAGE_CHARS = int(os.getenv("CONTEXT_PASSAGE_CHARS", "400"))
+# Weight of embedding similarity against term overlap when scoring passages. Off by default:
+# above 0 every packed question costs an extra embed_documents() call over its passages
+CONTEXT_SEMANTIC_WEIGHT = float(os.getenv("CONTEXT_SEMANTIC_WEIGHT", "0"))
+
+# /api/ask batch question answering
+BATCH_MAX_QUESTIONS = int(os.getenv("BATCH_MAX_QUESTIONS", "500"))
+BATCH_SEARCH_CONCURRENCY = int(os.getenv("BATCH_SEARCH_CONCURRENCY", "8"))
+BATCH_LLM_CONCURRENCY = int(os.getenv("BATCH_LLM_CONCURRENCY", "4"))
+
+# Server-side sessions: the cookie carries only a signed session ID. Backend: "memory" (LRU,
+# per process), "disk" (under SESSION_STORE_PATH, shared by workers on one host) or "mongo"
+SESSION_BACKEND = os.getenv("SESSION_BACKEND", "disk").lower()
+SESSION_STORE_PATH = "vectorestore/sessions"
+SESSION_COLLECTION_NAME = os.getenv("SESSION_COLLECTION_NAME", "chat_sessions")
+SESSION_MAX_SESSIONS = int(os.getenv("SESSION_MAX_SESSIONS", "10000"))
+SESSION_TTL = float(os.getenv("SESSION_TTL", str(7 * 24 * 3600)))
+# Chat messages kept per session; older ones are dropped
+CHAT_HISTORY_MAX_MESSAGES = int(os.getenv("CHAT_HISTORY_MAX_MESSAGES", "100"))
+
+# Near-duplicate chunks (MinHash over word shingles, LSH-banded) share one vector at ingestion
+DEDUP_ENABLED = os.getenv("DEDUP_ENABLED", "true").lower() == "true"
+DEDUP_INDEX_PATH = "vectorestore/dedup_index.npz"
+# Estimated Jaccard similarity of two chunks' shingles from which they count as duplicates
+DEDUP_THRESHOLD = float(os.getenv("DEDUP_THRESHOLD", "0.9"))
+DEDUP_NUM_PERM = int(os.getenv("DEDUP_NUM_PERM", "128"))
+DEDUP_SHINGLE_WORDS = int(os.getenv("DEDUP_SHINGLE_WORDS", "5"))
+
+# Document collections: each has its own folder under DATA_PATH, its own manifest and indexes
+# under COLLECTIONS_STATE_PATH, and its own Pinecone namespace. DEFAULT_COLLECTION keeps the
+# original paths and the default namespace
+DEFAULT_COLLECTION = os.getenv("DEFAULT_COLLECTION", "default")
+COLLECTIONS_STATE_PATH = "vectorestore/collections"
+
+# Outbound calls to Groq, Google embeddings, Pinecone and Mongo: pooled connections, a deadline
+# per call (seconds), jittered retries within it, and a circuit breaker per dependency that
+# fails fast after CIRCUIT_FAILURE_THRESHOLD consecutive failures, for CIRCUIT_RESET_TIMEOUT seconds
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", "30"))
+EMBEDDING_TIMEOUT = float(os.getenv("EMBEDDING_TIMEOUT", "10"))
+# Ingestion's embed_documents() batches, with a breaker of their own so slow bulk requests
+# can't open the circuit that query embeddings go through
+EMBEDDING_BULK_TIMEOUT = float(os.getenv("EMBEDDING_BULK_TIMEOUT", "60"))
+PINECONE_TIMEOUT = float(os.getenv("PINECONE_TIMEOUT", "5"))
+MONGO_TIMEOUT = float(os.getenv("MONGO_TIMEOUT", "5"))
+OUTBOUND_MAX_RETRIES = int(os.getenv("OUTBOUND_MAX_RETRIES", "2"))
+OUTBOUND_BACKOFF_BASE = float(os.getenv("OUTBOUND_BACKOFF_BASE", "0.1"))
+OUTBOUND_BACKOFF_MAX = float(os.getenv("OUTBOUND_BACKOFF_MAX", "2.0"))
+OUTBOUND_MAX_WORKERS = int(os.getenv("OUTBOUND_MAX_WORKERS", "32"))
+CIRCUIT_FAILURE_THRESHOLD = int(os.getenv("CIRCUIT_FAILURE_THRESHOLD", "5"))
+CIRCUIT_RESET_TIMEOUT = float(os.getenv("CIRCUIT_RESET_TIMEOUT", "30"))
+# Idempotent calls (embeddings, vector queries) still running after the p95 latency, and at
+# least HEDGE_MIN_DELAY seconds, are sent a second time; the first answer wins
+HEDGING_ENABLED = os.getenv("HEDGING_ENABLED", "false").lower() == "true"
+HEDGE_MIN_DELAY = float(os.getenv("HEDGE_MIN_DELAY", "0.05"))
+HTTP_POOL_MAX_CONNECTIONS = int(os.getenv("HTTP_POOL_MAX_CONNECTIONS", "100"))
+HTTP_POOL_MAX_KEEPALIVE = int(os.getenv("HTTP_POOL_MAX_KEEPALIVE", "20"))
+PINECONE_POOL_THREADS = int(os.getenv("PINECONE_POOL_THREADS", "8"))
+# Threads the async app runs Pinecone queries on; more concurrent searches than this wait in line
+PINECONE_QUERY_THREADS = int(os.getenv("PINECONE_QUERY_THREADS", "16"))
+MONGO_MAX_POOL_SIZE = int(os.getenv("MONGO_MAX_POOL_SIZE", "50"))
+
+# Request coalescing: query embeddings requested within QUERY_BATCH_WINDOW seconds of each other
+# go upstream as one batch of at most QUERY_BATCH_MAX_SIZE texts, and identical questions asked
+# while one is being answered share that answer instead of a completion of their own
+QUERY_BATCHING_ENABLED = os.getenv("QUERY_BATCHING_ENABLED", "true").lower() == "true"
+QUERY_BATCH_WINDOW = float(os.getenv("QUERY_BATCH_WINDOW", "0.005"))
+QUERY_BATCH_MAX_SIZE = int(os.getenv("QUERY_BATCH_MAX_SIZE", "32"))
+ANSWER_SINGLE_FLIGHT_ENABLED = os.getenv("ANSWER_SINGLE_FLIGHT_ENABLED", "true").lower() == "true"
@@ -0,0 +1,200 @@
+"""Helpers shared by the Flask app (application.py) and the async one (asgi_application.py)."""
+import json
+import os
+from uuid import uuid4
+
+from itsdangerous import BadSignature, URLSafeSerializer
+from markupsafe import Markup
+from werkzeug.datastructures import CallbackDict
+
+from app.components.collections import get_collection, list_collections, resolve_collections
+from app.components.session_store import compact_messages, expand_messages, valid_session_id
+from app.config.config import DEFAULT_COLLECTION
+from app.common.logger import get_logger
+from app.common.metrics import span
+
+logger = get_logger(__name__)
+
+ALLOWED_EXTENSIONS = {'pdf'}
+
+
+def secret_key():
+    """FLASK_SECRET_KEY, or a random key that only this process can verify sessions with."""
+    key = os.environ.get("FLASK_SECRET_KEY")
+    if not key:
+        logger.warning("FLASK_SECRET_KEY is not set; using a random key, so session cookies won't survive "
+                       "a restart or work across workers")
+        key = os.urandom(24)
+    return key
+
+
+def allowed_file(filename):
+    """Checks if a file has a PDF extension."""
+    return '.' in filename and \
+           filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
+
+
+def list_uploaded_files(folder):
+    """Get list of uploaded files with their info"""
+    files = []
+    if os.path.exists(folder):
+        for filename in os.listdir(folder):
+            if allowed_file(filename):
+                filepath = os.path.join(folder, filename)
+                file_size = os.path.getsize(filepath)
+                # Convert bytes to human readable format
+                if file_size < 1024:
+                    size_str = f"{file_size} B"
+                elif file_size < 1024*1024:
+                    size_str = f"{file_size/1024:.1f} KB"
+                else:
+                    size_str = f"{file_size/(1024*1024):.1f} MB"
+
+                files.append({
+                    'filename': filename,
+                    'size': size_str
+                })
+    return files
+
+
+def session_collection(session):
+    """The collection the session works in, DEFAULT_COLLECTION until one is chosen."""
+    name = session.get("collection")
+    return name if name and name in list_collections() else DEFAULT_COLLECTION
+
+
+def _field(sources, *names):
+    """The first non-empty value of names in the first source (form, JSON body, query string) that has one."""
+    for source in sources:
+        # A JSON body can be a list or a string
+        if not hasattr(source, "get"):
+            continue
+        for name in names:
+            if source.get(name):
+                return source.get(name)
+    return None
+
+
+def target_collection(session, *sources):
+    """
+    The Collection an upload or removal goes to: "collection" from the request sources, else
+    the session's collection. Raises ValueError for an invalid name.
+    """
+    return get_collection(_field(sources, "collection") or session_collection(session))
+
+
+def searched_collections(session, *sources):
+    """
+    The collections a question searches: "collections" (names, comma-separated names, or "*"
+    for every collection) or "collection" from the request sources, else only the session's
+    collection. Raises ValueError for an invalid or unknown collection.
+    """
+    value = _field(sources, "collections", "collection")
+    if not value:
+        return (session_collection(session),)
+    scope = resolve_collections(value)
+    unknown = sorted(set(scope) - set(list_collections()))
+    if unknown:
+        raise ValueError(f"Unknown collection: {', '.join(unknown)}")
+    return scope
+
+
+def nl2br(value):
+    return Markup(value.replace('\n', '\n'))
+
+
+def format_source_info(metadata):
+    """User-friendly source line for the chat, e.g. 'Source: book.pdf, Page: 3'."""
+    source = metadata.get('source', 'N/A')
+    page = metadata.get('page', 'N/A')
+    source_filename = os.path.basename(source) # Gets just the filename
+    return f"Source: {source_filename}, Page: {page}"
+
+
+def sse(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+class ServerSession(CallbackDict):
+    """Session data kept in a session store; the chat history is stored next to it, not in here."""
+
+    def __init__(self, sid, initial=None, new=False):
+        def on_update(session):
+            session.modified = True
+        super().__init__(initial, on_update)
+        self.sid = sid
+        self.new = new
+        self.modified = False
+        # A browser-session cookie, as with Flask's default cookie session
+        self.permanent = False
+        self.accessed = True
+
+
+class ServerSessionMixin:
+    """
+    The cookie carries only the signed session ID. Mixed into Flask's and Quart's
+    SessionInterface, which provide the get_cookie_* settings.
+    """
+
+    salt = "server-session"
+
+    def __init__(self, store):
+        self.store = store
+
+    def _serializer(self, app):
+        if not app.secret_key:
+            return None
+        return URLSafeSerializer(app.secret_key, salt=self.salt)
+
+    def _open(self, app, request):
+        serializer = self._serializer(app)
+        if serializer is None:
+            return None
+        cookie = request.cookies.get(self.get_cookie_name(app))
+        if cookie:
+            try:
+                sid = serializer.loads(cookie)
+            except BadSignature:
+                sid = None
+            if valid_session_id(sid):
+                with span("session_load"):
+                    data = self.store.load(sid)
+                if data is not None:
+                    return ServerSession(sid, data)
+        return ServerSession(uuid4().hex, new=True)
+
+    def _save(self, app, session, response):
+        response.vary.add("Cookie")
+        if not session.modified:
+            return
+        with span("session_save"):
+            self.store.save(session.sid, dict(session))
+        if session.new:
+            response.set_cookie(
+                self.get_cookie_name(app),
+                self._serializer(app).dumps(session.sid),
+                expires=self.get_expiration_time(app, session),
+                httponly=self.get_cookie_httponly(app),
+                domain=self.get_cookie_domain(app),
+                path=self.get_cookie_path(app),
+                secure=self.get_cookie_secure(app),
+                samesite=self.get_cookie_samesite(app),
+            )
+
+
+def chat_history(store, session):
+    """The session's chat messages as {"role", "content"} dicts, oldest first."""
+    with span("chat_history_load"):
+        return expand_messages(store.messages(session.sid))
+
+
+def add_chat_messages(store, session, messages):
+    """Appends messages to the session's chat history; only the new ones are written."""
+    with span("chat_history_append"):
+        store.append(session.sid, compact_messages(messages))
+    # Makes sure a new session's ID reaches the browser
+    session.modified = True
+
+
+def clear_chat_history(store, session):
+    store.clear_messages(session.sid)